@@ -1,7 +1,10 @@
 from fastapi import APIRouter
-from app.api.endpoints import customer, account, transfer
+from app.api.endpoints import customer, account, transfer, recurring_transfer, export, diagnostics
 
 api_router = APIRouter()
 api_router.include_router(customer.router, prefix="/customers", tags=["customers"])
 api_router.include_router(account.router, prefix="/accounts", tags=["accounts"])
-api_router.include_router(transfer.router, prefix="/transfers", tags=["transfers"])
\ No newline at end of file
+api_router.include_router(transfer.router, prefix="/transfers", tags=["transfers"])
+api_router.include_router(recurring_transfer.router, prefix="/recurring-transfers", tags=["recurring transfers"])
+api_router.include_router(export.router, prefix="/exports", tags=["exports"])
+api_router.include_router(diagnostics.router, prefix="/diagnostics", tags=["diagnostics"])
\ No newline at end of file
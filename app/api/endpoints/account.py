@@ -1,31 +1,104 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Response
 from sqlalchemy.orm import Session
 from app.crud import account as account_crud
-from app.schemas.schemas import AccountCreate, Account
+from app.crud import analytics as analytics_crud
+from app.crud import balance_checkpoint as balance_checkpoint_crud
+from app.schemas.schemas import AccountCreate, Account, Counterparty, FlowGraph
 from app.database import get_db
-from typing import Dict
+from datetime import datetime
+from typing import Dict, List, Literal, Optional
+from uuid import UUID
 
 router = APIRouter()
 
 
+def _etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Check an If-None-Match header against an ETag using weak comparison (RFC 9110, 13.1.2).
+    """
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in [tag.removeprefix("W/") for tag in candidates]
+
+
+def _not_modified(db: Session, account_id: UUID, if_none_match: Optional[str]) -> Optional[Response]:
+    """
+    Return a 304 response if the client already holds the current version of the account.
+    Only the version column is read, so a revalidation never loads the full row.
+    """
+    if not if_none_match:
+        return None
+    version = account_crud.get_account_version(db, account_id=account_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Account not found")
+    etag = _etag(version)
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
+
+
 @router.post("/", response_model=Account)
 def create_account(account: AccountCreate, db: Session = Depends(get_db)) -> Account:
     return account_crud.create_account(db=db, account=account)
 
 
 @router.get("/{account_id}", response_model=Account)
-def read_account(account_id: int, db: Session = Depends(get_db)) -> Account:
+def read_account(account_id: UUID, response: Response, db: Session = Depends(get_db),
+                 if_none_match: Optional[str] = Header(None)) -> Account:
+    not_modified = _not_modified(db, account_id, if_none_match)
+    if not_modified is not None:
+        return not_modified
     db_account = account_crud.get_account(db, account_id=account_id)
     if db_account is None:
         raise HTTPException(status_code=404, detail="Account not found")
+    response.headers["ETag"] = _etag(db_account.version)
     return db_account
 
 
 @router.get("/{account_id}/balance", response_model=Dict[str, float])
-def get_account_balance(account_id: int, db: Session = Depends(get_db)) -> Dict[str, float]:
-    balance = account_crud.get_account_balance(db, account_id=account_id)
-    if balance is None:
+def get_account_balance(account_id: UUID, response: Response, db: Session = Depends(get_db),
+                        if_none_match: Optional[str] = Header(None),
+                        as_of: Optional[datetime] = None) -> Dict[str, float]:
+    if as_of is not None:
+        # The ledger balance at a past point in time, from the nearest balance checkpoint
+        balance = balance_checkpoint_crud.get_balance_as_of(db, account_id=account_id, as_of=as_of)
+        if balance is None:
+            raise HTTPException(status_code=404, detail="Account not found")
+        return {"balance": float(balance)}
+    not_modified = _not_modified(db, account_id, if_none_match)
+    if not_modified is not None:
+        return not_modified
+    db_account = account_crud.get_account(db, account_id=account_id)
+    if db_account is None:
+        raise HTTPException(status_code=404, detail="Account not found")
+    response.headers["ETag"] = _etag(db_account.version)
+    return {"balance": float(db_account.balance)}
+
+
+@router.get("/{account_id}/counterparties", response_model=List[Counterparty])
+def get_account_counterparties(account_id: UUID, db: Session = Depends(get_db),
+                               order_by: Literal["volume", "count"] = "volume",
+                               limit: int = Query(10, ge=1, le=100)) -> List[Counterparty]:
+    counterparties = analytics_crud.get_counterparties(db, account_id=account_id, order_by=order_by, limit=limit)
+    if counterparties is None:
+        raise HTTPException(status_code=404, detail="Account not found")
+    return counterparties
+
+
+@router.get("/{account_id}/flows", response_model=FlowGraph)
+def get_account_flows(account_id: UUID, db: Session = Depends(get_db),
+                      depth: int = Query(2, ge=1, le=4),
+                      direction: Literal["out", "in"] = "out",
+                      max_edges: int = Query(500, ge=1, le=5000)) -> FlowGraph:
+    graph = analytics_crud.get_flow_graph(db, account_id=account_id, depth=depth, direction=direction,
+                                          max_edges=max_edges)
+    if graph is None:
         raise HTTPException(status_code=404, detail="Account not found")
-    return {"balance": float(balance)}
+    return graph
 
 # Add other endpoint functions as needed
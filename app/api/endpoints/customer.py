@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from app.crud import customer as customer_crud
 from app.schemas.schemas import CustomerCreate, Customer
 from app.database import get_db
+from uuid import UUID
 
 router = APIRouter()
 
@@ -13,7 +14,7 @@ def create_customer(customer: CustomerCreate, db: Session = Depends(get_db)) ->
 
 
 @router.get("/{customer_id}", response_model=Customer)
-def read_customer(customer_id: int, db: Session = Depends(get_db)) -> Customer:
+def read_customer(customer_id: UUID, db: Session = Depends(get_db)) -> Customer:
     db_customer = customer_crud.get_customer(db, customer_id=customer_id)
     if db_customer is None:
         raise HTTPException(status_code=404, detail="Customer not found")
@@ -0,0 +1,34 @@
+import os
+from fastapi import APIRouter, HTTPException, Query, Response
+from app import database, slow_queries
+from app.crud import unit_of_work
+from app.crud.outbox import get_outbox_backlog
+from app.schemas.schemas import OutboxBacklog, SlowQuery
+from typing import Dict, List
+
+router = APIRouter()
+
+
+@router.get("/slow-queries", response_model=List[SlowQuery])
+def read_slow_queries(limit: int = Query(50, ge=1, le=1000)) -> List[SlowQuery]:
+    if slow_queries.log.threshold_ms <= 0:
+        raise HTTPException(status_code=404, detail="Slow-query log is disabled; set SLOW_QUERY_MS to enable it")
+    return slow_queries.log.entries(limit)
+
+
+@router.get("/transactions", response_model=Dict[str, Dict[str, int]])
+def read_transaction_metrics(response: Response) -> Dict[str, Dict[str, int]]:
+    # The counters are kept per process, so with several server workers every response holds the
+    # counts of the worker that served it; the header tells the workers apart
+    response.headers["X-Worker-PID"] = str(os.getpid())
+    return unit_of_work.metrics.snapshot()
+
+
+@router.get("/outbox", response_model=Dict[str, OutboxBacklog])
+def read_outbox_backlog() -> Dict[str, OutboxBacklog]:
+    # Cross-shard transfers debited but not credited yet, per shard of their sender
+    backlog = {}
+    for shard in database.engines:
+        with database.SessionLocal(shard=shard) as db:
+            backlog[shard] = get_outbox_backlog(db)
+    return backlog
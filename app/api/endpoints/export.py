@@ -0,0 +1,50 @@
+import os
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+from sqlalchemy.orm import Session
+from app.crud import export_job as export_job_crud
+from app.jobs import export as export_jobs
+from app.schemas.schemas import ExportJobCreate, ExportJob
+from app.database import get_db
+from uuid import UUID
+
+router = APIRouter()
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+@router.post("/", response_model=ExportJob, status_code=202)
+def create_export_job(export_job: ExportJobCreate, db: Session = Depends(get_db)) -> ExportJob:
+    if not export_jobs.format_available(export_job.format):
+        raise HTTPException(status_code=400, detail=f"{export_job.format} export is not available on this server")
+    db_export_job = export_job_crud.create_export_job(db=db, export_job=export_job)
+    export_jobs.submit(db_export_job.id)
+    return db_export_job
+
+
+@router.get("/{export_job_id}", response_model=ExportJob)
+def read_export_job(export_job_id: UUID, db: Session = Depends(get_db)) -> ExportJob:
+    db_export_job = export_job_crud.get_export_job(db, export_job_id=export_job_id)
+    if db_export_job is None:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return db_export_job
+
+
+@router.get("/{export_job_id}/download")
+def download_export(export_job_id: UUID, db: Session = Depends(get_db)) -> FileResponse:
+    db_export_job = export_job_crud.get_export_job(db, export_job_id=export_job_id)
+    if db_export_job is None:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    if db_export_job.status != "completed":
+        raise HTTPException(status_code=409, detail=f"Export job is {db_export_job.status}")
+    if not os.path.exists(db_export_job.path):
+        raise HTTPException(status_code=410, detail="Export file is no longer available")
+    return FileResponse(
+        db_export_job.path,
+        media_type=MEDIA_TYPES[db_export_job.format],
+        filename=os.path.basename(db_export_job.path),
+    )
@@ -0,0 +1,27 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from app.crud import recurring_transfer as recurring_transfer_crud
+from app.schemas.schemas import RecurringTransferCreate, RecurringTransfer
+from app.database import get_db
+from uuid import UUID
+
+router = APIRouter()
+
+
+@router.post("/", response_model=RecurringTransfer)
+def create_recurring_transfer(recurring_transfer: RecurringTransferCreate,
+                              db: Session = Depends(get_db)) -> RecurringTransfer:
+    return recurring_transfer_crud.create_recurring_transfer(db=db, recurring_transfer=recurring_transfer)
+
+
+@router.get("/{recurring_transfer_id}", response_model=RecurringTransfer)
+def read_recurring_transfer(recurring_transfer_id: UUID, db: Session = Depends(get_db)) -> RecurringTransfer:
+    db_recurring_transfer = recurring_transfer_crud.get_recurring_transfer(db, recurring_transfer_id=recurring_transfer_id)
+    if db_recurring_transfer is None:
+        raise HTTPException(status_code=404, detail="Recurring transfer not found")
+    return db_recurring_transfer
+
+
+@router.delete("/{recurring_transfer_id}", response_model=RecurringTransfer)
+def cancel_recurring_transfer(recurring_transfer_id: UUID, db: Session = Depends(get_db)) -> RecurringTransfer:
+    return recurring_transfer_crud.cancel_recurring_transfer(db, recurring_transfer_id=recurring_transfer_id)
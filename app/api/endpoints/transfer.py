@@ -15,7 +15,7 @@ def create_transfer(transfer: TransferCreate, db: Session = Depends(get_db)) ->
 
 
 @router.get("/{transfer_id}", response_model=Transfer)
-def read_transfer(transfer_id: int, db: Session = Depends(get_db)) -> Transfer:
+def read_transfer(transfer_id: UUID, db: Session = Depends(get_db)) -> Transfer:
     db_transfer = transfer_crud.get_transfer(db, transfer_id=transfer_id)
     if db_transfer is None:
         raise HTTPException(status_code=404, detail="Transfer not found")
@@ -1,20 +1,50 @@
 from fastapi import HTTPException
+from sqlalchemy import func, update
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import Session
-from app.models.models import Account
+from app.crud.routing import find, route
+from app.crud.unit_of_work import retryable_error, run_in_transaction
+from app.ids import uuid7
+from app.models.models import Account, Customer
 from app.schemas.schemas import AccountCreate
+from app.sharding import slot_of
 from decimal import Decimal
 
 
 def create_account(db: Session, account: AccountCreate) -> Account:
-    db_account = Account(customer_id=account.customer_id, balance=Decimal(str(account.balance)))
-    db.add(db_account)
-    db.commit()
-    db.refresh(db_account)
-    return db_account
+    # Accounts live on the shard of their customer and carry its slot in their ID
+    if not route(db, Customer, account.customer_id):
+        raise HTTPException(status_code=404, detail="Customer not found")
+
+    def insert(db: Session) -> Account:
+        db_account = Account(id=uuid7(slot_of(account.customer_id)), customer_id=account.customer_id,
+                             balance=account.balance)
+        db.add(db_account)
+        return db_account
+
+    # Every column value is generated client-side, so the INSERT is the only statement and the
+    # new account does not need to be reloaded after commit
+    return run_in_transaction(db, insert, operation="create_account", expire_on_commit=False)
 
 
 def get_account(db: Session, account_id: int) -> Account:
-    return db.query(Account).filter(Account.id == account_id).first()
+    return find(db, account_id, lambda db: db.query(Account).filter(Account.id == account_id).first())
+
+
+def accounts_exist(db: Session, account_ids) -> bool:
+    """
+    Check that all of the given accounts exist on the current shard, in one query and without
+    loading them.
+
+    Args:
+        db (Session): The database session.
+        account_ids (Iterable[UUID]): The IDs of the accounts.
+
+    Returns:
+        bool: Whether every account exists.
+    """
+    account_ids = set(account_ids)
+    return db.query(func.count(Account.id)).filter(Account.id.in_(account_ids)).scalar() == len(account_ids)
 
 
 def get_account_balance(db: Session, account_id: int) -> Decimal:
@@ -22,7 +52,21 @@ def get_account_balance(db: Session, account_id: int) -> Decimal:
     return account.balance if account else None
 
 
-def update_account_balance(db: Session, account_id: int, amount: Decimal) -> Account:
+def get_account_version(db: Session, account_id: int) -> int:
+    """
+    Get the current version of an account without loading the rest of the row.
+
+    Args:
+        db (Session): The database session.
+        account_id (int): The ID of the account.
+
+    Returns:
+        int: The account version, or None if the account does not exist.
+    """
+    return find(db, account_id, lambda db: db.query(Account.version).filter(Account.id == account_id).scalar())
+
+
+def update_account_balance(db: Session, account_id: int, amount: Decimal, commit: bool = True) -> Account:
     """
     Update the balance of an account by a specified amount.
 
@@ -30,20 +74,52 @@ def update_account_balance(db: Session, account_id: int, amount: Decimal) -> Acc
         db (Session): The database session.
         account_id (int): The ID of the account to update.
         amount (Decimal): The amount to update the balance by. Can be positive or negative.
+        commit (bool): Apply the change in a transaction of its own, retried on serialization failures and
+            deadlocks (see app.crud.unit_of_work). Pass False to leave the change pending in the caller's transaction.
 
     Returns:
         Account: The updated account.
 
     Raises:
-        HTTPException: If the account is not found.
+        HTTPException: If the account is not found, or if it was modified concurrently and the
+            change could not be applied within the retry budget of the unit of work.
     """
-    account = get_account(db, account_id)
+    if commit:
+        if not route(db, Account, account_id):
+            raise HTTPException(status_code=404, detail="Account not found")
+        try:
+            account = run_in_transaction(
+                db, lambda db: _increment_balance(db, account_id, amount),
+                operation="update_account_balance", expire_on_commit=False,
+            )
+        except DBAPIError as e:
+            if retryable_error(e) is None:
+                raise
+            raise HTTPException(status_code=409, detail="Account was modified concurrently")
+        if account is None:
+            raise HTTPException(status_code=404, detail="Account not found")
+        return account
+
+    # The caller has usually loaded the account already, in which case it comes from the
+    # identity map without another SELECT
+    account = db.get(Account, account_id)
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
 
     account.balance += amount
-    db.commit()
-    db.refresh(account)
     return account
 
+
+def _increment_balance(db: Session, account_id, amount: Decimal) -> Account:
+    # A single UPDATE ... RETURNING instead of a SELECT followed by a versioned UPDATE. The
+    # increment is applied to the row as it is at write time, so there is no lost update to
+    # detect; the version is still bumped so that ETags change.
+    return db.execute(
+        update(Account)
+        .where(Account.id == account_id)
+        .values(balance=Account.balance + amount, version=Account.version + 1)
+        .returning(Account)
+        .execution_options(populate_existing=True)
+    ).scalar_one_or_none()
+
 # Add other CRUD operations as needed
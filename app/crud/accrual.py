@@ -0,0 +1,213 @@
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import Optional
+from uuid import UUID
+from sqlalchemy import BigInteger, DateTime, Numeric, bindparam, case, cast, func, insert, literal, select, update
+from sqlalchemy.dialects.postgresql import ARRAY, UUID as PostgresUUID, insert as pg_insert
+from sqlalchemy.orm import Session
+from app import money
+from app.crud.account import accounts_exist
+from app.ids import uuid7
+from app.models.models import Account, AccrualRun, Transfer, TransferEdge
+from app.money import Money
+from app.sharding import slot_of
+
+
+def _minor_units(amount):
+    """
+    SQL expression for a money column or value in minor units of the currency.
+    """
+    if money.MONEY_STORAGE == money.INT64:
+        return amount
+    return amount * 10 ** money.MINOR_UNIT_SCALE
+
+
+def _from_minor_units(units):
+    """
+    SQL expression for an amount in minor units as a value of a money column.
+    """
+    if money.MONEY_STORAGE == money.INT64:
+        return units
+    return cast(units, Numeric()) / 10 ** money.MINOR_UNIT_SCALE
+
+
+def _amount(units: int) -> Decimal:
+    return money.from_minor_units(units, money.MINOR_UNIT_SCALE)
+
+
+def _unnest(name: str, **columns):
+    """
+    Table of parallel arrays, each sent as a single array parameter.
+
+    The statement stays the same size whatever the number of rows, so it is neither compiled
+    nor parsed row by row.
+    """
+    arrays = []
+    for column_name, (item_type, items) in columns.items():
+        array_type = ARRAY(item_type)
+        arrays.append(cast(bindparam(f"{name}_{column_name}", items, type_=array_type), array_type))
+    return func.unnest(*arrays).table_valued(*columns).render_derived(name=name)
+
+
+def start_accrual_run(db: Session, business_date: date, annual_rate: Decimal, fee: Decimal,
+                      interest_account_id: UUID, fee_account_id: UUID,
+                      fee_waiver_balance: Optional[Decimal] = None, day_count: int = 365) -> AccrualRun:
+    """
+    Create the accrual run of a business date, or return the existing one to resume it.
+
+    Args:
+        db (Session): The database session.
+        business_date (date): The date the interest and fees are posted for.
+        annual_rate (Decimal): Annual interest rate, e.g. Decimal("0.02") for 2%.
+        fee (Decimal): Fee charged to every account.
+        interest_account_id (UUID): The account interest is paid from.
+        fee_account_id (UUID): The account fees are paid to.
+        fee_waiver_balance (Decimal): Accounts with at least this balance pay no fee.
+        day_count (int): Days per year the annual rate is divided by.
+
+    Returns:
+        AccrualRun: The run.
+
+    Raises:
+        ValueError: If an internal account does not exist, or if a run for the date already
+            exists with different parameters.
+    """
+    if not accounts_exist(db, [interest_account_id, fee_account_id]):
+        raise ValueError("The interest and fee accounts must exist")
+    parameters = {
+        "annual_rate": Decimal(annual_rate),
+        "day_count": day_count,
+        "fee": Decimal(fee),
+        "fee_waiver_balance": None if fee_waiver_balance is None else Decimal(fee_waiver_balance),
+        "interest_account_id": interest_account_id,
+        "fee_account_id": fee_account_id,
+    }
+    run = db.get(AccrualRun, business_date)
+    if run is None:
+        run = AccrualRun(business_date=business_date, **parameters)
+        db.add(run)
+        db.commit()
+        return run
+    if any(getattr(run, name) != value for name, value in parameters.items()):
+        raise ValueError(f"The accrual run of {business_date} was started with different parameters")
+    return run
+
+
+def post_accrual_chunk(db: Session, business_date: date, chunk_size: int) -> int:
+    """
+    Post the interest and fees of the next chunk of accounts of a run and advance its checkpoint.
+
+    The postings of the whole chunk are computed by one set-based query in exact NUMERIC
+    arithmetic and in minor units: interest is rounded down to the minor unit and fees never take
+    a balance below zero. They are then written with one bulk INSERT of transfers, one bulk UPDATE
+    of account balances and one bulk upsert of transfer summaries, each taking its rows as array
+    parameters. The caller commits, and the checkpoint commits with the postings.
+
+    Args:
+        db (Session): The database session.
+        business_date (date): The date of the run.
+        chunk_size (int): Maximum number of accounts processed.
+
+    Returns:
+        int: The number of accounts processed; fewer than `chunk_size` once the run is complete.
+    """
+    # Lock the run, so that two jobs started for the same date process chunks one after the other
+    run = db.get(AccrualRun, business_date, with_for_update=True)
+    if run.status == "completed":
+        return 0
+
+    balance = _minor_units(Account.balance)
+    interest = case(
+        (Account.balance > 0, func.floor(balance * literal(run.annual_rate, Numeric()) / run.day_count)),
+        else_=0,
+    )
+    fee = func.least(_minor_units(literal(run.fee, Money())), func.greatest(func.floor(balance) + interest, 0))
+    if run.fee_waiver_balance is not None:
+        fee = case((Account.balance >= literal(run.fee_waiver_balance, Money()), 0), else_=fee)
+    query = (
+        select(Account.id, interest, fee)
+        .where(Account.id.notin_([run.interest_account_id, run.fee_account_id]))
+        .order_by(Account.id)
+        .limit(chunk_size)
+        .with_for_update()
+    )
+    if run.last_account_id is not None:
+        query = query.where(Account.id > run.last_account_id)
+    rows = db.execute(query).all()
+
+    now = datetime.now(timezone.utc)
+    transfers, deltas, edges = [], {}, []
+    interest_total = fee_total = 0
+    interest_postings = fee_postings = 0
+    for account_id, interest_units, fee_units in rows:
+        interest_units, fee_units = int(interest_units), int(fee_units)
+        if interest_units > 0:
+            transfers.append((run.interest_account_id, account_id, interest_units))
+            interest_total += interest_units
+            interest_postings += 1
+        if fee_units > 0:
+            transfers.append((account_id, run.fee_account_id, fee_units))
+            fee_total += fee_units
+            fee_postings += 1
+        if interest_units != fee_units:
+            deltas[account_id] = interest_units - fee_units
+
+    if transfers:
+        if interest_total:
+            deltas[run.interest_account_id] = -interest_total
+        if fee_total:
+            deltas[run.fee_account_id] = deltas.get(run.fee_account_id, 0) + fee_total
+
+        uuid_type = PostgresUUID(as_uuid=True)
+        postings = _unnest(
+            "postings",
+            id=(uuid_type, [uuid7(slot_of(from_id)) for from_id, _, _ in transfers]),
+            from_account_id=(uuid_type, [from_id for from_id, _, _ in transfers]),
+            to_account_id=(uuid_type, [to_id for _, to_id, _ in transfers]),
+            units=(BigInteger(), [units for _, _, units in transfers]),
+        )
+        timestamp = literal(now, DateTime(timezone=True))
+        db.execute(insert(Transfer.__table__).from_select(
+            ["id", "from_account_id", "to_account_id", "amount", "timestamp"],
+            select(postings.c.id, postings.c.from_account_id, postings.c.to_account_id,
+                   _from_minor_units(postings.c.units), timestamp),
+        ))
+
+        changes = _unnest(
+            "changes",
+            id=(uuid_type, list(deltas)),
+            units=(BigInteger(), list(deltas.values())),
+        )
+        db.execute(
+            update(Account.__table__)
+            .where(Account.id == changes.c.id)
+            .values(balance=Account.balance + _from_minor_units(changes.c.units),
+                    version=Account.version + 1, updated_at=now)
+        )
+
+        # Every account appears at most once per chunk, so every pair of accounts does too
+        upsert = pg_insert(TransferEdge.__table__).from_select(
+            ["from_account_id", "to_account_id", "transfer_count", "total_amount", "last_transfer_at"],
+            select(postings.c.from_account_id, postings.c.to_account_id, literal(1),
+                   _from_minor_units(postings.c.units), timestamp),
+        )
+        db.execute(upsert.on_conflict_do_update(
+            index_elements=[TransferEdge.from_account_id, TransferEdge.to_account_id],
+            set_={
+                "transfer_count": TransferEdge.transfer_count + 1,
+                "total_amount": TransferEdge.total_amount + upsert.excluded.total_amount,
+                "last_transfer_at": func.greatest(TransferEdge.last_transfer_at, upsert.excluded.last_transfer_at),
+            },
+        ))
+
+    run.accounts += len(rows)
+    run.interest_postings += interest_postings
+    run.fee_postings += fee_postings
+    run.interest_total += _amount(interest_total)
+    run.fee_total += _amount(fee_total)
+    if rows:
+        run.last_account_id = rows[-1][0]
+    if len(rows) < chunk_size:
+        run.status = "completed"
+        run.finished_at = now
+    return len(rows)
@@ -0,0 +1,260 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+from uuid import UUID
+from sqlalchemy import func, literal_column, select, type_coerce, union_all
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app.crud.routing import route
+from app.models.models import Account, Transfer, TransferEdge
+from app.money import Money
+
+ANALYTICS_CACHE_SIZE = int(os.getenv("ANALYTICS_CACHE_SIZE", "1024"))
+
+
+class _AnalyticsCache:
+    """
+    LRU cache of analytics results, validated against account versions.
+
+    Every transfer bumps the version of both of its accounts, so a result stays valid for as long
+    as the accounts whose edges it was computed from keep the versions they had when it was
+    computed. Checking that takes a single primary key lookup, and because the versions live in
+    the database, a transfer made through any server process invalidates the entry in all of them.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._entries: "OrderedDict[tuple, tuple[dict[UUID, int], object]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, db: Session, key: tuple):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        versions, result = entry
+        if _account_versions(db, versions.keys()) != versions:
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        return result
+
+    def put(self, key: tuple, versions: dict[UUID, int], result) -> None:
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (versions, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+cache = _AnalyticsCache(ANALYTICS_CACHE_SIZE)
+
+
+def _account_versions(db: Session, account_ids) -> dict[UUID, int]:
+    rows = db.query(Account.id, Account.version).filter(Account.id.in_(list(account_ids))).all()
+    return {account_id: version for account_id, version in rows}
+
+
+def record_transfer_edge(db: Session, transfer: Transfer) -> None:
+    """
+    Add a flushed transfer to the summary of transfers between its two accounts.
+
+    Args:
+        db (Session): The database session holding the transfer.
+        transfer (Transfer): The transfer, already flushed so that its timestamp is set.
+    """
+    stmt = insert(TransferEdge).values(
+        from_account_id=transfer.from_account_id,
+        to_account_id=transfer.to_account_id,
+        transfer_count=1,
+        total_amount=transfer.amount,
+        last_transfer_at=transfer.timestamp,
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[TransferEdge.from_account_id, TransferEdge.to_account_id],
+        set_={
+            "transfer_count": TransferEdge.transfer_count + 1,
+            "total_amount": TransferEdge.total_amount + stmt.excluded.total_amount,
+            "last_transfer_at": func.greatest(TransferEdge.last_transfer_at, stmt.excluded.last_transfer_at),
+        },
+    ))
+
+
+def get_counterparties(db: Session, account_id: UUID, order_by: str = "volume", limit: int = 10) -> Optional[list[dict]]:
+    """
+    Get the top counterparties of an account, with transfers in both directions combined.
+
+    The summaries of all transfers of an account are kept on its shard, including those with
+    accounts on other shards, so this runs on a single shard.
+
+    Args:
+        db (Session): The database session.
+        account_id (UUID): The ID of the account.
+        order_by (str): "volume" to rank by total amount, "count" to rank by number of transfers.
+        limit (int): The maximum number of counterparties returned.
+
+    Returns:
+        list[dict]: The counterparties, best ranked first, or None if the account does not exist.
+    """
+    if not route(db, Account, account_id):
+        return None
+    key = ("counterparties", account_id, order_by, limit)
+    cached = cache.get(db, key)
+    if cached is not None:
+        return cached
+
+    # Read the version before the edges: a transfer committed in between makes the cached
+    # result look stale rather than letting a stale result look current
+    versions = _account_versions(db, [account_id])
+    if not versions:
+        return None
+
+    zero = literal_column("0")
+    sent = select(
+        TransferEdge.to_account_id.label("counterparty"),
+        TransferEdge.transfer_count.label("sent_count"),
+        TransferEdge.total_amount.label("sent_amount"),
+        zero.label("received_count"),
+        zero.label("received_amount"),
+        TransferEdge.last_transfer_at,
+    ).where(TransferEdge.from_account_id == account_id)
+    received = select(
+        TransferEdge.from_account_id,
+        zero,
+        zero,
+        TransferEdge.transfer_count,
+        TransferEdge.total_amount,
+        TransferEdge.last_transfer_at,
+    ).where(TransferEdge.to_account_id == account_id)
+    edges = union_all(sent, received).subquery()
+
+    sent_count = func.sum(edges.c.sent_count)
+    received_count = func.sum(edges.c.received_count)
+    sent_amount = func.sum(edges.c.sent_amount)
+    received_amount = func.sum(edges.c.received_amount)
+    transfer_count = sent_count + received_count
+    total_amount = sent_amount + received_amount
+    rank = transfer_count if order_by == "count" else total_amount
+    rows = db.execute(
+        select(
+            edges.c.counterparty,
+            transfer_count,
+            type_coerce(total_amount, Money()),
+            sent_count,
+            type_coerce(sent_amount, Money()),
+            received_count,
+            type_coerce(received_amount, Money()),
+            func.max(edges.c.last_transfer_at),
+        )
+        .group_by(edges.c.counterparty)
+        .order_by(rank.desc(), edges.c.counterparty)
+        .limit(limit)
+    ).all()
+
+    result = [
+        {
+            "account_id": row[0],
+            "transfer_count": row[1],
+            "total_amount": row[2],
+            "sent_count": row[3],
+            "sent_amount": row[4],
+            "received_count": row[5],
+            "received_amount": row[6],
+            "last_transfer_at": row[7],
+        }
+        for row in rows
+    ]
+    cache.put(key, versions, result)
+    return result
+
+
+def get_flow_graph(db: Session, account_id: UUID, depth: int = 2, direction: str = "out",
+                   max_edges: int = 500) -> Optional[dict]:
+    """
+    Get the accounts money flowed to (or from) an account, up to a number of hops away.
+
+    The graph is expanded breadth first with one query on the transfer summary per hop, so its
+    cost depends on the size of the neighbourhood, not of the transfer history. Accounts reached
+    again at a later hop are not expanded again, so cycles terminate. When the graph grows past
+    `max_edges`, the largest edges of the current hop are kept and the expansion stops.
+
+    The graph is expanded on the shard of the account: edges of accounts on other shards are
+    included up to the first hop that reaches them, but not followed further.
+
+    Args:
+        db (Session): The database session.
+        account_id (UUID): The ID of the account the graph starts from.
+        depth (int): The maximum number of hops followed.
+        direction (str): "out" to follow money sent, "in" to follow money received.
+        max_edges (int): The maximum number of edges returned.
+
+    Returns:
+        dict: The nodes and edges of the graph, or None if the account does not exist.
+    """
+    if not route(db, Account, account_id):
+        return None
+    key = ("flows", account_id, depth, direction, max_edges)
+    cached = cache.get(db, key)
+    if cached is not None:
+        return cached
+
+    if direction == "out":
+        near, far = TransferEdge.from_account_id, TransferEdge.to_account_id
+    else:
+        near, far = TransferEdge.to_account_id, TransferEdge.from_account_id
+
+    versions = _account_versions(db, [account_id])
+    if not versions:
+        return None
+    nodes = {account_id: None}
+    edges = []
+    frontier = [account_id]
+    truncated = False
+    for hop in range(1, depth + 1):
+        if not frontier:
+            break
+        if hop > 1:
+            versions.update(_account_versions(db, frontier))
+        remaining = max_edges - len(edges)
+        rows = db.query(
+            TransferEdge.from_account_id, TransferEdge.to_account_id,
+            TransferEdge.transfer_count, TransferEdge.total_amount, far,
+        ).filter(near.in_(frontier)).order_by(
+            TransferEdge.total_amount.desc(), TransferEdge.from_account_id, TransferEdge.to_account_id,
+        ).limit(remaining + 1).all()
+        if len(rows) > remaining:
+            rows = rows[:remaining]
+            truncated = True
+        frontier = []
+        for from_account_id, to_account_id, transfer_count, total_amount, reached in rows:
+            edges.append({
+                "from_account_id": from_account_id,
+                "to_account_id": to_account_id,
+                "transfer_count": transfer_count,
+                "total_amount": total_amount,
+                "depth": hop,
+            })
+            if reached not in nodes:
+                nodes[reached] = None
+                frontier.append(reached)
+        if truncated:
+            break
+
+    result = {
+        "account_id": account_id,
+        "direction": direction,
+        "depth": depth,
+        "nodes": list(nodes),
+        "edges": edges,
+        "truncated": truncated,
+    }
+    cache.put(key, versions, result)
+    return result
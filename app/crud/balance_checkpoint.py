@@ -0,0 +1,134 @@
+"""
+Point-in-time balances.
+
+The ledger balance of an account as of a time is its opening deposit plus every transfer it
+received up to that time, minus every transfer it sent. Rather than replaying the whole history,
+a balance is computed from the nearest checkpoint at or before the time and the transfers after
+it: one primary key lookup and one index range scan per direction on
+`transfers (to_account_id, timestamp)` and `transfers (from_account_id, timestamp)`. The cost
+depends on the activity since the checkpoint, not on the age of the account.
+
+Checkpoints are written by `python -m app.jobs.checkpoint`.
+"""
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Optional
+from uuid import UUID
+from sqlalchemy import DateTime, cast, func, literal, or_, select, true, type_coerce
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app.crud.routing import route
+from app.models.models import Account, BalanceCheckpoint, Transfer
+from app.money import Money
+
+
+def _utc(value: datetime) -> datetime:
+    # Times without a zone are taken as UTC, like the stored timestamps
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def _balances_as_of(accounts, as_of: datetime):
+    """
+    Select `(id, balance, due)` for the rows of `accounts`, a selectable with the `id` and
+    `initial_balance` of accounts, where `due` is whether the account has no checkpoint yet or
+    transfers since its nearest one.
+    """
+    latest = (
+        select(BalanceCheckpoint.as_of, BalanceCheckpoint.balance)
+        .where(BalanceCheckpoint.account_id == accounts.c.id, BalanceCheckpoint.as_of <= as_of)
+        .order_by(BalanceCheckpoint.as_of.desc())
+        .limit(1)
+        .lateral("latest")
+    )
+    since = func.coalesce(latest.c.as_of, cast(literal("-infinity"), DateTime(timezone=True)))
+
+    def transfers(account_column, name):
+        return (
+            select(func.coalesce(func.sum(Transfer.amount), literal(0, Money())).label("amount"),
+                   func.count().label("count"))
+            .where(account_column == accounts.c.id, Transfer.timestamp > since, Transfer.timestamp <= as_of)
+            .lateral(name)
+        )
+
+    received = transfers(Transfer.to_account_id, "received")
+    sent = transfers(Transfer.from_account_id, "sent")
+    balance = type_coerce(
+        func.coalesce(latest.c.balance, accounts.c.initial_balance) + received.c.amount - sent.c.amount, Money(),
+    )
+    return (
+        select(accounts.c.id, balance.label("balance"),
+               or_(latest.c.as_of.is_(None), received.c.count + sent.c.count > 0).label("due"))
+        .select_from(accounts)
+        .outerjoin(latest, true())
+        .join(received, true())
+        .join(sent, true())
+    )
+
+
+def get_balance_as_of(db: Session, account_id: UUID, as_of: datetime) -> Optional[Decimal]:
+    """
+    Get the ledger balance of an account as of a point in time.
+
+    Before the first transfer of the account this is its opening deposit.
+
+    Args:
+        db (Session): The database session.
+        account_id (UUID): The ID of the account.
+        as_of (datetime): The point in time, inclusive. Times without a zone are taken as UTC.
+
+    Returns:
+        Decimal: The balance, or None if the account does not exist.
+    """
+    if not route(db, Account, account_id):
+        return None
+    accounts = (
+        select(Account.id, Account.initial_balance).where(Account.id == account_id).subquery("accounts")
+    )
+    row = db.execute(_balances_as_of(accounts, _utc(as_of))).first()
+    return row.balance if row is not None else None
+
+
+def write_balance_checkpoints(db: Session, as_of: datetime, after: Optional[UUID] = None,
+                              chunk_size: int = 5000) -> tuple[int, int, Optional[UUID]]:
+    """
+    Write the checkpoints as of a point in time of the next chunk of accounts, in ID order.
+
+    Only accounts with transfers since their nearest earlier checkpoint, or without any
+    checkpoint yet, get one; for the others the earlier checkpoint is just as close. Checkpoints
+    that already exist are kept, so a chunk can be written again. The caller commits.
+
+    Args:
+        db (Session): The database session.
+        as_of (datetime): The time of the checkpoints. Every transfer up to this time must have
+            been committed.
+        after (UUID): The highest account ID of the previous chunk, or None to start.
+        chunk_size (int): Number of accounts per chunk.
+
+    Returns:
+        tuple: The number of accounts in the chunk, the number of checkpoints written and the
+            highest account ID of the chunk.
+    """
+    as_of = _utc(as_of)
+    query = select(Account.id).order_by(Account.id).limit(chunk_size)
+    if after is not None:
+        query = query.where(Account.id > after)
+    account_ids = db.execute(query).scalars().all()
+    if not account_ids:
+        return 0, 0, after
+
+    accounts = (
+        select(Account.id, Account.initial_balance)
+        .where(Account.id >= account_ids[0], Account.id <= account_ids[-1])
+        .subquery("accounts")
+    )
+    balances = _balances_as_of(accounts, as_of).subquery("balances")
+    written = db.execute(
+        insert(BalanceCheckpoint)
+        .from_select(
+            ["account_id", "as_of", "balance"],
+            select(balances.c.id, literal(as_of, DateTime(timezone=True)), balances.c.balance)
+            .where(balances.c.due),
+        )
+        .on_conflict_do_nothing(index_elements=[BalanceCheckpoint.account_id, BalanceCheckpoint.as_of])
+    ).rowcount
+    return len(account_ids), written, account_ids[-1]
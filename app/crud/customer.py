@@ -1,17 +1,27 @@
 from sqlalchemy.orm import Session
+from app import database
+from app.crud.routing import find, use_shard
+from app.crud.unit_of_work import run_in_transaction
+from app.ids import uuid7
 from app.models.models import Customer
 from app.schemas.schemas import CustomerCreate
 
 
 def create_customer(db: Session, customer: CustomerCreate) -> Customer:
-    db_customer = Customer(name=customer.name)
-    db.add(db_customer)
-    db.commit()
-    db.refresh(db_customer)
-    return db_customer
+    # The random bits of a new customer ID are its shard key
+    customer_id = uuid7()
+    use_shard(db, database.shard_map.shard_for(customer_id))
+
+    def insert(db: Session) -> Customer:
+        db_customer = Customer(id=customer_id, name=customer.name)
+        db.add(db_customer)
+        return db_customer
+
+    # The ID is generated client-side, so the new customer does not need to be reloaded after commit
+    return run_in_transaction(db, insert, operation="create_customer", expire_on_commit=False)
 
 
 def get_customer(db: Session, customer_id: int) -> Customer:
-    return db.query(Customer).filter(Customer.id == customer_id).first()
+    return find(db, customer_id, lambda db: db.query(Customer).filter(Customer.id == customer_id).first())
 
 # Add other CRUD operations as needed
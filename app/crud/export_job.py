@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+from app.crud.account import accounts_exist
+from app.crud.routing import find, route
+from app.crud.unit_of_work import run_in_transaction
+from app.ids import uuid7
+from app.models.models import Account, ExportJob
+from app.schemas.schemas import ExportJobCreate
+from app.sharding import slot_of
+
+
+def create_export_job(db: Session, export_job: ExportJobCreate) -> ExportJob:
+    # Export jobs live on the shard of their account
+    if not route(db, Account, export_job.account_id):
+        raise HTTPException(status_code=404, detail="Account not found")
+
+    def insert(db: Session) -> ExportJob:
+        if not accounts_exist(db, [export_job.account_id]):
+            raise HTTPException(status_code=404, detail="Account not found")
+        db_export_job = ExportJob(id=uuid7(slot_of(export_job.account_id)), account_id=export_job.account_id,
+                                  format=export_job.format)
+        db.add(db_export_job)
+        return db_export_job
+
+    return run_in_transaction(db, insert, operation="create_export_job", expire_on_commit=False)
+
+
+def get_export_job(db: Session, export_job_id) -> ExportJob:
+    return find(db, export_job_id, lambda db: db.query(ExportJob).filter(ExportJob.id == export_job_id).first())
+
+
+def claim_export_job(db: Session, export_job_id=None, stale_after: Optional[timedelta] = None) -> Optional[ExportJob]:
+    """
+    Mark a pending export job of the current shard as running and commit, so that no other
+    worker picks it up.
+
+    With `stale_after`, a job that has been running for longer than that is claimed again as
+    well, since the worker running it most likely died.
+
+    Args:
+        db (Session): The database session.
+        export_job_id (UUID): The job to claim. If None, the oldest pending job is claimed.
+        stale_after (timedelta): How long a job may run before it is claimed again. If None,
+            only pending jobs are claimed.
+
+    Returns:
+        ExportJob: The claimed job, or None if there was no such job.
+    """
+    now = datetime.now(timezone.utc)
+    claimable = ExportJob.status == "pending"
+    if stale_after is not None:
+        claimable = or_(claimable, and_(ExportJob.status == "running", ExportJob.started_at < now - stale_after))
+    query = db.query(ExportJob).filter(claimable)
+    if export_job_id is not None:
+        query = query.filter(ExportJob.id == export_job_id)
+    db_export_job = query.order_by(ExportJob.created_at).with_for_update(skip_locked=True).first()
+    if db_export_job is None:
+        db.rollback()
+        return None
+    db_export_job.status = "running"
+    db_export_job.started_at = now
+    db.commit()
+    return db_export_job
+
+
+def finish_export_job(db: Session, db_export_job: ExportJob, rows: int, path: Optional[str] = None,
+                      error: Optional[str] = None) -> ExportJob:
+    db_export_job.rows = rows
+    db_export_job.path = path
+    db_export_job.error = error
+    db_export_job.status = "failed" if error else "completed"
+    db_export_job.finished_at = datetime.now(timezone.utc)
+    db.commit()
+    return db_export_job
@@ -0,0 +1,194 @@
+"""
+Delivery of cross-shard transfers.
+
+A transfer between accounts on different shards cannot commit in one transaction. It runs as a
+saga instead: the debit, the transfer record and an outbox entry commit together on the shard of
+the sender, then the credit is applied on the shard of the recipient and the entry is marked
+delivered. The sender's shard balances at every step, and money in flight is exactly the sum of
+the undelivered entries.
+
+The credit is recorded under the ID of the transfer, so delivering an entry twice, or from two
+processes at once, applies it once. Entries that could not be delivered right after the debit
+are retried by the outbox relay (`python -m app.jobs.outbox`).
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from uuid import UUID
+from fastapi import HTTPException
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app import database
+from app.crud.analytics import record_transfer_edge
+from app.crud.routing import locate
+from app.crud.unit_of_work import run_in_transaction
+from app.models.models import Account, Transfer, TransferOutbox
+
+logger = logging.getLogger(__name__)
+
+# Key of `Session.info` collecting the IDs of the transfers whose credit was staged for delivery
+PENDING_DELIVERIES = "pending_deliveries"
+
+# Retry backoff of a failed delivery: RETRY_BASE_DELAY * 2 ** (attempts - 1), capped at RETRY_MAX_DELAY
+RETRY_BASE_DELAY = timedelta(seconds=5)
+RETRY_MAX_DELAY = timedelta(minutes=10)
+
+
+def _credit(db: Session, transfer, record: bool) -> bool:
+    if record:
+        inserted = db.execute(
+            insert(Transfer.__table__)
+            .values(id=transfer.id, from_account_id=transfer.from_account_id,
+                    to_account_id=transfer.to_account_id, amount=transfer.amount, timestamp=transfer.timestamp)
+            .on_conflict_do_nothing(index_elements=[Transfer.__table__.c.id])
+            .returning(Transfer.__table__.c.id)
+        ).first()
+        if inserted is None:
+            return False
+    credited = db.execute(
+        update(Account)
+        .where(Account.id == transfer.to_account_id)
+        .values(balance=Account.balance + transfer.amount, version=Account.version + 1)
+    ).rowcount
+    if not credited:
+        raise HTTPException(status_code=404, detail="Account not found")
+    if record:
+        record_transfer_edge(db, transfer)
+    return True
+
+
+def _mark_delivered(db: Session, transfer_id: UUID) -> bool:
+    return db.execute(
+        update(TransferOutbox)
+        .where(TransferOutbox.transfer_id == transfer_id, TransferOutbox.delivered_at.is_(None))
+        .values(delivered_at=datetime.now(timezone.utc), last_error=None)
+    ).rowcount == 1
+
+
+def deliver_transfer(shard: str, transfer_id: UUID) -> bool:
+    """
+    Apply the credit of a cross-shard transfer on the shard of its recipient and mark its outbox
+    entry delivered.
+
+    If the two accounts have ended up on the same shard since the debit, after a rebalance, the
+    debit record is the only record of the transfer there, and the credit commits together with
+    the delivery instead.
+
+    Args:
+        shard (str): The shard of the sender, holding the debit and the outbox entry.
+        transfer_id (UUID): The ID of the transfer.
+
+    Returns:
+        bool: Whether this call delivered the entry; False if it was already delivered.
+
+    Raises:
+        HTTPException: If the recipient account does not exist on any shard.
+    """
+    with database.SessionLocal(shard=shard) as db:
+        transfer = db.execute(
+            select(Transfer.id, Transfer.from_account_id, Transfer.to_account_id, Transfer.amount, Transfer.timestamp)
+            .join(TransferOutbox, TransferOutbox.transfer_id == Transfer.id)
+            .where(Transfer.id == transfer_id, TransferOutbox.delivered_at.is_(None))
+        ).first()
+        if transfer is None:
+            return False
+        to_shard = locate(Account, transfer.to_account_id)
+        if to_shard is None:
+            raise HTTPException(status_code=404, detail="Account not found")
+
+        if to_shard == shard:
+            def deliver(db: Session) -> bool:
+                return _mark_delivered(db, transfer_id) and _credit(db, transfer, record=False)
+
+            return run_in_transaction(db, deliver, operation="deliver_transfer")
+
+        db.use_shard(to_shard)
+        run_in_transaction(db, lambda db: _credit(db, transfer, record=True), operation="deliver_transfer")
+        db.use_shard(shard)
+        return run_in_transaction(db, lambda db: _mark_delivered(db, transfer_id), operation="deliver_transfer")
+
+
+def _error_message(error: Exception) -> str:
+    if isinstance(error, HTTPException):
+        return error.detail
+    return str(error).splitlines()[0] if str(error) else type(error).__name__
+
+
+def deliver_pending(db: Session) -> None:
+    """
+    Deliver the credits staged by the transaction the session has just committed.
+
+    A failed delivery is logged and left to the outbox relay; the transfer itself is already
+    committed.
+    """
+    for transfer_id in sorted(db.info.pop(PENDING_DELIVERIES, ())):
+        try:
+            deliver_transfer(db.shard, transfer_id)
+        except Exception as e:
+            logger.warning("delivery of transfer %s failed, left to the outbox relay: %s",
+                           transfer_id, _error_message(e))
+
+
+def claim_pending_deliveries(db: Session, batch_size: int, lease: timedelta,
+                             now: Optional[datetime] = None) -> list[UUID]:
+    """
+    Claim a batch of due outbox entries of the current shard and commit.
+
+    The entries are not kept locked while they are delivered: claiming moves them `lease` into
+    the future instead, so that other relays skip them in the meantime.
+
+    Args:
+        db (Session): The database session.
+        batch_size (int): Maximum number of entries to claim.
+        lease (timedelta): How long the claimed entries are skipped by other relays.
+        now (datetime): The current time. Defaults to the current UTC time.
+
+    Returns:
+        list[UUID]: The IDs of the transfers to deliver, oldest due first.
+    """
+    now = now or datetime.now(timezone.utc)
+    due = (
+        select(TransferOutbox.transfer_id)
+        .where(TransferOutbox.delivered_at.is_(None), TransferOutbox.next_attempt_at <= now)
+        .order_by(TransferOutbox.next_attempt_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    transfer_ids = db.execute(
+        update(TransferOutbox)
+        .where(TransferOutbox.transfer_id.in_(due.scalar_subquery()))
+        .values(next_attempt_at=now + lease)
+        .returning(TransferOutbox.transfer_id)
+    ).scalars().all()
+    db.commit()
+    return sorted(transfer_ids)
+
+
+def record_delivery_failure(db: Session, transfer_id: UUID, error: Exception,
+                            now: Optional[datetime] = None) -> None:
+    """
+    Count a failed delivery of an outbox entry of the current shard and schedule its retry.
+    """
+    now = now or datetime.now(timezone.utc)
+    entry = db.get(TransferOutbox, transfer_id, with_for_update=True)
+    if entry is None or entry.delivered_at is not None:
+        db.rollback()
+        return
+    entry.attempts += 1
+    entry.last_error = _error_message(error)
+    entry.next_attempt_at = now + min(RETRY_BASE_DELAY * 2 ** (entry.attempts - 1), RETRY_MAX_DELAY)
+    db.commit()
+
+
+def get_outbox_backlog(db: Session) -> dict:
+    """
+    Get the number and the oldest debit time of the undelivered entries of the current shard.
+    """
+    count, oldest = db.execute(
+        select(func.count(), func.min(Transfer.timestamp))
+        .select_from(TransferOutbox)
+        .join(Transfer, Transfer.id == TransferOutbox.transfer_id)
+        .where(TransferOutbox.delivered_at.is_(None))
+    ).one()
+    return {"undelivered": count, "oldest": oldest}
@@ -0,0 +1,214 @@
+import calendar
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from fastapi import HTTPException
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+from app.crud.account import accounts_exist
+from app.crud.outbox import deliver_pending
+from app.crud.routing import find, locate, route, sharded
+from app.crud.unit_of_work import run_in_transaction
+from app.crud.transfer import apply_transfer
+from app.ids import uuid7
+from app.models.models import Account, RecurringTransfer
+from app.schemas.schemas import RecurringTransferCreate, TransferCreate
+from app.sharding import slot_of
+
+# Retry backoff for a failed occurrence: RETRY_BASE_DELAY * 2 ** (attempt - 1), capped at RETRY_MAX_DELAY.
+# After MAX_ATTEMPTS failures the occurrence is skipped and the order moves on to its next period.
+RETRY_BASE_DELAY = timedelta(minutes=1)
+RETRY_MAX_DELAY = timedelta(hours=6)
+MAX_ATTEMPTS = 5
+
+
+def occurrence(start_at: datetime, frequency: str, n: int) -> datetime:
+    """
+    Compute the n-th scheduled run of a standing order, counting from zero.
+
+    Monthly runs are computed from the start date rather than from the previous run, so an order
+    starting on the 31st runs on the last day of shorter months and on the 31st again afterwards.
+
+    Args:
+        start_at (datetime): The first scheduled run.
+        frequency (str): "daily", "weekly" or "monthly".
+        n (int): The index of the occurrence.
+
+    Returns:
+        datetime: The scheduled time of the occurrence.
+    """
+    if frequency == "daily":
+        return start_at + timedelta(days=n)
+    if frequency == "weekly":
+        return start_at + timedelta(weeks=n)
+    if frequency == "monthly":
+        month_index = start_at.month - 1 + n
+        year, month = start_at.year + month_index // 12, month_index % 12 + 1
+        day = min(start_at.day, calendar.monthrange(year, month)[1])
+        return start_at.replace(year=year, month=month, day=day)
+    raise ValueError(f"Unknown frequency: {frequency}")
+
+
+def first_occurrence_after(start_at: datetime, frequency: str, after: datetime, n: int = 0) -> int:
+    """
+    Find the first scheduled run of a standing order, from the n-th on, that is later than a time.
+
+    Args:
+        start_at (datetime): The first scheduled run.
+        frequency (str): "daily", "weekly" or "monthly".
+        after (datetime): The time the run must be later than.
+        n (int): The index of the earliest occurrence to consider.
+
+    Returns:
+        int: The index of the occurrence.
+    """
+    # Start from an estimate that is never past the answer, so that only a few steps remain
+    if frequency == "monthly":
+        estimate = (after.year - start_at.year) * 12 + after.month - start_at.month - 1
+    else:
+        estimate = (after - start_at) // timedelta(days=1 if frequency == "daily" else 7)
+    n = max(n, estimate)
+    while occurrence(start_at, frequency, n) <= after:
+        n += 1
+    return n
+
+
+def create_recurring_transfer(db: Session, recurring_transfer: RecurringTransferCreate) -> RecurringTransfer:
+    # Standing orders live on the shard of the account they debit; the account they credit may
+    # be on another one
+    if not route(db, Account, recurring_transfer.from_account_id):
+        raise HTTPException(status_code=404, detail="One or both accounts not found")
+
+    def insert(db: Session) -> RecurringTransfer:
+        if sharded(db):
+            found = (accounts_exist(db, [recurring_transfer.from_account_id])
+                     and locate(Account, recurring_transfer.to_account_id) is not None)
+        else:
+            found = accounts_exist(db, [recurring_transfer.from_account_id, recurring_transfer.to_account_id])
+        if not found:
+            raise HTTPException(status_code=404, detail="One or both accounts not found")
+
+        db_recurring_transfer = RecurringTransfer(
+            id=uuid7(slot_of(recurring_transfer.from_account_id)),
+            from_account_id=recurring_transfer.from_account_id,
+            to_account_id=recurring_transfer.to_account_id,
+            amount=recurring_transfer.amount,
+            frequency=recurring_transfer.frequency,
+            start_at=recurring_transfer.start_at,
+            end_at=recurring_transfer.end_at,
+            next_run_at=recurring_transfer.start_at,
+        )
+        db.add(db_recurring_transfer)
+        return db_recurring_transfer
+
+    return run_in_transaction(db, insert, operation="create_recurring_transfer", expire_on_commit=False)
+
+
+def get_recurring_transfer(db: Session, recurring_transfer_id) -> RecurringTransfer:
+    return find(db, recurring_transfer_id,
+                lambda db: db.query(RecurringTransfer).filter(RecurringTransfer.id == recurring_transfer_id).first())
+
+
+def cancel_recurring_transfer(db: Session, recurring_transfer_id) -> RecurringTransfer:
+    if not route(db, RecurringTransfer, recurring_transfer_id):
+        raise HTTPException(status_code=404, detail="Recurring transfer not found")
+
+    def cancel(db: Session) -> RecurringTransfer:
+        # Lock the row so a cancellation waits for a worker that is executing the order right now
+        db_recurring_transfer = (
+            db.query(RecurringTransfer)
+            .filter(RecurringTransfer.id == recurring_transfer_id)
+            .with_for_update()
+            .first()
+        )
+        if db_recurring_transfer is None:
+            raise HTTPException(status_code=404, detail="Recurring transfer not found")
+        db_recurring_transfer.active = False
+        return db_recurring_transfer
+
+    return run_in_transaction(db, cancel, operation="cancel_recurring_transfer", expire_on_commit=False)
+
+
+def claim_due_recurring_transfers(db: Session, batch_size: int, now: Optional[datetime] = None) -> list[RecurringTransfer]:
+    """
+    Lock a batch of due standing orders for the current transaction.
+
+    Rows already locked by another worker are skipped rather than waited for, so any number of
+    workers can claim batches concurrently without executing an order twice. The locks are held
+    until the caller commits or rolls back.
+
+    Args:
+        db (Session): The database session.
+        batch_size (int): Maximum number of orders to claim.
+        now (datetime): The current time. Defaults to the current UTC time.
+
+    Returns:
+        list[RecurringTransfer]: The claimed orders, oldest due first.
+    """
+    now = now or datetime.now(timezone.utc)
+    return (
+        db.query(RecurringTransfer)
+        .filter(RecurringTransfer.active.is_(True), RecurringTransfer.next_run_at <= now)
+        .order_by(RecurringTransfer.next_run_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+
+
+def _advance(order: RecurringTransfer, now: datetime) -> None:
+    # Occurrences that were missed, because the order started in the past or the workers were
+    # down, are skipped rather than executed one after another
+    order.run_count = first_occurrence_after(order.start_at, order.frequency, now, order.run_count + 1)
+    order.attempts = 0
+    order.next_run_at = occurrence(order.start_at, order.frequency, order.run_count)
+    if order.end_at is not None and order.next_run_at > order.end_at:
+        order.active = False
+
+
+def execute_recurring_transfers(db: Session, batch_size: int = 500, now: Optional[datetime] = None) -> dict:
+    """
+    Claim one batch of due standing orders, execute them and commit the batch.
+
+    Every order runs in its own savepoint, so a failing order does not undo the rest of the batch.
+    A failed order is retried with exponential backoff; after MAX_ATTEMPTS failures the occurrence
+    is skipped and the order is scheduled for its next period. An order is executed once however
+    late it runs: the occurrences that were due in the meantime, such as those of an order created
+    with a start in the past, are skipped and it is scheduled for its first run after `now`.
+    Credits to accounts on other shards are delivered once the batch is committed.
+
+    Args:
+        db (Session): The database session.
+        batch_size (int): Maximum number of orders to execute.
+        now (datetime): The current time. Defaults to the current UTC time.
+
+    Returns:
+        dict: The number of orders claimed, executed and failed.
+    """
+    now = now or datetime.now(timezone.utc)
+    orders = claim_due_recurring_transfers(db, batch_size, now)
+    executed = failed = 0
+    for order in orders:
+        try:
+            with db.begin_nested():
+                apply_transfer(db, TransferCreate(
+                    from_account_id=order.from_account_id,
+                    to_account_id=order.to_account_id,
+                    amount=order.amount,
+                ))
+        except (HTTPException, StaleDataError, DBAPIError) as e:
+            failed += 1
+            order.attempts += 1
+            order.last_error = e.detail if isinstance(e, HTTPException) else str(e).splitlines()[0]
+            if order.attempts >= MAX_ATTEMPTS:
+                _advance(order, now)
+            else:
+                delay = min(RETRY_BASE_DELAY * 2 ** (order.attempts - 1), RETRY_MAX_DELAY)
+                order.next_run_at = now + delay
+            continue
+        executed += 1
+        order.last_error = None
+        _advance(order, now)
+    db.commit()
+    deliver_pending(db)
+    return {"claimed": len(orders), "executed": executed, "failed": failed}
@@ -0,0 +1,110 @@
+"""
+Routing of sessions to shards.
+
+Every record lives on the shard that owns the slot carried by its ID (see app.sharding), except
+for records created before the data was sharded, whose IDs carry no slot, and for customers the
+rebalance job has not moved yet after a change of the shard map. Lookups therefore go to the
+owning shard first and fall back to the other shards when the record is not there.
+
+With a single shard, or with a plain Session bound to one database, nothing is routed and no
+statement is added.
+"""
+from typing import Callable, Optional, TypeVar
+from uuid import UUID
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app import database
+
+T = TypeVar("T")
+
+
+def sharded(db: Optional[Session] = None) -> bool:
+    """
+    Check whether there is more than one shard to route to.
+    """
+    if db is not None and not isinstance(db, database.ShardedSession):
+        return False
+    return len(database.engines) > 1
+
+
+def use_shard(db: Session, shard: str) -> None:
+    """
+    Point a session at a shard. A plain Session is bound to a single database and is left alone.
+    """
+    if isinstance(db, database.ShardedSession):
+        db.use_shard(shard)
+
+
+def candidate_shards(record_id: UUID) -> list[str]:
+    """
+    Get the shards a record may be on, the shard owning its slot first.
+    """
+    owner = database.shard_map.shard_for(record_id)
+    return [owner, *(shard for shard in database.engines if shard != owner)]
+
+
+def find(db: Session, record_id: UUID, lookup: Callable[[Session], Optional[T]]) -> Optional[T]:
+    """
+    Run a lookup on the shard owning an ID, then on the other shards until it finds something.
+
+    The session is left on the shard the record was found on, so that the statements that follow
+    go to the same shard.
+
+    Args:
+        db (Session): The database session.
+        record_id (UUID): The ID the lookup is about.
+        lookup (Callable): Called with the session; returns None if the record is not there.
+
+    Returns:
+        The first result that is not None, or None if no shard has the record.
+    """
+    if not sharded(db):
+        return lookup(db)
+    shards = candidate_shards(record_id)
+    for shard in shards:
+        db.use_shard(shard)
+        result = lookup(db)
+        if result is not None:
+            return result
+    db.use_shard(shards[0])
+    return None
+
+
+def locate(model, record_id: UUID) -> Optional[str]:
+    """
+    Get the shard holding a record, without touching any session.
+
+    Every shard probed costs a primary key lookup on a connection of its own, so this can be used
+    in the middle of a transaction on another shard. With a single shard the record is assumed
+    to be there and nothing is queried; the caller finds out whether it exists.
+
+    Args:
+        model: The mapped class of the record, with an `id` primary key.
+        record_id (UUID): The ID of the record.
+
+    Returns:
+        str: The name of the shard, or None if no shard has the record.
+    """
+    if not sharded():
+        return database.DEFAULT_SHARD
+    for shard in candidate_shards(record_id):
+        with database.engines[shard].connect() as conn:
+            if conn.execute(select(model.id).where(model.id == record_id)).first() is not None:
+                return shard
+    return None
+
+
+def route(db: Session, model, record_id: UUID) -> bool:
+    """
+    Point a session at the shard holding a record.
+
+    Returns:
+        bool: False if no shard has the record. Always True with a single shard.
+    """
+    if not sharded(db):
+        return True
+    shard = locate(model, record_id)
+    if shard is None:
+        return False
+    db.use_shard(shard)
+    return True
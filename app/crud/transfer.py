@@ -1,26 +1,68 @@
+from datetime import datetime
+from typing import Iterator
+from uuid import UUID
+from sqlalchemy import func, select
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import Session
-from app.models.models import Transfer, Account
+from sqlalchemy.orm.exc import StaleDataError
+from app import velocity
+from app.ids import uuid7
+from app.models.models import Transfer, TransferOutbox, Account
 from app.schemas.schemas import TransferCreate
+from app.sharding import slot_of
 from decimal import Decimal
 from fastapi import HTTPException
-from app.crud.account import update_account_balance, get_account
+from app.crud.account import update_account_balance
+from app.crud.analytics import record_transfer_edge
+from app.crud.outbox import PENDING_DELIVERIES, deliver_pending
+from app.crud.routing import find, locate, route, sharded
+from app.crud.unit_of_work import retryable_error, run_in_transaction
 
-def create_transfer(db: Session, transfer: TransferCreate) -> Transfer:
-    # Get accounts
-    from_account = get_account(db, transfer.from_account_id)
-    to_account = get_account(db, transfer.to_account_id)
+def apply_transfer(db: Session, transfer: TransferCreate) -> Transfer:
+    """
+    Validate a transfer and stage it in the current transaction without committing.
+
+    The session must be on the shard of the source account. If the destination account is on
+    another shard, only the debit is staged here, together with an outbox entry for the credit;
+    its ID is added to `db.info[PENDING_DELIVERIES]` so that the caller can deliver the credit
+    once the debit is committed (see app.crud.outbox).
+
+    Args:
+        db (Session): The database session.
+        transfer (TransferCreate): The transfer to apply.
+
+    Returns:
+        Transfer: The flushed transfer record.
+
+    Raises:
+        HTTPException: If an account is not found or the source account has insufficient funds.
+        StaleDataError: If one of the accounts was modified concurrently since it was read.
+    """
+    # Get both accounts in one round trip
+    accounts = {
+        account.id: account
+        for account in db.query(Account).filter(
+            Account.id.in_([transfer.from_account_id, transfer.to_account_id])
+        )
+    }
+    from_account = accounts.get(transfer.from_account_id)
+    to_account = accounts.get(transfer.to_account_id)
+    to_shard = None
+    if from_account and not to_account and sharded(db):
+        to_shard = locate(Account, transfer.to_account_id)
 
-    if not from_account or not to_account:
+    if not from_account or not (to_account or to_shard):
         raise HTTPException(status_code=404, detail="One or both accounts not found")
 
-    amount = Decimal(str(transfer.amount))
+    amount = transfer.amount
 
     # Check balance
     if from_account.balance < amount:
         raise HTTPException(status_code=400, detail="Insufficient funds")
 
-    # Create transfer record
+    # Create transfer record, on the shard of the source account
     db_transfer = Transfer(
+        id=uuid7(slot_of(transfer.from_account_id)),
         from_account_id=transfer.from_account_id,
         to_account_id=transfer.to_account_id,
         amount=amount
@@ -28,17 +70,108 @@ def create_transfer(db: Session, transfer: TransferCreate) -> Transfer:
     db.add(db_transfer)
 
     # Update account balances
-    update_account_balance(db, from_account.id, -amount)
-    update_account_balance(db, to_account.id, amount)
+    update_account_balance(db, from_account.id, -amount, commit=False)
+    if to_account is not None:
+        update_account_balance(db, to_account.id, amount, commit=False)
 
-    db.commit()
-    db.refresh(db_transfer)
+    db.flush()
+    record_transfer_edge(db, db_transfer)
+    if to_account is None:
+        db.add(TransferOutbox(transfer_id=db_transfer.id))
+        db.info.setdefault(PENDING_DELIVERIES, set()).add(db_transfer.id)
+    return db_transfer
+
+def create_transfer(db: Session, transfer: TransferCreate) -> Transfer:
+    # Enforce the velocity limits of the source account before touching the database
+    exceeded = velocity.limiter.reserve(transfer.from_account_id, transfer.amount)
+    if exceeded is not None:
+        raise HTTPException(status_code=429, detail=f"Velocity limit exceeded: {exceeded.describe()}")
+
+    db.info.pop(PENDING_DELIVERIES, None)
+    try:
+        if not route(db, Account, transfer.from_account_id):
+            raise HTTPException(status_code=404, detail="One or both accounts not found")
+        # Every object the transfer loads is also written by it, so nothing needs to be
+        # reloaded after commit
+        db_transfer = run_in_transaction(db, lambda db: apply_transfer(db, transfer),
+                                         operation="create_transfer", expire_on_commit=False)
+    except (StaleDataError, DBAPIError) as e:
+        velocity.limiter.release(transfer.from_account_id, transfer.amount)
+        if isinstance(e, DBAPIError) and retryable_error(e) is None:
+            raise
+        raise HTTPException(status_code=409, detail="Account was modified concurrently")
+    except BaseException:
+        velocity.limiter.release(transfer.from_account_id, transfer.amount)
+        raise
+    velocity.limiter.confirm(transfer.from_account_id, transfer.amount)
+    # A transfer to another shard is complete once its debit is committed; the credit follows
+    deliver_pending(db)
     return db_transfer
 
 def get_transfer(db: Session, transfer_id: int) -> Transfer:
-    return db.query(Transfer).filter(Transfer.id == transfer_id).first()
+    return find(db, transfer_id, lambda db: db.query(Transfer).filter(Transfer.id == transfer_id).first())
 
 def get_account_transfers(db: Session, account_id: int) -> list[Transfer]:
+    route(db, Account, account_id)
     return db.query(Transfer).filter(
         (Transfer.from_account_id == account_id) | (Transfer.to_account_id == account_id)
+    ).order_by(Transfer.timestamp, Transfer.id).all()
+
+def stream_account_transfers(db: Session, account_id: UUID, chunk_size: int = 10000) -> Iterator[list]:
+    """
+    Stream every transfer of an account in chunks, through a server-side cursor.
+
+    Only the columns are loaded, without building ORM objects, and at most one chunk is held in
+    memory at a time whatever the number of transfers.
+
+    Args:
+        db (Session): The database session.
+        account_id (UUID): The ID of the account.
+        chunk_size (int): Number of rows fetched per round trip.
+
+    Returns:
+        Iterator[list]: Lists of `(id, from_account_id, to_account_id, amount, timestamp)` rows.
+    """
+    route(db, Account, account_id)
+    result = db.execute(
+        select(Transfer.id, Transfer.from_account_id, Transfer.to_account_id, Transfer.amount, Transfer.timestamp)
+        .where((Transfer.from_account_id == account_id) | (Transfer.to_account_id == account_id))
+        .order_by(Transfer.timestamp, Transfer.id)
+        .execution_options(stream_results=True, yield_per=chunk_size)
+    )
+    for partition in result.partitions():
+        yield partition
+
+def get_outgoing_transfers_since(db: Session, account_id: UUID, since: datetime) -> list[tuple[datetime, Decimal]]:
+    """
+    Get the timestamp and amount of every transfer an account sent since a point in time.
+    """
+    route(db, Account, account_id)
+    return db.query(Transfer.timestamp, Transfer.amount).filter(
+        Transfer.from_account_id == account_id, Transfer.timestamp >= since
     ).all()
+
+def get_outgoing_transfer_buckets(db: Session, since: datetime, bucket_seconds: int,
+                                  local_senders_only: bool = False) -> Iterator[tuple[UUID, int, Decimal, int]]:
+    """
+    Stream the amount and number of transfers sent per account and time bucket since a point in time.
+
+    Args:
+        db (Session): The database session.
+        since (datetime): Start of the period.
+        bucket_seconds (int): Length of a bucket. Buckets are numbered by Unix time divided by this length.
+        local_senders_only (bool): Skip the credits of transfers sent from accounts on other shards,
+            which are counted on the shard of their sender.
+
+    Returns:
+        Iterator[tuple]: `(account_id, bucket, amount, count)` rows.
+    """
+    bucket = func.floor(func.extract("epoch", Transfer.timestamp) / bucket_seconds)
+    query = db.query(Transfer.from_account_id, bucket, func.sum(Transfer.amount), func.count()).filter(
+        Transfer.timestamp >= since
+    )
+    if local_senders_only:
+        query = query.filter(select(Account.id).where(Account.id == Transfer.from_account_id).exists())
+    rows = query.group_by(Transfer.from_account_id, bucket).yield_per(10000)
+    for account_id, bucket_number, amount, count in rows:
+        yield account_id, int(bucket_number), amount, count
@@ -0,0 +1,162 @@
+"""
+Retrying unit of work for write transactions.
+
+Write operations run in their own transaction at `WRITE_ISOLATION_LEVEL` (default REPEATABLE
+READ). Under REPEATABLE READ and SERIALIZABLE, PostgreSQL aborts a transaction that conflicts with
+a concurrent one with a serialization failure (SQLSTATE 40001) rather than letting it act on data
+that changed after its snapshot, and any isolation level can hit a deadlock (40P01). A versioned
+UPDATE or DELETE that finds the row changed since it was loaded raises StaleDataError. All three
+are transient: the whole transaction is rolled back and run again, after a jittered exponential
+backoff, up to `WRITE_RETRY_ATTEMPTS` times. Other errors are raised right away.
+
+Attempts, retries by cause and transactions that ran out of attempts are counted per operation
+and served by `GET /diagnostics/transactions`. The counters live in the current process, so with
+several server workers every worker counts only the transactions it ran.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Optional, TypeVar
+
+from dotenv import load_dotenv
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+
+from app.database import has_uncommitted_writes
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+SERIALIZATION_FAILURE = "40001"
+DEADLOCK_DETECTED = "40P01"
+RETRYABLE_ERRORS = {SERIALIZATION_FAILURE: "serialization_failure", DEADLOCK_DETECTED: "deadlock"}
+STALE_DATA = "stale_data"
+
+WRITE_ISOLATION_LEVEL = os.getenv("WRITE_ISOLATION_LEVEL", "REPEATABLE READ")
+WRITE_RETRY_ATTEMPTS = int(os.getenv("WRITE_RETRY_ATTEMPTS", "5"))
+WRITE_RETRY_BASE_DELAY = float(os.getenv("WRITE_RETRY_BASE_DELAY", "0.005"))
+WRITE_RETRY_MAX_DELAY = float(os.getenv("WRITE_RETRY_MAX_DELAY", "0.2"))
+
+
+class RetryMetrics:
+    """
+    Thread-safe counters of write transactions, kept per operation.
+    """
+
+    def __init__(self):
+        self._counters: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def increment(self, operation: str, counter: str) -> None:
+        with self._lock:
+            self._counters[operation][counter] += 1
+
+    def snapshot(self) -> dict[str, dict[str, int]]:
+        with self._lock:
+            return {operation: dict(counters) for operation, counters in self._counters.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+
+
+metrics = RetryMetrics()
+
+
+def retryable_error(error: BaseException) -> Optional[str]:
+    """
+    Get the cause of a transient transaction failure, or None if the error is not transient.
+    """
+    if isinstance(error, DBAPIError):
+        return RETRYABLE_ERRORS.get(getattr(error.orig, "pgcode", None))
+    if isinstance(error, StaleDataError):
+        return STALE_DATA
+    return None
+
+
+def backoff_delay(attempt: int) -> float:
+    # Full jitter spreads retries of transactions that conflicted with each other apart
+    return random.uniform(0, min(WRITE_RETRY_MAX_DELAY, WRITE_RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+
+
+def _commit(db: Session, expire_on_commit: bool) -> None:
+    if expire_on_commit:
+        db.commit()
+        return
+    previous, db.expire_on_commit = db.expire_on_commit, False
+    try:
+        db.commit()
+    finally:
+        db.expire_on_commit = previous
+
+
+def run_in_transaction(db: Session, work: Callable[[Session], T], operation: str,
+                       isolation_level: Optional[str] = None, attempts: Optional[int] = None,
+                       expire_on_commit: bool = True) -> T:
+    """
+    Run `work` in a transaction of its own and commit it, retrying on serialization failures,
+    deadlocks and stale versioned rows.
+
+    `work` must only touch the database through `db` and must be safe to run again, since a
+    retry replays it from the start after the failed attempt was rolled back. A transaction
+    already open on the session, such as one a shard lookup has read in, is rolled back first so
+    that the isolation level can be set. If it has written anything the caller has to commit or
+    roll it back first, rather than have it committed along with `work`. Every attempt starts
+    with all objects of the session expired, so that `work` never acts on state loaded by an
+    earlier transaction.
+
+    With `expire_on_commit=False` the objects are left loaded after the commit, so that returning
+    them does not cost a SELECT per object. That is only safe if every object `work` loads is
+    also written by it: the written values are then exactly the committed ones, while an object
+    that was only read could have been changed by a concurrent transaction before the commit.
+
+    Args:
+        db (Session): The database session.
+        work (Callable): Called with the session; its return value is returned after commit.
+        operation (str): Name the attempts are counted under.
+        isolation_level (str): Isolation level of the transaction. Defaults to WRITE_ISOLATION_LEVEL.
+        attempts (int): Maximum number of attempts. Defaults to WRITE_RETRY_ATTEMPTS.
+        expire_on_commit (bool): Expire the objects of the session on commit.
+
+    Returns:
+        The return value of `work`.
+
+    Raises:
+        RuntimeError: If the session holds changes that have not been committed.
+        DBAPIError: If the last attempt failed with a serialization failure or deadlock.
+        StaleDataError: If the last attempt found a versioned row changed.
+        Exception: Any other error raised by `work` or by the commit, after rolling back.
+    """
+    isolation_level = isolation_level or WRITE_ISOLATION_LEVEL
+    attempts = attempts or WRITE_RETRY_ATTEMPTS
+    if has_uncommitted_writes(db):
+        raise RuntimeError(f"{operation}: the session holds uncommitted changes, commit or roll them back first")
+    if db.in_transaction():
+        db.rollback()
+    for attempt in range(1, attempts + 1):
+        metrics.increment(operation, "attempts")
+        try:
+            db.expire_all()
+            db.connection(execution_options={"isolation_level": isolation_level})
+            result = work(db)
+            _commit(db, expire_on_commit)
+            return result
+        except BaseException as e:
+            db.rollback()
+            cause = retryable_error(e)
+            if cause is None:
+                raise
+            if attempt == attempts:
+                metrics.increment(operation, "exhausted")
+                raise
+            metrics.increment(operation, "retries")
+            metrics.increment(operation, cause)
+            logger.info("%s: %s on attempt %d, retrying", operation, cause, attempt)
+        time.sleep(backoff_delay(attempt))
@@ -1,8 +1,11 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, func, select
 import os
-from sqlalchemy.orm import declarative_base
+from typing import Optional
+from sqlalchemy.orm import Session, declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
+from app import slow_queries
+from app.sharding import ShardMap, parse_shard_urls
 
 load_dotenv()
 
@@ -14,12 +17,106 @@ DB_PORT = os.getenv("DB_PORT")
 
 SQLALCHEMY_DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+# Connection pool per process. With several server workers the database sees up to
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+
+# Shards as a `name=url,name=url` list, see app.sharding. By default the database above is the
+# only shard. Shards listed in SHARD_RETIRED own no slots: they are still read from, and drained
+# by the rebalance job, but get no new customers.
+SHARD_URLS = parse_shard_urls(os.getenv("SHARD_URLS") or f"default={SQLALCHEMY_DATABASE_URL}")
+SHARD_RETIRED = [name.strip() for name in os.getenv("SHARD_RETIRED", "").split(",") if name.strip()]
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", "64"))
+
+
+def _create_engine(url: str):
+    return create_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=True,
+    )
+
+
+# One engine, and so one connection pool, per shard
+engines = {name: _create_engine(url) for name, url in SHARD_URLS.items()}
+shard_map = ShardMap([name for name in engines if name not in SHARD_RETIRED], SHARD_VNODES)
+
+# The first shard; holds everything when there is only one
+DEFAULT_SHARD = next(iter(engines))
+engine = engines[DEFAULT_SHARD]
+
+# Opt-in slow-query log, see app.slow_queries
+if slow_queries.SLOW_QUERY_MS > 0:
+    for shard_engine in engines.values():
+        slow_queries.log.install(shard_engine)
+
+
+def _reset_pool_after_fork() -> None:
+    # A forked child must never use the parent's pooled connections: two processes writing to
+    # the same socket corrupt the protocol stream. Start the child with an empty pool and leave
+    # the parent's connections open for the parent.
+    for shard_engine in engines.values():
+        shard_engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_reset_pool_after_fork)
+
+
+def has_uncommitted_writes(db: Session) -> bool:
+    """
+    Check whether the transaction open on a session has written anything, or has changes waiting
+    to be flushed.
+    """
+    if not db.in_transaction():
+        return False
+    if db.new or db.deleted or any(db.is_modified(instance) for instance in db.dirty):
+        return True
+    # Changes already flushed, or written with Core statements, are not tracked by the session;
+    # PostgreSQL only assigns a transaction ID once the transaction writes
+    return db.execute(select(func.pg_current_xact_id_if_assigned())).scalar() is not None
+
+
+class ShardedSession(Session):
+    """
+    Session that runs its transactions on one shard at a time.
+
+    The shard is chosen with `use_shard`, which the `app.crud` functions call with the shard of
+    the records they work on before they run any statement.
+
+    Args:
+        shard (str): The shard to start on. Defaults to DEFAULT_SHARD.
+    """
+
+    def __init__(self, *args, shard: Optional[str] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shard = shard or DEFAULT_SHARD
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        return engines[self.shard]
+
+    def use_shard(self, shard: str) -> None:
+        """
+        Point the session at a shard. A transaction open on another shard, such as one a lookup
+        has read in, is rolled back first.
+
+        Raises:
+            RuntimeError: If the transaction open on the current shard has written anything; the
+                caller has to commit or roll it back rather than have it end halfway through.
+        """
+        if shard == self.shard:
+            return
+        if has_uncommitted_writes(self):
+            raise RuntimeError(f"Cannot switch from shard {self.shard!r} to {shard!r} with uncommitted changes")
+        if self.in_transaction():
+            self.rollback()
+        self.shard = shard
 
-# Create a new SQLAlchemy engine instance
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
 
 # Create a configured "Session" class
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = sessionmaker(class_=ShardedSession, autocommit=False, autoflush=False)
 
 # Base class for all ORM models
 Base = declarative_base()
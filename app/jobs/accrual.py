@@ -0,0 +1,105 @@
+"""
+End-of-day interest accrual and fee job.
+
+Posts one day of interest to every account with a positive balance and charges the daily fee to
+every account, as ledger transfers from the bank's interest account and to its fee account. The
+accounts are processed in ID order, a chunk at a time: the postings of a chunk are computed by a
+single set-based query and written with one bulk INSERT and one bulk UPDATE, then committed
+together with the checkpoint of the run. Rerunning the job for the same business date resumes
+after the last committed chunk, and does nothing once the run has completed.
+
+The job posts to the accounts of one shard, whose own interest and fee accounts it is given; run it
+once per shard.
+
+Usage:
+    python -m app.jobs.accrual --interest-account UUID --fee-account UUID --annual-rate 0.02
+                               [--fee 1.00] [--fee-waiver-balance 1000] [--date 2024-01-31]
+                               [--day-count 365] [--chunk-size 5000] [--shard NAME]
+"""
+import argparse
+import logging
+import time
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import Optional
+from uuid import UUID
+
+from app import database
+from app.crud.accrual import post_accrual_chunk, start_accrual_run
+from app.crud.unit_of_work import run_in_transaction
+from app.models.models import AccrualRun
+
+logger = logging.getLogger(__name__)
+
+
+def run(business_date: date, annual_rate: Decimal, fee: Decimal, interest_account_id: UUID,
+        fee_account_id: UUID, fee_waiver_balance: Optional[Decimal] = None, day_count: int = 365,
+        chunk_size: int = 5000, shard: Optional[str] = None) -> dict:
+    """
+    Run, or resume, the accrual of a business date until every account of a shard has been
+    processed. The shard defaults to the default shard.
+
+    Returns:
+        dict: Totals of the run and the throughput of this invocation in accounts per second.
+    """
+    started = time.monotonic()
+    processed = 0
+    with database.SessionLocal(shard=shard) as db:
+        start_accrual_run(db, business_date, annual_rate, fee, interest_account_id, fee_account_id,
+                          fee_waiver_balance=fee_waiver_balance, day_count=day_count)
+        while True:
+            accounts = run_in_transaction(
+                db, lambda db: post_accrual_chunk(db, business_date, chunk_size), operation="post_accrual_chunk",
+            )
+            processed += accounts
+            elapsed = time.monotonic() - started
+            if accounts:
+                logger.info("accrual %s: %d accounts, %.0f accounts/s", business_date, processed,
+                            processed / elapsed if elapsed else 0)
+            if accounts < chunk_size:
+                break
+
+        accrual_run = db.get(AccrualRun, business_date)
+        elapsed = time.monotonic() - started
+        return {
+            "business_date": business_date.isoformat(),
+            "status": accrual_run.status,
+            "accounts": accrual_run.accounts,
+            "interest_postings": accrual_run.interest_postings,
+            "fee_postings": accrual_run.fee_postings,
+            "interest_total": str(accrual_run.interest_total),
+            "fee_total": str(accrual_run.fee_total),
+            "processed": processed,
+            "seconds": round(elapsed, 3),
+            "accounts_per_second": round(processed / elapsed) if elapsed else None,
+        }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Post end-of-day interest and fees.")
+    parser.add_argument("--interest-account", type=UUID, required=True, help="Account interest is paid from")
+    parser.add_argument("--fee-account", type=UUID, required=True, help="Account fees are paid to")
+    parser.add_argument("--annual-rate", type=Decimal, required=True, help="Annual interest rate, e.g. 0.02")
+    parser.add_argument("--fee", type=Decimal, default=Decimal("0"), help="Fee charged to every account")
+    parser.add_argument("--fee-waiver-balance", type=Decimal, default=None,
+                        help="Accounts with at least this balance pay no fee")
+    parser.add_argument("--date", type=date.fromisoformat, default=None,
+                        help="Business date (default: today, UTC)")
+    parser.add_argument("--day-count", type=int, default=365)
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--shard", choices=list(database.engines), default=database.DEFAULT_SHARD)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    summary = run(
+        args.date or datetime.now(timezone.utc).date(), args.annual_rate, args.fee,
+        args.interest_account, args.fee_account, fee_waiver_balance=args.fee_waiver_balance,
+        day_count=args.day_count, chunk_size=args.chunk_size, shard=args.shard,
+    )
+    for key, value in summary.items():
+        print(f"{key}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,122 @@
+"""
+Balance checkpoint job.
+
+Writes the ledger balance of every account that had transfers since its latest checkpoint, as of
+a recent point in time, so that point-in-time balance queries only scan the transfers made since
+(see app.crud.balance_checkpoint). Accounts are processed in ID order, a chunk per transaction,
+with one set-based `INSERT ... SELECT` per chunk. Checkpoints that already exist are kept, so an
+interrupted run can simply be run again.
+
+The time of the checkpoints lags the current time by a settling delay, so that transfers still
+committing are not missed, and stays before the oldest cross-shard transfer whose credit has not
+been delivered yet, since that credit will be recorded with the time of the debit.
+
+Usage:
+    python -m app.jobs.checkpoint [--as-of 2024-01-31T00:00:00Z] [--settle 300] [--chunk-size 5000]
+                                  [--interval 3600] [--shard NAME ...]
+"""
+import argparse
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from app import database
+from app.crud.balance_checkpoint import write_balance_checkpoints
+from app.crud.outbox import get_outbox_backlog
+from app.crud.unit_of_work import run_in_transaction
+
+logger = logging.getLogger(__name__)
+
+
+def checkpoint_time(settle: float = 300.0, now: Optional[datetime] = None) -> datetime:
+    """
+    Get the latest time up to which every transfer is known to be committed, on every shard.
+
+    Args:
+        settle (float): Seconds a transfer may take to commit after its timestamp.
+        now (datetime): The current time. Defaults to the current UTC time.
+
+    Returns:
+        datetime: `now - settle`, or just before the oldest undelivered cross-shard transfer.
+    """
+    as_of = (now or datetime.now(timezone.utc)) - timedelta(seconds=settle)
+    for shard in database.engines:
+        with database.SessionLocal(shard=shard) as db:
+            oldest = get_outbox_backlog(db)["oldest"]
+        if oldest is not None:
+            as_of = min(as_of, oldest - timedelta(microseconds=1))
+    return as_of
+
+
+def run(as_of: Optional[datetime] = None, settle: float = 300.0, chunk_size: int = 5000,
+        shards: Optional[list[str]] = None) -> dict:
+    """
+    Write the balance checkpoints of every account as of a point in time.
+
+    Args:
+        as_of (datetime): The time of the checkpoints. Defaults to `checkpoint_time(settle)`.
+        settle (float): Seconds a transfer may take to commit after its timestamp.
+        chunk_size (int): Number of accounts per transaction.
+        shards (list[str]): The shards to checkpoint. Defaults to all of them.
+
+    Returns:
+        dict: The time of the checkpoints, the numbers of accounts scanned and checkpoints
+            written, and the throughput in accounts per second.
+    """
+    as_of = as_of or checkpoint_time(settle)
+    started = time.monotonic()
+    scanned = written = 0
+    for shard in shards or list(database.engines):
+        shard_scanned = shard_written = 0
+        with database.SessionLocal(shard=shard) as db:
+            after = None
+            while True:
+                accounts, checkpoints, after = run_in_transaction(
+                    db, lambda db: write_balance_checkpoints(db, as_of, after, chunk_size),
+                    operation="write_balance_checkpoints",
+                )
+                shard_scanned += accounts
+                shard_written += checkpoints
+                if accounts < chunk_size:
+                    break
+        logger.info("balance checkpoints as of %s on %s: %d accounts scanned, %d written",
+                    as_of.isoformat(), shard, shard_scanned, shard_written)
+        scanned += shard_scanned
+        written += shard_written
+
+    elapsed = time.monotonic() - started
+    return {
+        "as_of": as_of.isoformat(),
+        "accounts": scanned,
+        "checkpoints": written,
+        "seconds": round(elapsed, 3),
+        "accounts_per_second": round(scanned / elapsed) if elapsed else None,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Write balance checkpoints for point-in-time queries.")
+    parser.add_argument("--as-of", type=datetime.fromisoformat, default=None,
+                        help="Time of the checkpoints (default: now minus --settle)")
+    parser.add_argument("--settle", type=float, default=300.0,
+                        help="Seconds a transfer may take to commit after its timestamp")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--interval", type=float, default=None,
+                        help="Keep running, writing checkpoints every this many seconds")
+    parser.add_argument("--shard", action="append", choices=list(database.engines),
+                        help="Shard to checkpoint, may be repeated (default: all)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    while True:
+        summary = run(as_of=args.as_of, settle=args.settle, chunk_size=args.chunk_size, shards=args.shard)
+        for key, value in summary.items():
+            print(f"{key}: {value}")
+        if args.interval is None:
+            return 0
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,184 @@
+"""
+Transfer history export jobs.
+
+Export jobs are submitted through `POST /exports/` and run in a pool of worker processes, so a
+long export never ties up an API worker. A job streams the transfers of its account through a
+server-side cursor and writes them chunk by chunk, so memory use stays constant whatever the size
+of the history. Files are written to `EXPORT_DIR` (default `exports/`) under a temporary name and
+renamed when complete.
+
+CSV and NDJSON are always available; Parquet requires the optional `pyarrow` package.
+
+Jobs left pending, e.g. because the API process that accepted them was restarted, and jobs
+running for longer than `EXPORT_TIMEOUT` seconds (default 3600), whose worker most likely died,
+can be run on every shard with:
+    python -m app.jobs.export
+"""
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from app import database
+from app.crud.export_job import claim_export_job, finish_export_job
+from app.crud.routing import locate
+from app.crud.transfer import stream_account_transfers
+from app.models.models import ExportJob
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover - optional dependency
+    pyarrow = None
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "2"))
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "10000"))
+EXPORT_TIMEOUT = float(os.getenv("EXPORT_TIMEOUT", "3600"))
+
+COLUMNS = ["id", "from_account_id", "to_account_id", "amount", "timestamp"]
+EXTENSIONS = {"csv": "csv", "ndjson": "ndjson", "parquet": "parquet"}
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def format_available(export_format: str) -> bool:
+    return export_format != "parquet" or pyarrow is not None
+
+
+def _write_csv(path: str, chunks) -> int:
+    rows = 0
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for chunk in chunks:
+            writer.writerows(
+                (str(id_), str(from_id), str(to_id), str(amount), timestamp.isoformat())
+                for id_, from_id, to_id, amount, timestamp in chunk
+            )
+            rows += len(chunk)
+    return rows
+
+
+def _write_ndjson(path: str, chunks) -> int:
+    rows = 0
+    with open(path, "w") as f:
+        for chunk in chunks:
+            f.writelines(
+                json.dumps({
+                    "id": str(id_),
+                    "from_account_id": str(from_id),
+                    "to_account_id": str(to_id),
+                    "amount": str(amount),
+                    "timestamp": timestamp.isoformat(),
+                }) + "\n"
+                for id_, from_id, to_id, amount, timestamp in chunk
+            )
+            rows += len(chunk)
+    return rows
+
+
+def _write_parquet(path: str, chunks) -> int:
+    # Amounts are written as strings so that no precision is lost whatever the money storage
+    schema = pyarrow.schema([
+        ("id", pyarrow.string()),
+        ("from_account_id", pyarrow.string()),
+        ("to_account_id", pyarrow.string()),
+        ("amount", pyarrow.string()),
+        ("timestamp", pyarrow.timestamp("us", tz="UTC")),
+    ])
+    rows = 0
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        for chunk in chunks:
+            columns = list(zip(*chunk))
+            writer.write_table(pyarrow.table([
+                [str(v) for v in columns[0]],
+                [str(v) for v in columns[1]],
+                [str(v) for v in columns[2]],
+                [str(v) for v in columns[3]],
+                list(columns[4]),
+            ], schema=schema))
+            rows += len(chunk)
+    return rows
+
+
+WRITERS = {"csv": _write_csv, "ndjson": _write_ndjson, "parquet": _write_parquet}
+
+
+def run_export(export_job_id=None, shard: Optional[str] = None, stale_after: Optional[timedelta] = None) -> bool:
+    """
+    Claim and run one pending export job.
+
+    Args:
+        export_job_id (UUID): The job to run. If None, the oldest pending job is run.
+        shard (str): The shard of the job. Defaults to the shard holding `export_job_id`, or to
+            the default shard if no job is given.
+        stale_after (timedelta): Also run a job that has been running for longer than that.
+
+    Returns:
+        bool: Whether a job was claimed.
+    """
+    if shard is None and export_job_id is not None:
+        shard = locate(ExportJob, export_job_id)
+        if shard is None:
+            return False
+    with database.SessionLocal(shard=shard) as db:
+        job = claim_export_job(db, export_job_id, stale_after)
+        if job is None:
+            return False
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        path = os.path.abspath(os.path.join(EXPORT_DIR, f"{job.id}.{EXTENSIONS[job.format]}"))
+        # A worker whose job was claimed again may still be writing, so each one has its own file
+        part = f"{path}.{os.getpid()}.part"
+        try:
+            with database.SessionLocal(shard=shard) as stream_db:
+                chunks = stream_account_transfers(stream_db, job.account_id, EXPORT_CHUNK_SIZE)
+                rows = WRITERS[job.format](part, chunks)
+            os.replace(part, path)
+        except Exception as e:
+            logger.exception("export %s failed", job.id)
+            if os.path.exists(part):
+                os.remove(part)
+            finish_export_job(db, job, rows=0, error=str(e).splitlines()[0] if str(e) else type(e).__name__)
+            return True
+        finish_export_job(db, job, rows=rows, path=path)
+        return True
+
+
+def submit(export_job_id) -> None:
+    """
+    Run an export job in the background worker pool.
+
+    The pool uses spawned processes, so the worker never inherits the threads, event loop or
+    database connections of the API process.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=EXPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    _pool.submit(run_export, export_job_id)
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.INFO)
+    stale_after = timedelta(seconds=EXPORT_TIMEOUT)
+    for shard in database.engines:
+        while run_export(shard=shard, stale_after=stale_after):
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
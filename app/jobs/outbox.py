@@ -0,0 +1,83 @@
+"""
+Outbox relay.
+
+Delivers the credits of cross-shard transfers that could not be delivered right after their
+debit, because the shard of the recipient was unreachable or the server stopped in between (see
+app.crud.outbox). Entries are claimed in batches with `FOR UPDATE SKIP LOCKED` and a lease, so
+several relays can run at the same time; a failed delivery is retried with exponential backoff.
+
+Usage:
+    python -m app.jobs.outbox [--batch-size 100] [--poll-interval 5] [--lease 60] [--once]
+                              [--shard NAME ...]
+"""
+import argparse
+import logging
+import time
+from datetime import timedelta
+from typing import Optional
+
+from app import database
+from app.crud.outbox import claim_pending_deliveries, deliver_transfer, record_delivery_failure
+
+logger = logging.getLogger(__name__)
+
+
+def run_relay(batch_size: int = 100, poll_interval: float = 5.0, lease: float = 60.0, once: bool = False,
+              shards: Optional[list[str]] = None) -> dict:
+    """
+    Deliver due outbox entries until none are left (with `once`) or forever.
+
+    Args:
+        batch_size (int): Maximum number of entries claimed per transaction.
+        poll_interval (float): Seconds to sleep when no more entries are due.
+        lease (float): Seconds a claimed entry is skipped by other relays while it is delivered.
+        once (bool): Return as soon as no more entries are due.
+        shards (list[str]): The shards served. Defaults to all of them.
+
+    Returns:
+        dict: The number of entries delivered and of failed deliveries.
+    """
+    stats = {"delivered": 0, "failed": 0}
+    while True:
+        drained = True
+        for shard in shards or list(database.engines):
+            with database.SessionLocal(shard=shard) as db:
+                transfer_ids = claim_pending_deliveries(db, batch_size, timedelta(seconds=lease))
+                for transfer_id in transfer_ids:
+                    try:
+                        if deliver_transfer(shard, transfer_id):
+                            stats["delivered"] += 1
+                    except Exception as e:
+                        stats["failed"] += 1
+                        logger.warning("delivery of transfer %s on %s failed: %s", transfer_id, shard, e)
+                        record_delivery_failure(db, transfer_id, e)
+            if transfer_ids:
+                logger.info("outbox on %s: %d claimed", shard, len(transfer_ids))
+            if len(transfer_ids) >= batch_size:
+                drained = False
+        if drained:
+            if once:
+                return stats
+            time.sleep(poll_interval)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Deliver the credits of cross-shard transfers.")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--poll-interval", type=float, default=5.0)
+    parser.add_argument("--lease", type=float, default=60.0,
+                        help="Seconds a claimed entry is hidden from other relays")
+    parser.add_argument("--once", action="store_true", help="Exit when no more entries are due")
+    parser.add_argument("--shard", action="append", choices=list(database.engines),
+                        help="Shard to serve, may be repeated (default: all)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    stats = run_relay(batch_size=args.batch_size, poll_interval=args.poll_interval, lease=args.lease,
+                      once=args.once, shards=args.shard)
+    print(f"delivered: {stats['delivered']}, failed: {stats['failed']}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
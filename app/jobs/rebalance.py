@@ -0,0 +1,230 @@
+"""
+Shard rebalance job.
+
+After a shard is added to SHARD_URLS, or listed in SHARD_RETIRED, the shard map assigns some
+slots to other shards than before (see app.sharding). This job moves every customer that is not
+on the shard owning its slot, together with its accounts, their transfers, transfer summaries,
+balance checkpoints, standing orders, export jobs and outbox entries, one customer at a time.
+
+A customer is moved while its rows on the old shard are locked, so its accounts take no transfer
+in the meantime: a transfer arriving during the move waits, finds the account gone and fails with
+404 (a cross-shard credit is retried by the outbox relay and then goes to the new shard). The
+copy is committed on the new shard before the old rows are deleted, and lookups go to the shard
+owning the slot first, so the customer is never missing. Customers with a cross-shard transfer
+still in flight are skipped and moved by the next run.
+
+Usage:
+    python -m app.jobs.rebalance [--dry-run] [--limit 1000]
+"""
+import argparse
+import logging
+from typing import Optional
+from uuid import UUID
+
+from sqlalchemy import Connection, exists, or_, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+
+from app import database
+from app.migrations import prepare_database
+from app.models.models import (Account, BalanceCheckpoint, Customer, ExportJob, RecurringTransfer, Transfer,
+                               TransferEdge, TransferOutbox)
+
+logger = logging.getLogger(__name__)
+
+customers = Customer.__table__
+accounts = Account.__table__
+transfers = Transfer.__table__
+edges = TransferEdge.__table__
+outbox = TransferOutbox.__table__
+recurring_transfers = RecurringTransfer.__table__
+export_jobs = ExportJob.__table__
+checkpoints = BalanceCheckpoint.__table__
+
+
+def misplaced_customers(shard: str) -> list[UUID]:
+    """
+    Get the IDs of the customers on a shard that belong on another one.
+    """
+    with database.engines[shard].connect() as conn:
+        return [
+            customer_id for customer_id in conn.execute(select(customers.c.id).order_by(customers.c.id)).scalars()
+            if database.shard_map.shard_for(customer_id) != shard
+        ]
+
+
+def plan() -> dict[tuple[str, str], int]:
+    """
+    Count the customers to move, per pair of shards.
+
+    Returns:
+        dict: `(source, target)` pairs mapped to the number of customers moving between them.
+    """
+    moves: dict[tuple[str, str], int] = {}
+    for shard in database.engines:
+        for customer_id in misplaced_customers(shard):
+            key = (shard, database.shard_map.shard_for(customer_id))
+            moves[key] = moves.get(key, 0) + 1
+    return moves
+
+
+def _in_flight(account_ids: list[UUID]) -> bool:
+    # Undelivered cross-shard transfers from or to the accounts, on the shard of their sender
+    involved = or_(transfers.c.from_account_id.in_(account_ids), transfers.c.to_account_id.in_(account_ids))
+    pending = (
+        select(outbox.c.transfer_id)
+        .join(transfers, transfers.c.id == outbox.c.transfer_id)
+        .where(outbox.c.delivered_at.is_(None), involved)
+        .limit(1)
+    )
+    for shard_engine in database.engines.values():
+        with shard_engine.connect() as conn:
+            if conn.execute(pending).first() is not None:
+                return True
+    return False
+
+
+def _copy(conn: Connection, table, rows: list[dict]) -> None:
+    # Rows already on the target are kept: a cross-shard transfer and its summary are stored on
+    # both shards, and anything else there is at least as recent as the copy being moved
+    if rows:
+        keys = [column.name for column in table.primary_key]
+        conn.execute(insert(table).values(rows).on_conflict_do_nothing(index_elements=keys))
+
+
+def _rows(conn: Connection, statement) -> list[dict]:
+    return [dict(row) for row in conn.execute(statement).mappings()]
+
+
+def move_customer(customer_id: UUID, source: str, target: str) -> bool:
+    """
+    Move a customer and everything that belongs to it from one shard to another.
+
+    The rows are read and deleted on the source in one transaction, which holds the locks of the
+    customer and its accounts until the copy has been committed on the target.
+
+    If the customer is already on the target, an earlier move committed its copy there but failed
+    to delete the source. The target copy has been the live one since, as the target owns the
+    slot, so only the stale source rows are deleted.
+
+    Args:
+        customer_id (UUID): The ID of the customer.
+        source (str): The shard the customer is on.
+        target (str): The shard to move it to.
+
+    Returns:
+        bool: False if the customer was skipped because it is gone or has transfers in flight.
+
+    Raises:
+        IntegrityError: If a row of another table still references one of its accounts, such as
+            an accrual run posting from or to it.
+    """
+    with database.engines[source].connect() as conn:
+        customer = _rows(conn, select(customers).where(customers.c.id == customer_id).with_for_update())
+        if not customer:
+            conn.rollback()
+            return False
+        account_rows = _rows(conn, select(accounts).where(accounts.c.customer_id == customer_id)
+                             .order_by(accounts.c.id).with_for_update())
+        account_ids = [row["id"] for row in account_rows]
+        if account_ids and _in_flight(account_ids):
+            conn.rollback()
+            return False
+
+        involved_transfers = or_(transfers.c.from_account_id.in_(account_ids),
+                                 transfers.c.to_account_id.in_(account_ids))
+        involved_edges = or_(edges.c.from_account_id.in_(account_ids), edges.c.to_account_id.in_(account_ids))
+        transfer_rows = _rows(conn, select(transfers).where(involved_transfers))
+        edge_rows = _rows(conn, select(edges).where(involved_edges))
+        outbox_rows = _rows(conn, select(outbox).join(transfers, transfers.c.id == outbox.c.transfer_id)
+                            .where(transfers.c.from_account_id.in_(account_ids)))
+        recurring_rows = _rows(conn, select(recurring_transfers)
+                               .where(recurring_transfers.c.from_account_id.in_(account_ids)))
+        export_rows = _rows(conn, select(export_jobs).where(export_jobs.c.account_id.in_(account_ids)))
+        checkpoint_rows = _rows(conn, select(checkpoints).where(checkpoints.c.account_id.in_(account_ids)))
+
+        # Delete first, so that anything still referencing the accounts fails the move before
+        # the copy is committed. Transfers and summaries stay as long as one of their accounts
+        # remains on the source.
+        def leaves(account_id):
+            return or_(account_id.in_(account_ids),
+                       ~exists(select(accounts.c.id).where(accounts.c.id == account_id)))
+
+        conn.execute(outbox.delete().where(outbox.c.transfer_id.in_([row["transfer_id"] for row in outbox_rows])))
+        conn.execute(recurring_transfers.delete().where(recurring_transfers.c.from_account_id.in_(account_ids)))
+        conn.execute(export_jobs.delete().where(export_jobs.c.account_id.in_(account_ids)))
+        conn.execute(checkpoints.delete().where(checkpoints.c.account_id.in_(account_ids)))
+        conn.execute(transfers.delete().where(
+            involved_transfers, leaves(transfers.c.from_account_id), leaves(transfers.c.to_account_id),
+        ))
+        conn.execute(edges.delete().where(
+            involved_edges, leaves(edges.c.from_account_id), leaves(edges.c.to_account_id),
+        ))
+        conn.execute(accounts.delete().where(accounts.c.id.in_(account_ids)))
+        conn.execute(customers.delete().where(customers.c.id == customer_id))
+
+        with database.engines[target].begin() as target_conn:
+            copied = target_conn.execute(select(customers.c.id).where(customers.c.id == customer_id)).first()
+            if copied is None:
+                _copy(target_conn, customers, customer)
+                _copy(target_conn, accounts, account_rows)
+                _copy(target_conn, transfers, transfer_rows)
+                _copy(target_conn, outbox, outbox_rows)
+                _copy(target_conn, recurring_transfers, recurring_rows)
+                _copy(target_conn, export_jobs, export_rows)
+                _copy(target_conn, checkpoints, checkpoint_rows)
+                _copy(target_conn, edges, edge_rows)
+        conn.commit()
+    return True
+
+
+def run(dry_run: bool = False, limit: Optional[int] = None) -> dict:
+    """
+    Move the customers that are not on the shard owning their slot.
+
+    Args:
+        dry_run (bool): Only count the customers to move.
+        limit (int): Maximum number of customers to move in this run.
+
+    Returns:
+        dict: Numbers of customers moved, skipped and failed, or the plan with `dry_run`.
+    """
+    if dry_run:
+        return {f"{source} -> {target}": count for (source, target), count in sorted(plan().items())}
+
+    stats = {"moved": 0, "skipped": 0, "failed": 0}
+    for source in database.engines:
+        for customer_id in misplaced_customers(source):
+            if limit is not None and stats["moved"] >= limit:
+                return stats
+            target = database.shard_map.shard_for(customer_id)
+            try:
+                moved = move_customer(customer_id, source, target)
+            except IntegrityError as e:
+                stats["failed"] += 1
+                logger.warning("customer %s cannot leave %s: %s", customer_id, source, str(e.orig).splitlines()[0])
+                continue
+            if moved:
+                stats["moved"] += 1
+                logger.info("moved customer %s from %s to %s", customer_id, source, target)
+            else:
+                stats["skipped"] += 1
+    return stats
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Move customers to the shard owning their slot.")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the customers to move")
+    parser.add_argument("--limit", type=int, default=None, help="Maximum number of customers to move")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    for shard_engine in database.engines.values():
+        prepare_database(shard_engine)
+    for key, value in run(dry_run=args.dry_run, limit=args.limit).items():
+        print(f"{key}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
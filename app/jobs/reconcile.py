@@ -0,0 +1,317 @@
+"""
+Ledger reconciliation job.
+
+Checks that every account balance equals its opening deposit plus the net sum of its transfers,
+and that the total of all balances equals the total of all opening deposits (transfers move money
+between accounts but never create or destroy it).
+
+The account keyspace is split into contiguous ID ranges that are reconciled in a process pool.
+Each range is checked with one set-based aggregate query whose discrepancies are streamed
+straight to a per-range NDJSON file, so memory use does not depend on the number of accounts.
+Progress is recorded in `state.json` in the output directory, which allows an interrupted run to
+be resumed and an incremental run to check only accounts written since the last completed run.
+
+An account's `updated_at` is taken from the application clock when the write is flushed, which
+can be well before it commits. A write flushed before the previous run started but committed only
+after that run read the account is invisible to that run, and its `updated_at` is earlier than the
+start of the run. Incremental runs therefore go back a settling delay (`--settle`, default 300
+seconds) before the start of the previous run, so such an account is checked by the next run.
+
+A run checks one shard; run it once per shard, each with its own output directory.
+
+Usage:
+    python -m app.jobs.reconcile --out reconciliation/ [--workers 8] [--partitions 64]
+                                 [--resume] [--incremental] [--settle 300] [--shard NAME]
+"""
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from uuid import UUID
+
+from sqlalchemy import func, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from app import database
+from app.models.models import Account, Transfer
+
+STATE_FILE = "state.json"
+SUMMARY_FILE = "summary.json"
+
+# Target number of sampled IDs per partition used to pick the partition boundaries
+SAMPLE_ROWS_PER_PARTITION = 1000
+
+
+def partition_bounds(conn: Connection, partitions: int) -> list[tuple[Optional[str], Optional[str]]]:
+    """
+    Split the account keyspace into ranges holding roughly the same number of accounts.
+
+    Boundaries are quantiles of a random sample of account IDs, so the split stays balanced
+    whatever the distribution of the IDs is (random or time-ordered UUIDs).
+
+    Args:
+        conn (Connection): A database connection.
+        partitions (int): The number of ranges to produce.
+
+    Returns:
+        list[tuple]: `(lo, hi)` pairs covering the whole keyspace. `lo` is inclusive, `hi` is
+        exclusive and `None` means unbounded.
+    """
+    if partitions <= 1:
+        return [(None, None)]
+    estimated_rows = conn.execute(
+        text("SELECT GREATEST(reltuples, 0) FROM pg_class WHERE oid = 'accounts'::regclass")
+    ).scalar() or 0
+    sample_percent = 100.0
+    if estimated_rows:
+        sample_percent = min(100.0, 100.0 * partitions * SAMPLE_ROWS_PER_PARTITION / estimated_rows)
+    fractions = [i / partitions for i in range(1, partitions)]
+    quantiles = conn.execute(
+        text("SELECT percentile_disc(CAST(:fractions AS float8[])) WITHIN GROUP (ORDER BY id) "
+             f"FROM accounts TABLESAMPLE BERNOULLI ({sample_percent})"),
+        {"fractions": fractions},
+    ).scalar()
+    cuts = sorted({str(cut) for cut in quantiles or [] if cut is not None}, key=UUID)
+    edges = [None, *cuts, None]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def _range(column, lo: Optional[str], hi: Optional[str]) -> list:
+    conditions = []
+    if lo is not None:
+        conditions.append(column >= UUID(lo))
+    if hi is not None:
+        conditions.append(column < UUID(hi))
+    return conditions
+
+
+def discrepancy_query(lo: Optional[str], hi: Optional[str], since: Optional[datetime]):
+    """
+    Build the set-based query returning the accounts of a range whose balance does not match
+    their opening deposit plus incoming minus outgoing transfers.
+
+    Args:
+        lo (str): Inclusive lower bound of the account ID range, or None.
+        hi (str): Exclusive upper bound of the account ID range, or None.
+        since (datetime): If given, only accounts written at or after this time are checked.
+
+    Returns:
+        Select: A query yielding `(id, balance, expected)` rows.
+    """
+    scope_conditions = _range(Account.id, lo, hi)
+    if since is not None:
+        scope_conditions.append(Account.updated_at >= since)
+    scope = (
+        select(Account.id, Account.balance, Account.initial_balance)
+        .where(*scope_conditions)
+        .cte("scope")
+    )
+    credits = (
+        select(Transfer.to_account_id.label("id"), func.sum(Transfer.amount).label("total"))
+        .join(scope, scope.c.id == Transfer.to_account_id)
+        .where(*_range(Transfer.to_account_id, lo, hi))
+        .group_by(Transfer.to_account_id)
+        .subquery("credits")
+    )
+    debits = (
+        select(Transfer.from_account_id.label("id"), func.sum(Transfer.amount).label("total"))
+        .join(scope, scope.c.id == Transfer.from_account_id)
+        .where(*_range(Transfer.from_account_id, lo, hi))
+        .group_by(Transfer.from_account_id)
+        .subquery("debits")
+    )
+    expected = (
+        func.coalesce(scope.c.initial_balance, 0)
+        + func.coalesce(credits.c.total, 0)
+        - func.coalesce(debits.c.total, 0)
+    )
+    return (
+        select(scope.c.id, scope.c.balance, expected.label("expected"))
+        .outerjoin(credits, credits.c.id == scope.c.id)
+        .outerjoin(debits, debits.c.id == scope.c.id)
+        .where(scope.c.balance.is_distinct_from(expected))
+    )
+
+
+def reconcile_partition(index: int, lo: Optional[str], hi: Optional[str],
+                        since: Optional[str], out_dir: str, shard: Optional[str] = None) -> dict:
+    """
+    Reconcile one account ID range and write its discrepancies to `part-<index>.ndjson`.
+
+    Returns:
+        dict: The partition index with the number of accounts checked and discrepancies found.
+    """
+    since_dt = datetime.fromisoformat(since) if since else None
+    path = os.path.join(out_dir, f"part-{index:05d}.ndjson")
+    checked = 0
+    discrepancies = 0
+    with database.engines[shard or database.DEFAULT_SHARD].connect() as conn:
+        count_conditions = _range(Account.id, lo, hi)
+        if since_dt is not None:
+            count_conditions.append(Account.updated_at >= since_dt)
+        checked = conn.execute(select(func.count()).select_from(Account).where(*count_conditions)).scalar()
+
+        result = conn.execution_options(stream_results=True, yield_per=1000).execute(
+            discrepancy_query(lo, hi, since_dt)
+        )
+        with open(path + ".tmp", "w") as report:
+            for account_id, balance, expected in result:
+                report.write(json.dumps({
+                    "account_id": str(account_id),
+                    "balance": str(balance),
+                    "expected": str(expected),
+                    "difference": str(balance - expected),
+                }) + "\n")
+                discrepancies += 1
+    # Publish the part atomically so a resumed run never sees a half-written report
+    os.replace(path + ".tmp", path)
+    return {"index": index, "checked": checked, "discrepancies": discrepancies}
+
+
+def check_conservation(conn: Connection, cross_shard: bool = False) -> dict:
+    """
+    Check that the sum of all balances equals the sum of all opening deposits.
+
+    With `cross_shard`, the transfers received from and sent to accounts on other shards move
+    money into and out of the shard, so their net amount is added to the expected total.
+    """
+    total_balance, total_initial = conn.execute(
+        select(func.coalesce(func.sum(Account.balance), 0), func.coalesce(func.sum(Account.initial_balance), 0))
+    ).one()
+    summary = {
+        "total_balance": str(total_balance),
+        "total_initial_balance": str(total_initial),
+    }
+    expected = total_initial
+    if cross_shard:
+        def local(account_id):
+            return select(Account.id).where(Account.id == account_id).exists()
+
+        received, sent = conn.execute(select(
+            func.coalesce(func.sum(Transfer.amount).filter(~local(Transfer.from_account_id)), 0),
+            func.coalesce(func.sum(Transfer.amount).filter(~local(Transfer.to_account_id)), 0),
+        )).one()
+        summary["received_from_other_shards"] = str(received)
+        summary["sent_to_other_shards"] = str(sent)
+        expected = total_initial + received - sent
+    summary["conserved"] = total_balance == expected
+    return summary
+
+
+def _load_state(out_dir: str) -> dict:
+    path = os.path.join(out_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_state(out_dir: str, state: dict) -> None:
+    path = os.path.join(out_dir, STATE_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def run(out_dir: str, workers: int = os.cpu_count() or 1, partitions: int = 64,
+        resume: bool = False, incremental: bool = False, settle: float = 300.0, engine: Engine = None,
+        shard: Optional[str] = None) -> dict:
+    """
+    Run (or resume) a reconciliation and write `summary.json` to `out_dir`.
+
+    Args:
+        out_dir (str): Directory holding the state file and the discrepancy report.
+        workers (int): Number of worker processes.
+        partitions (int): Number of account ID ranges to split the work into.
+        resume (bool): Continue the unfinished run recorded in the state file.
+        incremental (bool): Only check accounts written since the last completed run started.
+        settle (float): Seconds a write may take to commit after it was flushed; an incremental
+            run also checks the accounts written this long before the last completed run started.
+        engine (Engine): Engine used by the coordinating process. Defaults to the engine of the shard.
+        shard (str): The shard to reconcile. Defaults to the default shard.
+
+    Returns:
+        dict: The run summary.
+    """
+    shard = shard or database.DEFAULT_SHARD
+    engine = engine or database.engines[shard]
+    os.makedirs(out_dir, exist_ok=True)
+    state = _load_state(out_dir)
+
+    if not (resume and state.get("run")):
+        with engine.connect() as conn:
+            started_at = conn.execute(select(func.now())).scalar()
+            bounds = partition_bounds(conn, partitions)
+        since = state.get("last_completed_started_at") if incremental else None
+        if since is not None:
+            since = (datetime.fromisoformat(since) - timedelta(seconds=settle)).isoformat()
+        for name in os.listdir(out_dir):
+            if name.startswith("part-"):
+                os.remove(os.path.join(out_dir, name))
+        state["run"] = {
+            "started_at": started_at.isoformat(),
+            "since": since,
+            "bounds": bounds,
+            "completed": {},
+        }
+        _save_state(out_dir, state)
+
+    current = state["run"]
+    pending = [
+        (index, lo, hi) for index, (lo, hi) in enumerate(current["bounds"])
+        if str(index) not in current["completed"]
+    ]
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [
+            pool.submit(reconcile_partition, index, lo, hi, current["since"], out_dir, shard)
+            for index, lo, hi in pending
+        ]
+        for future in as_completed(futures):
+            outcome = future.result()
+            current["completed"][str(outcome["index"])] = outcome
+            _save_state(out_dir, state)
+
+    with engine.connect() as conn:
+        conservation = check_conservation(conn, cross_shard=len(database.engines) > 1)
+
+    summary = {
+        "started_at": current["started_at"],
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "incremental_since": current["since"],
+        "partitions": len(current["bounds"]),
+        "accounts_checked": sum(p["checked"] for p in current["completed"].values()),
+        "discrepancies": sum(p["discrepancies"] for p in current["completed"].values()),
+        **conservation,
+    }
+    with open(os.path.join(out_dir, SUMMARY_FILE), "w") as f:
+        json.dump(summary, f, indent=2)
+
+    state["last_completed_started_at"] = current["started_at"]
+    del state["run"]
+    _save_state(out_dir, state)
+    return summary
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Reconcile account balances against the transfer ledger.")
+    parser.add_argument("--out", required=True, help="Directory for the state file and discrepancy report")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--partitions", type=int, default=64)
+    parser.add_argument("--resume", action="store_true", help="Resume the unfinished run in --out")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only check accounts written since the last completed run")
+    parser.add_argument("--settle", type=float, default=300.0,
+                        help="Seconds a write may take to commit after it was flushed")
+    parser.add_argument("--shard", choices=list(database.engines), default=database.DEFAULT_SHARD)
+    args = parser.parse_args(argv)
+
+    summary = run(args.out, workers=args.workers, partitions=args.partitions,
+                  resume=args.resume, incremental=args.incremental, settle=args.settle, shard=args.shard)
+    print(json.dumps(summary, indent=2))
+    return 0 if summary["discrepancies"] == 0 and summary["conserved"] else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
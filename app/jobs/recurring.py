@@ -0,0 +1,89 @@
+"""
+Recurring transfer worker.
+
+Repeatedly claims batches of due standing orders with `FOR UPDATE SKIP LOCKED` and executes them
+through the regular transfer logic. Several worker processes, on one or many machines, can run at
+the same time: each due order is locked by exactly one of them. Standing orders live on the shard
+of the account they debit; a worker serves every shard in turn, or only those given with --shard.
+
+Usage:
+    python -m app.jobs.recurring [--workers 4] [--batch-size 500] [--poll-interval 5] [--once]
+                                 [--shard NAME ...]
+"""
+import argparse
+import logging
+import multiprocessing
+import time
+from typing import Optional
+
+from app import database
+from app.crud.recurring_transfer import execute_recurring_transfers
+
+logger = logging.getLogger(__name__)
+
+
+def run_worker(batch_size: int = 500, poll_interval: float = 5.0, once: bool = False,
+               shards: Optional[list[str]] = None) -> int:
+    """
+    Execute due standing orders until none are left (with `once`) or forever.
+
+    Full batches are followed immediately by the next one, so a month-end backlog is drained as
+    fast as the database allows; the worker only sleeps when the batches of all its shards come
+    back short.
+
+    Args:
+        batch_size (int): Maximum number of orders claimed per transaction.
+        poll_interval (float): Seconds to sleep when no more orders are due.
+        once (bool): Return as soon as no more orders are due.
+        shards (list[str]): The shards served. Defaults to all of them.
+
+    Returns:
+        int: The number of orders executed.
+    """
+    executed = 0
+    while True:
+        drained = True
+        for shard in shards or list(database.engines):
+            with database.SessionLocal(shard=shard) as db:
+                stats = execute_recurring_transfers(db, batch_size=batch_size)
+            executed += stats["executed"]
+            if stats["claimed"]:
+                logger.info("recurring transfers on %s: %d claimed, %d executed, %d failed",
+                            shard, stats["claimed"], stats["executed"], stats["failed"])
+            if stats["claimed"] >= batch_size:
+                drained = False
+        if drained:
+            if once:
+                return executed
+            time.sleep(poll_interval)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Execute due recurring transfers.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--poll-interval", type=float, default=5.0)
+    parser.add_argument("--once", action="store_true", help="Exit when no more orders are due")
+    parser.add_argument("--shard", action="append", choices=list(database.engines),
+                        help="Shard to serve, may be repeated (default: all)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.workers <= 1:
+        run_worker(batch_size=args.batch_size, poll_interval=args.poll_interval, once=args.once, shards=args.shard)
+        return 0
+
+    processes = [
+        multiprocessing.Process(target=run_worker,
+                                args=(args.batch_size, args.poll_interval, args.once, args.shard))
+        for _ in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,17 +1,40 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, Request
+from app import slow_queries, velocity
 from app.api.api import api_router
-from app.database import engine, Base
+from app.database import engines, SessionLocal
+from app.migrations import prepare_database
+
+# Create missing tables, bring tables created by earlier releases up to date
+# and check that the money storage layout matches the configuration, on every shard
+for shard_engine in engines.values():
+    prepare_database(shard_engine)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the velocity counters of this worker from the transfers still inside their windows
+    velocity.configure(velocity.VELOCITY_LIMITS)
+    for shard in engines:
+        with SessionLocal(shard=shard) as db:
+            velocity.limiter.warm(db, local_senders_only=len(engines) > 1)
+    yield
+
+
+async def track_route(request: Request) -> None:
+    # Tag the statements of this request with its route in the slow-query log. Set from an async
+    # dependency so that the value is copied into the thread that runs a sync endpoint.
+    route = request.scope.get("route")
+    slow_queries.current_route.set(f"{request.method} {route.path if route else request.url.path}")
 
-# Create all database tables defined in the metadata
-Base.metadata.create_all(bind=engine)
 
 # Initialize the FastAPI application with a title
-app = FastAPI(title="Bank API")
+app = FastAPI(title="Bank API", lifespan=lifespan, dependencies=[Depends(track_route)])
 
 # Include the API router to handle all API endpoints
 app.include_router(api_router)
 
 if __name__ == "__main__":
-    import uvicorn
-    # Run the FastAPI application using Uvicorn server
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    from app.server import main
+    # Run the FastAPI application with the production launcher
+    raise SystemExit(main())
@@ -0,0 +1,242 @@
+import argparse
+from typing import Optional
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from app import money
+
+# Ordered list of (migration_id, statements). `Base.metadata.create_all` only creates
+# missing tables, so changes to existing tables are applied here. Every statement must be
+# idempotent because fresh databases already get the current layout from `create_all`.
+MIGRATIONS = [
+    ("0001_account_version", [
+        "ALTER TABLE accounts ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1",
+    ]),
+    ("0002_reconciliation", [
+        "CREATE INDEX IF NOT EXISTS ix_transfers_from_account_id ON transfers (from_account_id)",
+        "CREATE INDEX IF NOT EXISTS ix_transfers_to_account_id ON transfers (to_account_id)",
+        "ALTER TABLE accounts ADD COLUMN IF NOT EXISTS initial_balance NUMERIC(36, 20)",
+        "ALTER TABLE accounts ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ",
+        # The opening deposit of existing accounts was never stored; derive it from the
+        # current balance so that reconciliation starts from today's ledger state.
+        "UPDATE accounts a SET initial_balance = a.balance"
+        " - COALESCE((SELECT SUM(t.amount) FROM transfers t WHERE t.to_account_id = a.id), 0)"
+        " + COALESCE((SELECT SUM(t.amount) FROM transfers t WHERE t.from_account_id = a.id), 0)"
+        " WHERE a.initial_balance IS NULL",
+        "UPDATE accounts SET updated_at = now() WHERE updated_at IS NULL",
+    ]),
+    # The primary keys used to be declared with index=True, which created a second index
+    # duplicating the one behind the primary key constraint.
+    ("0003_drop_duplicate_pk_indexes", [
+        "DROP INDEX IF EXISTS ix_customers_id",
+        "DROP INDEX IF EXISTS ix_accounts_id",
+        "DROP INDEX IF EXISTS ix_transfers_id",
+    ]),
+    ("0004_transfer_timestamp_index", [
+        "CREATE INDEX IF NOT EXISTS ix_transfers_timestamp ON transfers (timestamp)",
+    ]),
+    # transfer_edges is created by create_all; summarize the history recorded before it existed
+    ("0005_transfer_edges", [
+        "INSERT INTO transfer_edges (from_account_id, to_account_id, transfer_count, total_amount, last_transfer_at)"
+        " SELECT from_account_id, to_account_id, count(*), sum(amount), max(timestamp) FROM transfers"
+        " GROUP BY from_account_id, to_account_id"
+        " ON CONFLICT (from_account_id, to_account_id) DO NOTHING",
+    ]),
+    # A transfer between shards is stored on both, so its counterparty may live in another database
+    ("0006_cross_shard_transfers", [
+        "ALTER TABLE transfers DROP CONSTRAINT IF EXISTS transfers_from_account_id_fkey",
+        "ALTER TABLE transfers DROP CONSTRAINT IF EXISTS transfers_to_account_id_fkey",
+        "ALTER TABLE transfer_edges DROP CONSTRAINT IF EXISTS transfer_edges_from_account_id_fkey",
+        "ALTER TABLE transfer_edges DROP CONSTRAINT IF EXISTS transfer_edges_to_account_id_fkey",
+        "ALTER TABLE recurring_transfers DROP CONSTRAINT IF EXISTS recurring_transfers_to_account_id_fkey",
+    ]),
+    # Point-in-time balances scan the transfers of an account in a time range; the composite
+    # indexes replace the single-column ones
+    ("0007_transfer_account_timestamp_indexes", [
+        "CREATE INDEX IF NOT EXISTS ix_transfers_from_account_id_timestamp ON transfers (from_account_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS ix_transfers_to_account_id_timestamp ON transfers (to_account_id, timestamp)",
+        "DROP INDEX IF EXISTS ix_transfers_from_account_id",
+        "DROP INDEX IF EXISTS ix_transfers_to_account_id",
+    ]),
+]
+
+# Columns stored with the app.money.Money type
+MONEY_COLUMNS = [
+    ("accounts", "balance"),
+    ("accounts", "initial_balance"),
+    ("transfers", "amount"),
+    ("recurring_transfers", "amount"),
+    ("transfer_edges", "total_amount"),
+    ("accrual_runs", "fee"),
+    ("accrual_runs", "fee_waiver_balance"),
+    ("accrual_runs", "interest_total"),
+    ("accrual_runs", "fee_total"),
+    ("balance_checkpoints", "balance"),
+]
+
+# Key of the advisory lock serializing schema setup between processes starting at the same time
+SCHEMA_LOCK_ID = 0x42616E6B
+
+
+def prepare_database(engine: Engine) -> None:
+    """
+    Create missing tables, apply pending migrations and check the money storage layout.
+
+    Every server worker runs this on startup, so it is serialized with a PostgreSQL advisory lock:
+    the first process does the work and the others find nothing left to do.
+
+    Args:
+        engine (Engine): The engine of the database to prepare.
+    """
+    from app.database import Base
+    import app.models.models  # noqa: F401  (registers the tables with Base.metadata)
+
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": SCHEMA_LOCK_ID})
+        try:
+            Base.metadata.create_all(bind=conn)
+            conn.commit()
+            run_migrations(engine)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": SCHEMA_LOCK_ID})
+            conn.commit()
+    check_money_storage(engine)
+
+
+def run_migrations(engine: Engine) -> list[str]:
+    """
+    Apply any migrations that have not yet been recorded in the `schema_migrations` table.
+
+    Args:
+        engine (Engine): The engine to migrate.
+
+    Returns:
+        list[str]: The IDs of the migrations applied by this call.
+    """
+    applied = []
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "id VARCHAR(100) PRIMARY KEY, "
+            "applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+        ))
+        done = set(conn.execute(text("SELECT id FROM schema_migrations")).scalars())
+        for migration_id, statements in MIGRATIONS:
+            if migration_id in done:
+                continue
+            for statement in statements:
+                conn.execute(text(statement))
+            conn.execute(text("INSERT INTO schema_migrations (id) VALUES (:id)"), {"id": migration_id})
+            applied.append(migration_id)
+    return applied
+
+
+def money_storage_layout(conn: Connection) -> dict[tuple[str, str], str]:
+    """
+    Get the current storage layout of every existing money column.
+
+    Returns:
+        dict: `money.INT64` or `money.NUMERIC` keyed by `(table, column)`.
+    """
+    rows = conn.execute(text(
+        "SELECT table_name, column_name, data_type FROM information_schema.columns "
+        "WHERE table_schema = current_schema()"
+    ))
+    types = {(table, column): data_type for table, column, data_type in rows}
+    return {
+        key: money.INT64 if types[key] == "bigint" else money.NUMERIC
+        for key in MONEY_COLUMNS if key in types
+    }
+
+
+def check_money_storage(engine: Engine) -> None:
+    """
+    Refuse to start if the database layout does not match `MONEY_STORAGE`, since reading minor
+    units as NUMERIC values (or the reverse) would misstate every balance.
+
+    Raises:
+        RuntimeError: If a money column is stored in a different layout than configured.
+    """
+    with engine.connect() as conn:
+        layout = money_storage_layout(conn)
+    mismatched = [f"{table}.{column}" for (table, column), kind in layout.items() if kind != money.MONEY_STORAGE]
+    if mismatched:
+        raise RuntimeError(
+            f"Money columns {', '.join(mismatched)} are not stored as {money.MONEY_STORAGE}; run "
+            f"`python -m app.migrations convert-money --to {money.MONEY_STORAGE}` first"
+        )
+
+
+def convert_money_storage(engine: Engine, to: str, scale: Optional[int] = None) -> list[str]:
+    """
+    Convert all money columns between NUMERIC(36, 20) and BIGINT minor units in one transaction.
+
+    Converting to int64 is refused if any stored value has more decimal places than `scale` or
+    does not fit in 64 bits, so no value is ever rounded. Each conversion rewrites its table under
+    an exclusive lock; schedule it in a maintenance window.
+
+    Args:
+        engine (Engine): The engine of the database to convert.
+        to (str): `money.INT64` or `money.NUMERIC`.
+        scale (int): Decimal places of the minor unit. Defaults to `money.MINOR_UNIT_SCALE`.
+
+    Returns:
+        list[str]: The converted columns as `table.column`.
+
+    Raises:
+        ValueError: If a value cannot be represented exactly in the target layout.
+    """
+    scale = money.MINOR_UNIT_SCALE if scale is None else scale
+    factor = f"power(10::numeric, {int(scale)})"
+    converted = []
+    with engine.begin() as conn:
+        for (table, column), kind in money_storage_layout(conn).items():
+            if kind == to:
+                continue
+            if to == money.INT64:
+                unrepresentable = conn.execute(text(
+                    f"SELECT count(*) FROM {table} WHERE {column} <> round({column}, {int(scale)}) "
+                    f"OR abs({column} * {factor}) > {money.INT64_MAX}"
+                )).scalar()
+                if unrepresentable:
+                    raise ValueError(
+                        f"{unrepresentable} values in {table}.{column} cannot be stored as 64-bit "
+                        f"integers at scale {scale}"
+                    )
+                conn.execute(text(
+                    f"ALTER TABLE {table} ALTER COLUMN {column} TYPE BIGINT USING ({column} * {factor})::bigint"
+                ))
+            else:
+                conn.execute(text(
+                    f"ALTER TABLE {table} ALTER COLUMN {column} "
+                    f"TYPE NUMERIC({money.NUMERIC_PRECISION}, {money.NUMERIC_SCALE}) "
+                    f"USING {column}::numeric / {factor}"
+                ))
+            converted.append(f"{table}.{column}")
+    return converted
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    from app.database import engines
+
+    parser = argparse.ArgumentParser(description="Database schema maintenance.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("upgrade", help="Apply pending migrations")
+    convert = commands.add_parser("convert-money", help="Convert the storage layout of money columns")
+    convert.add_argument("--to", required=True, choices=[money.NUMERIC, money.INT64])
+    convert.add_argument("--scale", type=int, default=None,
+                         help="Decimal places of the minor unit (default: from MONEY_CURRENCY/MONEY_SCALE)")
+    args = parser.parse_args(argv)
+
+    # Every shard has the same schema
+    for shard, engine in engines.items():
+        if args.command == "upgrade":
+            applied = run_migrations(engine)
+            print(f"{shard}: applied migrations: {', '.join(applied) or 'none'}")
+        else:
+            converted = convert_money_storage(engine, args.to, args.scale)
+            print(f"{shard}: converted columns: {', '.join(converted) or 'none'}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,9 +1,10 @@
-from sqlalchemy import Column, String, ForeignKey, DateTime, Numeric, UniqueConstraint
+from sqlalchemy import Column, String, ForeignKey, Date, DateTime, UniqueConstraint, Integer, Boolean, Index, Numeric, Text
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import UUID
 from app.database import Base
+from app.ids import uuid7
+from app.money import Money
 from datetime import datetime, timezone
-import uuid
 
 
 class Customer(Base):
@@ -11,12 +12,12 @@ class Customer(Base):
     Represents a customer in the database.
 
     Attributes:
-        id (UUID): Primary key, unique identifier for the customer.
+        id (UUID): Primary key, time-ordered (UUIDv7) unique identifier for the customer.
         name (str): Name of the customer.
         accounts (list[Account]): List of accounts associated with the customer.
     """
     __tablename__ = "customers"
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     name = Column(String(100), index=True)
     accounts = relationship("Account", back_populates="customer")
 
@@ -26,41 +27,257 @@ class Account(Base):
     Represents an account in the database.
 
     Attributes:
-        id (UUID): Primary key, unique identifier for the account.
+        id (UUID): Primary key, time-ordered (UUIDv7) unique identifier for the account.
         customer_id (UUID): Foreign key, references the customer who owns the account.
         balance (Decimal): Balance of the account with high precision.
+        initial_balance (Decimal): The opening deposit. Together with the account's transfers it
+            determines the expected balance checked by ledger reconciliation.
+        updated_at (datetime): When the account row was last written, timezone-aware.
+        version (int): Monotonic row version, incremented on every update. Used as the ETag of the
+            account and for optimistic concurrency control of balance changes.
         customer (Customer): The customer who owns the account.
         transfers_from (list[Transfer]): List of transfers originating from this account.
         transfers_to (list[Transfer]): List of transfers destined to this account.
     """
     __tablename__ = "accounts"
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     customer_id = Column(UUID(as_uuid=True), ForeignKey("customers.id"))
-    balance = Column(Numeric(precision=36, scale=20))  # High precision for financial calculations
+    balance = Column(Money())  # NUMERIC(36, 20) or BIGINT minor units, see app.money
+    initial_balance = Column(Money(),
+                             default=lambda context: context.get_current_parameters()["balance"])
+    updated_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc),
+                        onupdate=lambda: datetime.now(timezone.utc))
+    version = Column(Integer, nullable=False, server_default="1")
     customer = relationship("Customer", back_populates="accounts")
-    transfers_from = relationship("Transfer", foreign_keys="[Transfer.from_account_id]", back_populates="from_account")
-    transfers_to = relationship("Transfer", foreign_keys="[Transfer.to_account_id]", back_populates="to_account")
+    transfers_from = relationship("Transfer", primaryjoin="Account.id == foreign(Transfer.from_account_id)",
+                                  back_populates="from_account")
+    transfers_to = relationship("Transfer", primaryjoin="Account.id == foreign(Transfer.to_account_id)",
+                                back_populates="to_account")
+
+    # UPDATEs are issued as `... WHERE id = :id AND version = :version` and bump the version,
+    # so a concurrent balance change raises StaleDataError instead of being silently lost.
+    __mapper_args__ = {"version_id_col": version}
 
 
 class Transfer(Base):
     """
     Represents a transfer in the database.
 
+    A transfer between accounts on different shards is stored on both of them, with the same ID:
+    the debit on the shard of the sender and the credit on the shard of the recipient. The account
+    IDs are therefore not foreign keys, since one of the accounts may live in another database.
+
     Attributes:
-        id (UUID): Primary key, unique identifier for the transfer.
-        from_account_id (UUID): Foreign key, references the account from which the transfer originates.
-        to_account_id (UUID): Foreign key, references the account to which the transfer is destined.
+        id (UUID): Primary key, time-ordered (UUIDv7) unique identifier for the transfer.
+        from_account_id (UUID): References the account from which the transfer originates.
+        to_account_id (UUID): References the account to which the transfer is destined.
         amount (Decimal): Amount of money being transferred with high precision.
         timestamp (datetime): Timestamp of when the transfer was made, timezone-aware.
         from_account (Account): The account from which the transfer originates.
         to_account (Account): The account to which the transfer is destined.
     """
     __tablename__ = "transfers"
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
-    from_account_id = Column(UUID(as_uuid=True), ForeignKey("accounts.id"))
-    to_account_id = Column(UUID(as_uuid=True), ForeignKey("accounts.id"))
-    amount = Column(Numeric(precision=36, scale=20))  # High precision for financial calculations
-    timestamp = Column(DateTime(timezone=True),
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
+    from_account_id = Column(UUID(as_uuid=True))
+    to_account_id = Column(UUID(as_uuid=True))
+    amount = Column(Money())  # NUMERIC(36, 20) or BIGINT minor units, see app.money
+    timestamp = Column(DateTime(timezone=True), index=True,
                        default=lambda: datetime.now(timezone.utc))  # Ensure timezone-aware datetime
-    from_account = relationship("Account", foreign_keys=[from_account_id], back_populates="transfers_from")
-    to_account = relationship("Account", foreign_keys=[to_account_id], back_populates="transfers_to")
+    from_account = relationship("Account", primaryjoin="Account.id == foreign(Transfer.from_account_id)",
+                                back_populates="transfers_from")
+    to_account = relationship("Account", primaryjoin="Account.id == foreign(Transfer.to_account_id)",
+                              back_populates="transfers_to")
+
+    # The transfers of an account in a time range are one index range scan per direction; lookups
+    # by account alone use the leading column
+    __table_args__ = (
+        Index("ix_transfers_from_account_id_timestamp", "from_account_id", "timestamp"),
+        Index("ix_transfers_to_account_id_timestamp", "to_account_id", "timestamp"),
+    )
+
+
+class TransferEdge(Base):
+    """
+    Summary of all transfers between an ordered pair of accounts, maintained with every transfer.
+
+    Counterparty and money-flow analytics read these rows instead of scanning the transfer history.
+    Like the transfers, the summary of a pair of accounts on different shards is kept on both.
+
+    Attributes:
+        from_account_id (UUID): Primary key, the account that sent the transfers.
+        to_account_id (UUID): Primary key, the account that received the transfers.
+        transfer_count (int): Number of transfers from one account to the other.
+        total_amount (Decimal): Sum of their amounts with high precision.
+        last_transfer_at (datetime): Timestamp of the latest of them, timezone-aware.
+    """
+    __tablename__ = "transfer_edges"
+    from_account_id = Column(UUID(as_uuid=True), primary_key=True)
+    to_account_id = Column(UUID(as_uuid=True), primary_key=True)
+    transfer_count = Column(Integer, nullable=False)
+    total_amount = Column(Money(), nullable=False)  # NUMERIC(36, 20) or BIGINT minor units, see app.money
+    last_transfer_at = Column(DateTime(timezone=True), nullable=False)
+
+    # The primary key serves lookups by sender; incoming edges are looked up by recipient
+    __table_args__ = (
+        Index("ix_transfer_edges_to_account_id", "to_account_id"),
+    )
+
+
+class TransferOutbox(Base):
+    """
+    The credit of a transfer to an account on another shard, waiting to be delivered there.
+
+    The entry is written on the shard of the sender, in the same transaction as the debit, and
+    marked delivered once the credit has been committed on the shard of the recipient. Undelivered
+    entries are retried by the outbox relay (`python -m app.jobs.outbox`).
+
+    Attributes:
+        transfer_id (UUID): Primary key, foreign key to the debit of the transfer.
+        attempts (int): Failed delivery attempts.
+        next_attempt_at (datetime): When the entry is next due for delivery, timezone-aware.
+        last_error (str): Error of the most recent failed attempt.
+        delivered_at (datetime): When the credit was committed, timezone-aware.
+    """
+    __tablename__ = "transfer_outbox"
+    transfer_id = Column(UUID(as_uuid=True), ForeignKey("transfers.id"), primary_key=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+    last_error = Column(Text)
+    delivered_at = Column(DateTime(timezone=True))
+
+    # The relay only ever looks for entries that are not delivered yet
+    __table_args__ = (
+        Index("ix_transfer_outbox_pending", "next_attempt_at", postgresql_where=(delivered_at.is_(None))),
+    )
+
+
+class RecurringTransfer(Base):
+    """
+    Represents a standing order that is executed on a schedule by the recurring transfer worker.
+
+    Attributes:
+        id (UUID): Primary key, time-ordered (UUIDv7) unique identifier for the standing order.
+        from_account_id (UUID): Foreign key, references the account that is debited.
+        to_account_id (UUID): References the account that is credited, which may be on another shard.
+        amount (Decimal): Amount transferred on every run, with high precision.
+        frequency (str): One of "daily", "weekly" or "monthly".
+        start_at (datetime): First scheduled run; later runs are computed from it, timezone-aware.
+        end_at (datetime): Optional time after which no further runs are scheduled, timezone-aware.
+        next_run_at (datetime): When the order is next due (including retry backoff), timezone-aware.
+        run_count (int): Number of scheduled occurrences already executed, given up on or skipped.
+        attempts (int): Failed attempts of the current occurrence.
+        last_error (str): Error of the most recent failed attempt.
+        active (bool): Whether the order is still scheduled.
+    """
+    __tablename__ = "recurring_transfers"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
+    from_account_id = Column(UUID(as_uuid=True), ForeignKey("accounts.id"), nullable=False)
+    to_account_id = Column(UUID(as_uuid=True), nullable=False)
+    amount = Column(Money(), nullable=False)
+    frequency = Column(String(16), nullable=False)
+    start_at = Column(DateTime(timezone=True), nullable=False)
+    end_at = Column(DateTime(timezone=True))
+    next_run_at = Column(DateTime(timezone=True), nullable=False)
+    run_count = Column(Integer, nullable=False, default=0)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    active = Column(Boolean, nullable=False, default=True)
+
+    # Workers only ever look for active orders that are due, so index just those
+    __table_args__ = (
+        Index("ix_recurring_transfers_due", "next_run_at", postgresql_where=(active.is_(True))),
+    )
+
+
+class ExportJob(Base):
+    """
+    Represents an asynchronous export of the full transfer history of an account.
+
+    Attributes:
+        id (UUID): Primary key, time-ordered (UUIDv7) unique identifier for the export job.
+        account_id (UUID): Foreign key, references the account whose transfers are exported.
+        format (str): Output format, one of "csv", "ndjson" or "parquet".
+        status (str): One of "pending", "running", "completed" or "failed".
+        rows (int): Number of transfers written so far.
+        path (str): Location of the finished file on local disk.
+        error (str): Why the export failed, if it did.
+        created_at (datetime): When the job was submitted, timezone-aware.
+        started_at (datetime): When a worker started the job, timezone-aware.
+        finished_at (datetime): When the job completed or failed, timezone-aware.
+    """
+    __tablename__ = "export_jobs"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
+    account_id = Column(UUID(as_uuid=True), ForeignKey("accounts.id"), nullable=False)
+    format = Column(String(16), nullable=False)
+    status = Column(String(16), nullable=False, default="pending")
+    rows = Column(Integer, nullable=False, default=0)
+    path = Column(Text)
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+
+
+class AccrualRun(Base):
+    """
+    Represents the end-of-day interest accrual and fee run of one business date.
+
+    The run posts interest from the bank's interest account to every account with a positive
+    balance and fees from every account to the bank's fee account, a chunk of accounts at a time.
+    Each chunk commits together with the checkpoint, so an interrupted run resumes after the last
+    committed chunk and no account is posted twice for the same date.
+
+    Attributes:
+        business_date (date): Primary key, the date the interest and fees are posted for.
+        annual_rate (Decimal): Annual interest rate, e.g. 0.02 for 2%.
+        day_count (int): Days per year the annual rate is divided by.
+        fee (Decimal): Fee charged to every account, never more than its balance.
+        fee_waiver_balance (Decimal): Accounts with at least this balance pay no fee; None waives no fee.
+        interest_account_id (UUID): Foreign key, the account interest is paid from.
+        fee_account_id (UUID): Foreign key, the account fees are paid to.
+        status (str): "running" or "completed".
+        last_account_id (UUID): Checkpoint, the highest account ID already processed.
+        accounts (int): Number of accounts processed so far.
+        interest_postings (int): Number of interest transfers posted so far.
+        fee_postings (int): Number of fee transfers posted so far.
+        interest_total (Decimal): Total interest posted so far.
+        fee_total (Decimal): Total fees posted so far.
+        started_at (datetime): When the run started, timezone-aware.
+        finished_at (datetime): When the run completed, timezone-aware.
+    """
+    __tablename__ = "accrual_runs"
+    business_date = Column(Date, primary_key=True)
+    annual_rate = Column(Numeric(12, 8), nullable=False)
+    day_count = Column(Integer, nullable=False, default=365)
+    fee = Column(Money(), nullable=False)
+    fee_waiver_balance = Column(Money())
+    interest_account_id = Column(UUID(as_uuid=True), ForeignKey("accounts.id"), nullable=False)
+    fee_account_id = Column(UUID(as_uuid=True), ForeignKey("accounts.id"), nullable=False)
+    status = Column(String(16), nullable=False, default="running")
+    last_account_id = Column(UUID(as_uuid=True))
+    accounts = Column(Integer, nullable=False, default=0)
+    interest_postings = Column(Integer, nullable=False, default=0)
+    fee_postings = Column(Integer, nullable=False, default=0)
+    interest_total = Column(Money(), nullable=False, default=0)
+    fee_total = Column(Money(), nullable=False, default=0)
+    started_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+    finished_at = Column(DateTime(timezone=True))
+
+
+class BalanceCheckpoint(Base):
+    """
+    The ledger balance of an account at a point in time, written by the balance checkpoint job.
+
+    The balance as of any later time is the checkpoint plus the transfers since, so a
+    point-in-time query never replays more than the history since the nearest checkpoint.
+
+    Attributes:
+        account_id (UUID): Primary key, foreign key to the account.
+        as_of (datetime): Primary key, the time of the balance; includes the transfers made at
+            that time, timezone-aware.
+        balance (Decimal): The balance of the account as of that time, with high precision.
+    """
+    __tablename__ = "balance_checkpoints"
+    account_id = Column(UUID(as_uuid=True), ForeignKey("accounts.id"), primary_key=True)
+    as_of = Column(DateTime(timezone=True), primary_key=True)
+    balance = Column(Money(), nullable=False)  # NUMERIC(36, 20) or BIGINT minor units, see app.money
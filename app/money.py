@@ -0,0 +1,143 @@
+"""
+Storage of monetary values.
+
+By default balances and amounts are stored as `NUMERIC(36, 20)`. Setting `MONEY_STORAGE=int64`
+stores them instead as 64-bit integers counting minor units of the bank's currency (cents for
+USD), which makes rows and indexes narrower and lets the database sum and compare them with
+integer arithmetic. The ORM keeps exposing `Decimal` values in both modes.
+
+The minor-unit scale is taken from `MONEY_CURRENCY` (default USD) and can be overridden with
+`MONEY_SCALE`. Amounts with more decimal places than the scale are rejected by the API schemas,
+so a value never has to be rounded on its way into the database.
+
+Switching an existing database between the two layouts is done with
+`python -m app.migrations convert-money --to int64|numeric`.
+"""
+import os
+from decimal import Decimal
+from dotenv import load_dotenv
+from sqlalchemy import BigInteger, Numeric
+from sqlalchemy.types import TypeDecorator
+
+load_dotenv()
+
+NUMERIC = "numeric"
+INT64 = "int64"
+
+# Number of decimal places of the minor unit of each supported currency (ISO 4217)
+CURRENCY_SCALES = {
+    "USD": 2,
+    "EUR": 2,
+    "GBP": 2,
+    "CHF": 2,
+    "JPY": 0,
+    "KRW": 0,
+    "BHD": 3,
+    "KWD": 3,
+}
+
+# Scale of the NUMERIC(36, 20) layout
+NUMERIC_PRECISION = 36
+NUMERIC_SCALE = 20
+
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
+MONEY_STORAGE = os.getenv("MONEY_STORAGE", NUMERIC).lower()
+MONEY_CURRENCY = os.getenv("MONEY_CURRENCY", "USD").upper()
+
+if MONEY_STORAGE not in (NUMERIC, INT64):
+    raise ValueError(f"MONEY_STORAGE must be '{NUMERIC}' or '{INT64}', not '{MONEY_STORAGE}'")
+
+# Decimal places of the minor unit used by the int64 layout
+MINOR_UNIT_SCALE = int(os.getenv("MONEY_SCALE", CURRENCY_SCALES.get(MONEY_CURRENCY, 2)))
+
+# Decimal places that can be stored without rounding in the configured layout
+SCALE = MINOR_UNIT_SCALE if MONEY_STORAGE == INT64 else NUMERIC_SCALE
+
+
+def decimal_places(value: Decimal) -> int:
+    """
+    Count the significant decimal places of an amount, ignoring trailing zeros.
+
+    Works on the digits directly, so it never rounds whatever the size of the value.
+    """
+    _, digits, exponent = value.as_tuple()
+    if exponent >= 0:
+        return 0
+    trailing_zeros = len(digits) - len("".join(map(str, digits)).rstrip("0"))
+    return max(0, -exponent - trailing_zeros)
+
+
+def to_minor_units(value: Decimal, scale: int = None) -> int:
+    """
+    Convert an amount to an integer number of minor units.
+
+    Args:
+        value (Decimal): The amount.
+        scale (int): Number of decimal places of the minor unit. Defaults to the configured scale.
+
+    Returns:
+        int: The amount in minor units.
+
+    Raises:
+        ValueError: If the amount has more decimal places than the scale or does not fit in 64 bits.
+    """
+    scale = SCALE if scale is None else scale
+    value = Decimal(value)
+    if not value.is_finite() or decimal_places(value) > scale:
+        raise ValueError(f"{value} has more than {scale} decimal places")
+    sign, digits, exponent = value.as_tuple()
+    coefficient = int("".join(map(str, digits)) or "0")
+    shift = exponent + scale
+    units = coefficient * 10 ** shift if shift >= 0 else coefficient // 10 ** -shift
+    units = -units if sign else units
+    if not INT64_MIN <= units <= INT64_MAX:
+        raise ValueError(f"{value} is out of range for 64-bit storage at scale {scale}")
+    return units
+
+
+def from_minor_units(units: int, scale: int = None) -> Decimal:
+    """
+    Convert an integer number of minor units back to an amount.
+
+    Args:
+        units (int): The amount in minor units.
+        scale (int): Number of decimal places of the minor unit. Defaults to the configured scale.
+
+    Returns:
+        Decimal: The amount.
+    """
+    scale = SCALE if scale is None else scale
+    return Decimal(units).scaleb(-scale)
+
+
+def has_valid_scale(value: Decimal) -> bool:
+    """
+    Check whether an amount can be stored without rounding in the configured layout.
+    """
+    return value.is_finite() and decimal_places(value) <= SCALE
+
+
+class Money(TypeDecorator):
+    """
+    Column type for monetary values. Stored as NUMERIC(36, 20) or as BIGINT minor units depending
+    on `MONEY_STORAGE`, and always exposed to Python as `Decimal`.
+    """
+    impl = Numeric(precision=NUMERIC_PRECISION, scale=NUMERIC_SCALE)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if MONEY_STORAGE == INT64:
+            return dialect.type_descriptor(BigInteger())
+        return dialect.type_descriptor(Numeric(precision=NUMERIC_PRECISION, scale=NUMERIC_SCALE))
+
+    def process_bind_param(self, value, dialect):
+        if value is None or MONEY_STORAGE != INT64:
+            return value
+        return to_minor_units(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None or MONEY_STORAGE != INT64:
+            return value
+        return from_minor_units(value)
@@ -1,7 +1,54 @@
-from pydantic import BaseModel, Field, field_validator, model_validator, UUID4
+from pydantic import AfterValidator, BaseModel, Field, field_validator, model_validator
 from decimal import Decimal
 import re
-from typing import ClassVar
+from typing import Annotated, Any, ClassVar, Literal, Optional
+from datetime import datetime, timezone
+from uuid import UUID
+from app import ids, money
+
+
+def validate_id_version(v: UUID) -> UUID:
+    """
+    Validates that an ID is a random (version 4) or time-ordered (version 7) UUID.
+
+    Args:
+        v (UUID): The ID to validate.
+
+    Returns:
+        UUID: The validated ID.
+
+    Raises:
+        ValueError: If the UUID has another version.
+    """
+    if v.version not in ids.ACCEPTED_VERSIONS:
+        raise ValueError('UUID version must be 4 or 7')
+    return v
+
+
+# The ID of a stored entity. Rows created before the switch to time-ordered keys have UUIDv4 IDs.
+EntityId = Annotated[UUID, AfterValidator(validate_id_version)]
+
+
+def validate_money_scale(v: Decimal) -> Decimal:
+    """
+    Validates that an amount can be stored without rounding in the configured money storage.
+
+    Args:
+        v (Decimal): The amount to validate.
+
+    Returns:
+        Decimal: The validated amount.
+
+    Raises:
+        ValueError: If the amount has more decimal places than the configured scale.
+    """
+    if not money.has_valid_scale(v):
+        raise ValueError(f'Amount must have at most {money.SCALE} decimal places')
+    return v
+
+
+# A monetary input value, checked against the scale of the configured money storage (see app.money)
+MoneyAmount = Annotated[Decimal, AfterValidator(validate_money_scale)]
 
 class CustomerCreate(BaseModel):
     """
@@ -37,11 +84,11 @@ class AccountCreate(BaseModel):
     Schema for creating a new account.
 
     Attributes:
-        customer_id (UUID4): The ID of the customer who owns the account.
+        customer_id (EntityId): The ID of the customer who owns the account.
         balance (Decimal): The initial balance of the account. Must be non-negative with up to 20 decimal places.
     """
-    customer_id: UUID4
-    balance: Decimal = Field(..., ge=Decimal('0.00'), decimal_places=20)
+    customer_id: EntityId
+    balance: MoneyAmount = Field(..., ge=Decimal('0.00'), decimal_places=20)
 
     @field_validator('balance')
     @classmethod
@@ -68,13 +115,13 @@ class TransferCreate(BaseModel):
     Schema for creating a new transfer.
 
     Attributes:
-        from_account_id (UUID4): The ID of the account from which the transfer originates.
-        to_account_id (UUID4): The ID of the account to which the transfer is destined.
+        from_account_id (EntityId): The ID of the account from which the transfer originates.
+        to_account_id (EntityId): The ID of the account to which the transfer is destined.
         amount (Decimal): The amount of money to transfer. Must be positive with up to 20 decimal places.
     """
-    from_account_id: UUID4
-    to_account_id: UUID4
-    amount: Decimal = Field(..., gt=Decimal('0'), decimal_places=20)
+    from_account_id: EntityId
+    to_account_id: EntityId
+    amount: MoneyAmount = Field(..., gt=Decimal('0'), decimal_places=20)
 
     @model_validator(mode='after')
     def validate_transfer(self) -> 'TransferCreate':
@@ -92,15 +139,68 @@ class TransferCreate(BaseModel):
         return self
 
 
+class RecurringTransferCreate(BaseModel):
+    """
+    Schema for creating a new standing order.
+
+    Attributes:
+        from_account_id (EntityId): The ID of the account that is debited.
+        to_account_id (EntityId): The ID of the account that is credited.
+        amount (Decimal): The amount transferred on every run. Must be positive with up to 20 decimal places.
+        frequency (str): How often the transfer runs: "daily", "weekly" or "monthly".
+        start_at (datetime): The first run. Defaults to now; naive datetimes are taken as UTC.
+        end_at (datetime): Optional time after which the order stops running.
+    """
+    from_account_id: EntityId
+    to_account_id: EntityId
+    amount: MoneyAmount = Field(..., gt=Decimal('0'), decimal_places=20)
+    frequency: Literal["daily", "weekly", "monthly"]
+    start_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    end_at: Optional[datetime] = None
+
+    @field_validator('start_at', 'end_at')
+    @classmethod
+    def ensure_timezone(cls, v: Optional[datetime]) -> Optional[datetime]:
+        """
+        Treats naive datetimes as UTC.
+
+        Args:
+            v (datetime): The datetime to validate.
+
+        Returns:
+            datetime: The timezone-aware datetime.
+        """
+        if v is not None and v.tzinfo is None:
+            return v.replace(tzinfo=timezone.utc)
+        return v
+
+    @model_validator(mode='after')
+    def validate_recurring_transfer(self) -> 'RecurringTransferCreate':
+        """
+        Validates that the order is not to the same account and does not end before it starts.
+
+        Returns:
+            RecurringTransferCreate: The validated standing order.
+
+        Raises:
+            ValueError: If the order is to the same account or ends before it starts.
+        """
+        if self.from_account_id == self.to_account_id:
+            raise ValueError('Cannot transfer to the same account')
+        if self.end_at is not None and self.end_at < self.start_at:
+            raise ValueError('end_at must not be before start_at')
+        return self
+
+
 class Customer(BaseModel):
     """
     Schema for a customer.
 
     Attributes:
-        id (UUID4): The unique identifier of the customer.
+        id (EntityId): The unique identifier of the customer.
         name (str): The name of the customer.
     """
-    id: UUID4
+    id: EntityId
     name: str
 
 
@@ -109,12 +209,12 @@ class Account(BaseModel):
     Schema for an account.
 
     Attributes:
-        id (UUID4): The unique identifier of the account.
-        customer_id (UUID4): The ID of the customer who owns the account.
+        id (EntityId): The unique identifier of the account.
+        customer_id (EntityId): The ID of the customer who owns the account.
         balance (Decimal): The balance of the account.
     """
-    id: UUID4
-    customer_id: UUID4
+    id: EntityId
+    customer_id: EntityId
     balance: Decimal
 
 
@@ -123,12 +223,174 @@ class Transfer(BaseModel):
     Schema for a transfer.
 
     Attributes:
-        id (UUID4): The unique identifier of the transfer.
-        from_account_id (UUID4): The ID of the account from which the transfer originates.
-        to_account_id (UUID4): The ID of the account to which the transfer is destined.
+        id (EntityId): The unique identifier of the transfer.
+        from_account_id (EntityId): The ID of the account from which the transfer originates.
+        to_account_id (EntityId): The ID of the account to which the transfer is destined.
         amount (Decimal): The amount of money being transferred.
     """
-    id: UUID4
-    from_account_id: UUID4
-    to_account_id: UUID4
-    amount: Decimal
\ No newline at end of file
+    id: EntityId
+    from_account_id: EntityId
+    to_account_id: EntityId
+    amount: Decimal
+
+
+class RecurringTransfer(BaseModel):
+    """
+    Schema for a standing order.
+
+    Attributes:
+        id (EntityId): The unique identifier of the standing order.
+        from_account_id (EntityId): The ID of the account that is debited.
+        to_account_id (EntityId): The ID of the account that is credited.
+        amount (Decimal): The amount transferred on every run.
+        frequency (str): How often the transfer runs.
+        start_at (datetime): The first scheduled run.
+        end_at (datetime): The time after which the order stops running, if any.
+        next_run_at (datetime): When the order is next due.
+        last_error (str): The error of the most recent failed attempt, if any.
+        active (bool): Whether the order is still scheduled.
+    """
+    id: EntityId
+    from_account_id: EntityId
+    to_account_id: EntityId
+    amount: Decimal
+    frequency: str
+    start_at: datetime
+    end_at: Optional[datetime] = None
+    next_run_at: datetime
+    last_error: Optional[str] = None
+    active: bool
+
+
+class ExportJobCreate(BaseModel):
+    """
+    Schema for submitting an export of the full transfer history of an account.
+
+    Attributes:
+        account_id (EntityId): The ID of the account whose transfers are exported.
+        format (str): The output format: "csv", "ndjson" or "parquet".
+    """
+    account_id: EntityId
+    format: Literal["csv", "ndjson", "parquet"] = "csv"
+
+
+class ExportJob(BaseModel):
+    """
+    Schema for an export job.
+
+    Attributes:
+        id (EntityId): The unique identifier of the export job.
+        account_id (EntityId): The ID of the account whose transfers are exported.
+        format (str): The output format.
+        status (str): "pending", "running", "completed" or "failed".
+        rows (int): The number of transfers written so far.
+        error (str): Why the export failed, if it did.
+        created_at (datetime): When the job was submitted.
+        finished_at (datetime): When the job completed or failed, if it has.
+    """
+    id: EntityId
+    account_id: EntityId
+    format: str
+    status: str
+    rows: int
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+
+class Counterparty(BaseModel):
+    """
+    Schema for the transfers between an account and one of its counterparties.
+
+    Attributes:
+        account_id (EntityId): The ID of the counterparty account.
+        transfer_count (int): The number of transfers in either direction.
+        total_amount (Decimal): The volume of transfers in either direction.
+        sent_count (int): The number of transfers to the counterparty.
+        sent_amount (Decimal): The volume of transfers to the counterparty.
+        received_count (int): The number of transfers from the counterparty.
+        received_amount (Decimal): The volume of transfers from the counterparty.
+        last_transfer_at (datetime): When the latest transfer between the two accounts was made.
+    """
+    account_id: EntityId
+    transfer_count: int
+    total_amount: Decimal
+    sent_count: int
+    sent_amount: Decimal
+    received_count: int
+    received_amount: Decimal
+    last_transfer_at: datetime
+
+
+class FlowEdge(BaseModel):
+    """
+    Schema for the summary of all transfers from one account to another.
+
+    Attributes:
+        from_account_id (EntityId): The ID of the account that sent the transfers.
+        to_account_id (EntityId): The ID of the account that received the transfers.
+        transfer_count (int): The number of transfers.
+        total_amount (Decimal): The volume of the transfers.
+        depth (int): The number of hops from the queried account at which the edge was found.
+    """
+    from_account_id: EntityId
+    to_account_id: EntityId
+    transfer_count: int
+    total_amount: Decimal
+    depth: int
+
+
+class FlowGraph(BaseModel):
+    """
+    Schema for the money-flow graph around an account.
+
+    Attributes:
+        account_id (EntityId): The ID of the account the graph starts from.
+        direction (str): "out" to follow money sent by the account, "in" to follow money it received.
+        depth (int): The maximum number of hops followed.
+        nodes (list[EntityId]): The IDs of all accounts in the graph.
+        edges (list[FlowEdge]): The transfer summaries connecting them.
+        truncated (bool): Whether edges were left out because the graph exceeded the edge limit.
+    """
+    account_id: EntityId
+    direction: Literal["out", "in"]
+    depth: int
+    nodes: list[EntityId]
+    edges: list[FlowEdge]
+    truncated: bool
+
+
+class SlowQuery(BaseModel):
+    """
+    Schema for an entry of the slow-query log.
+
+    Attributes:
+        at (datetime): When the statement finished.
+        duration_ms (float): How long the statement took, in milliseconds.
+        statement (str): The SQL statement.
+        parameters (Any): Its parameters, with values that may hold personal data redacted.
+        caller (str): The crud functions that issued the statement, outermost first.
+        route (str): The API route being served, if the statement was issued by a request.
+        plan (str): The plan of the statement, if it was sampled.
+        analyzed (bool): Whether the plan was captured with EXPLAIN ANALYZE.
+    """
+    at: datetime
+    duration_ms: float
+    statement: str
+    parameters: Any = None
+    caller: Optional[str] = None
+    route: Optional[str] = None
+    plan: Optional[str] = None
+    analyzed: bool
+
+
+class OutboxBacklog(BaseModel):
+    """
+    Schema for the undelivered cross-shard transfers of a shard.
+
+    Attributes:
+        undelivered (int): Number of transfers whose credit has not been applied yet.
+        oldest (datetime): When the oldest of them was debited, if there is any.
+    """
+    undelivered: int
+    oldest: Optional[datetime] = None
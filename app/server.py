@@ -0,0 +1,70 @@
+"""
+Production launcher for the Bank API.
+
+Runs the application under Uvicorn with one worker process per core by default. Every worker
+imports `app.main` itself and so creates its own database engine and connection pool; no
+connection is ever shared between processes (see also `app.database`, which resets the pool of
+any forked child).
+
+Settings are read from the environment and can be overridden on the command line:
+
+    WEB_HOST              Interface to bind (default 0.0.0.0)
+    WEB_PORT              Port to bind (default 8000)
+    WEB_WORKERS           Number of worker processes (default: number of CPUs)
+    WEB_LOOP              Event loop: auto, uvloop or asyncio (default auto, which picks uvloop when installed)
+    WEB_HTTP              HTTP parser: auto, httptools or h11 (default auto, which picks httptools when installed)
+    WEB_BACKLOG           Maximum number of pending connections (default 2048)
+    WEB_KEEPALIVE         Seconds to keep idle keep-alive connections open (default 5)
+    WEB_GRACEFUL_TIMEOUT  Seconds to wait for in-flight requests on shutdown (default 30)
+    WEB_MAX_REQUESTS      Restart a worker after this many requests (default: never)
+    WEB_ACCESS_LOG        Log every request, 1 or 0 (default 1)
+
+Usage:
+    python -m app.server [--workers 4] [--port 8000] ...
+"""
+import argparse
+import os
+
+import uvicorn
+
+
+def _env_int(name: str, default):
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run the Bank API with multiple worker processes.")
+    parser.add_argument("--host", default=os.getenv("WEB_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=_env_int("WEB_PORT", 8000))
+    parser.add_argument("--workers", type=int, default=_env_int("WEB_WORKERS", os.cpu_count() or 1))
+    parser.add_argument("--loop", default=os.getenv("WEB_LOOP", "auto"), choices=["auto", "uvloop", "asyncio"])
+    parser.add_argument("--http", default=os.getenv("WEB_HTTP", "auto"), choices=["auto", "httptools", "h11"])
+    parser.add_argument("--backlog", type=int, default=_env_int("WEB_BACKLOG", 2048))
+    parser.add_argument("--keep-alive", type=int, default=_env_int("WEB_KEEPALIVE", 5))
+    parser.add_argument("--graceful-timeout", type=int, default=_env_int("WEB_GRACEFUL_TIMEOUT", 30))
+    parser.add_argument("--max-requests", type=int, default=_env_int("WEB_MAX_REQUESTS", None))
+    parser.add_argument("--access-log", type=int, choices=[0, 1], default=_env_int("WEB_ACCESS_LOG", 1))
+    args = parser.parse_args(argv)
+
+    # The application is passed as an import string so that every worker process imports it,
+    # and with it creates its database engine, after the process has been started.
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=max(1, args.workers),
+        loop=args.loop,
+        http=args.http,
+        backlog=args.backlog,
+        timeout_keep_alive=args.keep_alive,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        limit_max_requests=args.max_requests,
+        access_log=bool(args.access_log),
+        proxy_headers=True,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
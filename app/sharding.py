@@ -0,0 +1,112 @@
+"""
+Shard map.
+
+Customers, and everything that belongs to them, are spread over several PostgreSQL databases
+("shards"). The shard key of a customer is its slot: the low `SLOT_BITS` bits of the customer ID,
+which are random. Accounts get IDs carrying the slot of their customer (see `app.ids.uuid7`), and
+transfers, standing orders and export jobs the slot of their account, so the shard of any record
+can be computed from its ID alone, without a lookup.
+
+Slots are assigned to shards by consistent hashing: every shard is placed on a hash ring at
+`vnodes` pseudo-random points and a slot belongs to the first shard point that follows the hash of
+the slot. Adding a shard to a map of n shards therefore moves only about 1/(n + 1) of the slots,
+all of them to the new shard, and removing one moves only the slots it owned.
+"""
+import hashlib
+from bisect import bisect
+from typing import Iterable
+from uuid import UUID
+
+SLOT_BITS = 16
+SLOTS = 1 << SLOT_BITS
+
+
+def slot_of(record_id: UUID) -> int:
+    """
+    Get the slot carried in the low bits of an ID.
+    """
+    return record_id.int & (SLOTS - 1)
+
+
+def _hash(value: str) -> int:
+    # Stable across processes and Python versions, unlike hash()
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+def parse_shard_urls(value: str) -> dict[str, str]:
+    """
+    Parse a `name=url,name=url` list of shards, keeping their order.
+
+    Raises:
+        ValueError: If an entry has no name or a name appears twice.
+    """
+    shards = {}
+    for entry in filter(None, (entry.strip() for entry in value.split(","))):
+        name, separator, url = entry.partition("=")
+        name = name.strip()
+        if not separator or not name or not url.strip():
+            raise ValueError(f"Invalid shard {entry!r}, expected name=url")
+        if name in shards:
+            raise ValueError(f"Shard {name!r} is listed twice")
+        shards[name] = url.strip()
+    return shards
+
+
+class ShardMap:
+    """
+    Consistent-hash assignment of slots to shards.
+
+    Args:
+        shards (Iterable[str]): The names of the shards that own slots.
+        vnodes (int): Points per shard on the hash ring. More points spread the slots more evenly.
+    """
+
+    def __init__(self, shards: Iterable[str], vnodes: int = 64):
+        self.shards = list(shards)
+        if not self.shards:
+            raise ValueError("A shard map needs at least one shard")
+        self.vnodes = vnodes
+        ring = sorted((_hash(f"{shard}#{point}"), shard) for shard in self.shards for point in range(vnodes))
+        self._points = [point for point, _ in ring]
+        self._owners = [shard for _, shard in ring]
+        # The ring is only ever asked about SLOTS distinct slots, so resolve them all up front
+        self._slots = [self._lookup(slot) for slot in range(SLOTS)] if len(self.shards) > 1 else None
+
+    def _lookup(self, slot: int) -> str:
+        index = bisect(self._points, _hash(f"slot:{slot}"))
+        return self._owners[index % len(self._owners)]
+
+    def shard_for_slot(self, slot: int) -> str:
+        if self._slots is None:
+            return self.shards[0]
+        return self._slots[slot]
+
+    def shard_for(self, record_id: UUID) -> str:
+        """
+        Get the shard that owns the slot carried by an ID.
+        """
+        return self.shard_for_slot(slot_of(record_id))
+
+    def slot_counts(self) -> dict[str, int]:
+        """
+        Get the number of slots owned by every shard.
+        """
+        counts = dict.fromkeys(self.shards, 0)
+        for slot in range(SLOTS):
+            counts[self.shard_for_slot(slot)] += 1
+        return counts
+
+    def moved_slots(self, other: "ShardMap") -> dict[tuple[str, str], int]:
+        """
+        Count the slots that change owner between this map and another one, per pair of shards.
+
+        Returns:
+            dict: `(from_shard, to_shard)` pairs mapped to the number of slots moving between them.
+        """
+        moves: dict[tuple[str, str], int] = {}
+        for slot in range(SLOTS):
+            before, after = self.shard_for_slot(slot), other.shard_for_slot(slot)
+            if before != after:
+                moves[(before, after)] = moves.get((before, after), 0) + 1
+        return moves
+
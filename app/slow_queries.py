@@ -0,0 +1,215 @@
+"""
+Slow-query log.
+
+When `SLOW_QUERY_MS` is set, every SQL statement that takes longer than that many milliseconds is
+logged with its parameters, the `app.crud` functions that issued it and the API route being
+served. A sample of them (`SLOW_QUERY_EXPLAIN_RATE`, default 0.1) also get their plan captured:
+read-only SELECT statements with `EXPLAIN (ANALYZE, BUFFERS)`, so the plan shows actual row counts
+and buffer usage, and every other statement with a plain `EXPLAIN`, so it is never run twice. A
+SELECT only counts as read-only without a locking clause and when every function it calls is
+known to have no side effects: `SELECT pg_advisory_lock(...)`, `nextval(...)` or
+`SELECT ... FOR UPDATE` run again would take their lock or advance their sequence a second time.
+The plan is captured right away, on the same connection and in the same transaction as the
+statement, inside a savepoint so that a failing EXPLAIN cannot abort the caller's transaction.
+
+The most recent `SLOW_QUERY_BUFFER_SIZE` entries (default 200) are kept in memory and served by
+`GET /diagnostics/slow-queries`. With several server workers every worker keeps its own buffer.
+
+Parameter values that may hold personal data are redacted: only identifiers, numbers, booleans,
+timestamps and NULLs are logged as they are, everything else as `<redacted str>` and the like.
+"""
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import Optional
+from uuid import UUID
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# The API route being served, e.g. "POST /transfers/"; set for every request by app.main
+current_route: ContextVar[Optional[str]] = ContextVar("current_route", default=None)
+
+SAFE_PARAMETER_TYPES = (UUID, int, float, Decimal, bool, datetime, date, type(None))
+
+# Functions, type names and keywords that may precede a parenthesis in a statement that is safe
+# to run a second time under EXPLAIN ANALYZE; a call to anything else may have side effects
+READ_ONLY_CALLS = frozenset({
+    "abs", "and", "any", "array", "array_agg", "as", "avg", "bool_and", "bool_or", "cast", "ceil",
+    "char", "coalesce", "count", "current_date", "date_trunc", "decimal", "exists", "extract",
+    "filter", "floor", "from", "greatest", "in", "join", "json_agg", "jsonb_agg", "lateral",
+    "least", "length", "limit", "lower", "max", "min", "not", "now", "nullif", "numeric", "on",
+    "or", "over", "round", "row_number", "select", "string_agg", "sum", "timestamp", "trunc",
+    "union", "unnest", "upper", "using", "values", "varchar", "where", "with",
+})
+_CALL = re.compile(r"\b([a-z_][a-z0-9_.]*)\s*\(")
+_LOCKING_CLAUSE = re.compile(r"\bfor\s+(update|no\s+key\s+update|share|key\s+share)\b")
+
+
+def redact(value):
+    if isinstance(value, SAFE_PARAMETER_TYPES):
+        return value if not isinstance(value, (datetime, date)) else value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return f"<redacted {type(value).__name__}>"
+
+
+def redact_parameters(parameters):
+    if isinstance(parameters, dict):
+        return {name: redact(value) for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact(value) for value in parameters]
+    return redact(parameters)
+
+
+def read_only(statement: str) -> bool:
+    """
+    Check whether a statement can be run a second time, under EXPLAIN ANALYZE, without effects.
+    """
+    lowered = statement.lower()
+    if not lowered.lstrip().startswith("select") or _LOCKING_CLAUSE.search(lowered):
+        return False
+    return all(name.rsplit(".", 1)[-1] in READ_ONLY_CALLS for name in _CALL.findall(lowered))
+
+
+def _callers() -> str:
+    """
+    Describe the `app.crud` functions on the current call stack, outermost first.
+
+    If the statement was not issued from `app.crud`, the innermost application frame is used.
+    """
+    crud, innermost = [], None
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith("app.") and module != __name__:
+            name = f"{module}.{frame.f_code.co_name}"
+            innermost = innermost or name
+            # The shard routing helpers and the lookups handed to them say nothing about the caller
+            if (module.startswith("app.crud.") and module != "app.crud.routing"
+                    and frame.f_code.co_name != "<lambda>" and name not in crud):
+                crud.append(name)
+        frame = frame.f_back
+    if crud:
+        return " > ".join(reversed(crud))
+    return innermost
+
+
+class SlowQueryLog:
+    """
+    Records statements slower than a threshold, with a sampled EXPLAIN plan, in a ring buffer.
+
+    Args:
+        threshold_ms (float): Statements taking longer than this many milliseconds are recorded.
+        explain_rate (float): Fraction of the recorded statements whose plan is captured.
+        size (int): Number of entries kept.
+    """
+
+    def __init__(self, threshold_ms: float, explain_rate: float = 0.1, size: int = 200):
+        self.threshold_ms = threshold_ms
+        self.explain_rate = explain_rate
+        self._entries: deque = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def install(self, engine: Engine) -> None:
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        event.listen(engine, "handle_error", self._handle_error)
+
+    def uninstall(self, engine: Engine) -> None:
+        event.remove(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.remove(engine, "after_cursor_execute", self._after_cursor_execute)
+        event.remove(engine, "handle_error", self._handle_error)
+
+    def entries(self, limit: Optional[int] = None) -> list[dict]:
+        """
+        Get the recorded statements, most recent first.
+        """
+        with self._lock:
+            entries = list(reversed(self._entries))
+        return entries if limit is None else entries[:limit]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # Keyed by execution context, as a statement may be issued while another one's result is
+        # still being processed on the same connection
+        conn.info.setdefault("slow_query_started", {})[context] = time.perf_counter()
+
+    def _handle_error(self, context) -> None:
+        # A statement that raised never reaches after_cursor_execute; drop its start time so that
+        # it does not stay in the connection's info for as long as the connection is pooled
+        if context.connection is not None:
+            context.connection.info.get("slow_query_started", {}).pop(context.execution_context, None)
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration_ms = (time.perf_counter() - conn.info["slow_query_started"].pop(context)) * 1000
+        if duration_ms < self.threshold_ms:
+            return
+
+        entry = {
+            "at": datetime.now(timezone.utc),
+            "duration_ms": round(duration_ms, 3),
+            "statement": statement,
+            "parameters": redact_parameters(parameters),
+            "caller": _callers(),
+            "route": current_route.get(),
+            "plan": None,
+            "analyzed": False,
+        }
+        # A server-side cursor is still open on the connection and executemany has no single plan
+        streaming = context is not None and context.execution_options.get("stream_results", False)
+        if not executemany and not streaming and random.random() < self.explain_rate:
+            entry["analyzed"] = read_only(statement)
+            entry["plan"] = self._explain(cursor.connection, statement, parameters, entry["analyzed"])
+
+        logger.warning(
+            "slow query (%.1f ms) in %s during %s: %s",
+            duration_ms, entry["caller"], entry["route"], " ".join(statement.split()),
+        )
+        with self._lock:
+            self._entries.append(entry)
+
+    @staticmethod
+    def _explain(dbapi_connection, statement: str, parameters, analyze: bool) -> str:
+        explain = f"EXPLAIN (ANALYZE, BUFFERS) {statement}" if analyze else f"EXPLAIN {statement}"
+        in_transaction = not getattr(dbapi_connection, "autocommit", False)
+        try:
+            with dbapi_connection.cursor() as cursor:
+                if in_transaction:
+                    cursor.execute("SAVEPOINT slow_query_explain")
+                try:
+                    cursor.execute(explain, parameters)
+                    plan = "\n".join(row[0] for row in cursor.fetchall())
+                except Exception as e:
+                    plan = f"EXPLAIN failed: {str(e).splitlines()[0] if str(e) else type(e).__name__}"
+                if in_transaction:
+                    cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                    cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+        except Exception:
+            logger.exception("could not capture the plan of a slow query")
+            return None
+        return plan
+
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS") or 0)
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_RATE", "0.1"))
+SLOW_QUERY_BUFFER_SIZE = int(os.getenv("SLOW_QUERY_BUFFER_SIZE", "200"))
+
+# The process-wide log; app.database installs it on the engine when SLOW_QUERY_MS is set
+log = SlowQueryLog(SLOW_QUERY_MS, SLOW_QUERY_EXPLAIN_RATE, SLOW_QUERY_BUFFER_SIZE)
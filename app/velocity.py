@@ -0,0 +1,375 @@
+"""
+Per-account velocity limits for outgoing transfers.
+
+A velocity limit caps the amount and/or the number of transfers an account may send within a
+sliding time window, e.g. at most 20 transfers per minute and 50,000 per day. Limits are
+configured with `VELOCITY_LIMITS`, a comma-separated list of `window_seconds:max_amount:max_count`
+entries where either maximum may be left empty:
+
+    VELOCITY_LIMITS=60::20,86400:50000:
+
+Counters are kept in memory so that checking a transfer never queries the `transfers` table.
+Each window is split into `VELOCITY_BUCKETS` buckets of whole seconds kept in a ring; a check or
+update touches one bucket per limit, so both are constant-time. The window slides by one bucket at
+a time. A window that is not a multiple of the bucket length gets one more bucket, and a window
+shorter than `VELOCITY_BUCKETS` seconds gets one-second buckets, so the ring always spans the
+full window.
+At most `VELOCITY_MAX_ACCOUNTS` accounts are held. The least recently used ones are evicted,
+and an evicted account is reloaded from the database on its next transfer.
+
+The counters are warmed from the database at startup. A transfer is checked before any database
+work: the check atomically reserves the amount, so concurrent transfers cannot pass the same
+limit together. The reservation is confirmed after commit and released if the transfer fails.
+
+`LocalVelocityBackend` keeps the counters in the current process, so with several server workers
+each worker enforces the limits on its own share of the traffic. A `VelocityBackend` shared by
+all workers (e.g. backed by Redis) can be plugged in with `configure()`.
+"""
+import math
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Callable, Iterable, NamedTuple, Optional
+from uuid import UUID
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class VelocityLimit(NamedTuple):
+    """
+    A cap on what an account may send within a sliding window.
+
+    Attributes:
+        window_seconds (int): Length of the window.
+        max_amount (Decimal): Maximum total amount sent within the window, or None.
+        max_count (int): Maximum number of transfers within the window, or None.
+    """
+    window_seconds: int
+    max_amount: Optional[Decimal]
+    max_count: Optional[int]
+
+    def describe(self) -> str:
+        caps = []
+        if self.max_amount is not None:
+            caps.append(f"amount {self.max_amount}")
+        if self.max_count is not None:
+            caps.append(f"{self.max_count} transfers")
+        return f"{' and '.join(caps)} per {self.window_seconds}s"
+
+
+def parse_limits(spec: str) -> list[VelocityLimit]:
+    """
+    Parse a `window_seconds:max_amount:max_count[,...]` limit specification.
+
+    Raises:
+        ValueError: If an entry is malformed or sets neither maximum.
+    """
+    limits = []
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        window, max_amount, max_count = entry.split(":")
+        if not max_amount and not max_count:
+            raise ValueError(f"Velocity limit '{entry}' sets neither a maximum amount nor a maximum count")
+        limits.append(VelocityLimit(
+            window_seconds=int(window),
+            max_amount=Decimal(max_amount) if max_amount else None,
+            max_count=int(max_count) if max_count else None,
+        ))
+    return limits
+
+
+def bucket_seconds(limit: VelocityLimit, buckets: int) -> int:
+    """
+    Length of one bucket of a limit's window, at least one second.
+    """
+    return max(1, limit.window_seconds // buckets)
+
+
+def ring_size(limit: VelocityLimit, buckets: int) -> int:
+    """
+    Number of buckets needed to span a limit's whole window.
+    """
+    return math.ceil(limit.window_seconds / bucket_seconds(limit, buckets))
+
+
+# Loads the (timestamp, amount) of the transfers an account sent since a point in time
+HistoryLoader = Callable[[UUID, datetime], Iterable[tuple[datetime, Decimal]]]
+
+
+class VelocityBackend(ABC):
+    """
+    Storage of the sliding-window counters. Every method must be atomic per account.
+    """
+
+    @abstractmethod
+    def reserve(self, account_id: UUID, amount: Decimal, now: float) -> Optional[VelocityLimit]:
+        """
+        Check that sending `amount` keeps the account within every limit, counting pending
+        reservations, and if so reserve it.
+
+        Returns:
+            VelocityLimit: The first limit that would be exceeded, or None if the amount was reserved.
+        """
+
+    @abstractmethod
+    def confirm(self, account_id: UUID, amount: Decimal, now: float) -> None:
+        """
+        Turn a reservation into a transfer sent at `now`.
+        """
+
+    @abstractmethod
+    def release(self, account_id: UUID, amount: Decimal) -> None:
+        """
+        Drop a reservation whose transfer did not happen.
+        """
+
+    @abstractmethod
+    def warm(self, limit_index: int, rows: Iterable[tuple[UUID, int, Decimal, int]]) -> None:
+        """
+        Load historical counters for one limit as `(account_id, bucket, amount, count)` rows,
+        where `bucket` is the Unix time divided by the limit's bucket length.
+        """
+
+
+class _Ring:
+    """
+    Sliding-window counters of one account for one limit.
+    """
+    __slots__ = ("amounts", "counts", "last_bucket", "total_amount", "total_count")
+
+    def __init__(self, buckets: int):
+        self.amounts = [Decimal(0)] * buckets
+        self.counts = [0] * buckets
+        self.last_bucket = None
+        self.total_amount = Decimal(0)
+        self.total_count = 0
+
+    def advance(self, bucket: int) -> None:
+        # Clear the slots of the buckets that left the window since the last update. At most one
+        # full turn of the ring is cleared, so this is bounded by the number of buckets.
+        size = len(self.counts)
+        if self.last_bucket is None or bucket - self.last_bucket >= size:
+            self.amounts = [Decimal(0)] * size
+            self.counts = [0] * size
+            self.total_amount = Decimal(0)
+            self.total_count = 0
+        elif bucket > self.last_bucket:
+            for expired in range(self.last_bucket + 1, bucket + 1):
+                slot = expired % size
+                self.total_amount -= self.amounts[slot]
+                self.total_count -= self.counts[slot]
+                self.amounts[slot] = Decimal(0)
+                self.counts[slot] = 0
+        if self.last_bucket is None or bucket > self.last_bucket:
+            self.last_bucket = bucket
+
+    def add(self, bucket: int, amount: Decimal, count: int) -> None:
+        self.advance(bucket if self.last_bucket is None else max(bucket, self.last_bucket))
+        if bucket <= self.last_bucket - len(self.counts):
+            return  # Older than the window
+        slot = bucket % len(self.counts)
+        self.amounts[slot] += amount
+        self.counts[slot] += count
+        self.total_amount += amount
+        self.total_count += count
+
+
+class _AccountState:
+    __slots__ = ("rings", "pending_amount", "pending_count")
+
+    def __init__(self, ring_sizes: list[int]):
+        self.rings = [_Ring(size) for size in ring_sizes]
+        self.pending_amount = Decimal(0)
+        self.pending_count = 0
+
+
+class LocalVelocityBackend(VelocityBackend):
+    """
+    In-process counters, bounded to `max_accounts` accounts in least-recently-used order.
+
+    Args:
+        limits (list[VelocityLimit]): The limits to enforce.
+        buckets (int): Number of buckets each window is split into.
+        max_accounts (int): Maximum number of accounts held in memory.
+        loader (HistoryLoader): Reloads the history of an account that was evicted.
+    """
+
+    def __init__(self, limits: list[VelocityLimit], buckets: int = 60, max_accounts: int = 100_000,
+                 loader: Optional[HistoryLoader] = None):
+        self.limits = limits
+        self.buckets = buckets
+        self.max_accounts = max_accounts
+        self.loader = loader
+        self.bucket_seconds = [bucket_seconds(limit, buckets) for limit in limits]
+        self.ring_sizes = [ring_size(limit, buckets) for limit in limits]
+        self._accounts: "OrderedDict[UUID, _AccountState]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Until an account has been evicted, an account missing from memory has sent nothing
+        # within the windows (the counters were warmed at startup) and needs no reload.
+        self._evicted = False
+
+    def __len__(self) -> int:
+        return len(self._accounts)
+
+    def _history(self, account_id: UUID, now: float) -> Optional[list[tuple[datetime, Decimal]]]:
+        # Called without the lock held, so that reloading an evicted account does not block
+        # the checks of every other account while the database is queried.
+        if not self._evicted or self.loader is None or account_id in self._accounts:
+            return None
+        since = datetime.fromtimestamp(now - max(limit.window_seconds for limit in self.limits), timezone.utc)
+        return list(self.loader(account_id, since))
+
+    def _state(self, account_id: UUID, history: Optional[list[tuple[datetime, Decimal]]] = None) -> _AccountState:
+        # Called with the lock held
+        state = self._accounts.get(account_id)
+        if state is not None:
+            self._accounts.move_to_end(account_id)
+            return state
+        state = _AccountState(self.ring_sizes)
+        for timestamp, amount in history or ():
+            self._add(state, timestamp.timestamp(), amount, 1)
+        self._accounts[account_id] = state
+        self._evict()
+        return state
+
+    def _evict(self) -> None:
+        # Accounts with a reservation in flight are kept, since their pending amount lives only here
+        for _ in range(len(self._accounts)):
+            if len(self._accounts) <= self.max_accounts:
+                return
+            account_id, state = next(iter(self._accounts.items()))
+            if state.pending_count:
+                self._accounts.move_to_end(account_id)
+                continue
+            del self._accounts[account_id]
+            self._evicted = True
+
+    def _add(self, state: _AccountState, at: float, amount: Decimal, count: int) -> None:
+        for ring, seconds in zip(state.rings, self.bucket_seconds):
+            ring.add(int(at // seconds), amount, count)
+
+    def reserve(self, account_id: UUID, amount: Decimal, now: float) -> Optional[VelocityLimit]:
+        history = self._history(account_id, now)
+        with self._lock:
+            state = self._state(account_id, history)
+            for limit, ring, seconds in zip(self.limits, state.rings, self.bucket_seconds):
+                ring.advance(int(now // seconds))
+                if limit.max_amount is not None and ring.total_amount + state.pending_amount + amount > limit.max_amount:
+                    return limit
+                if limit.max_count is not None and ring.total_count + state.pending_count + 1 > limit.max_count:
+                    return limit
+            state.pending_amount += amount
+            state.pending_count += 1
+            return None
+
+    def confirm(self, account_id: UUID, amount: Decimal, now: float) -> None:
+        with self._lock:
+            state = self._state(account_id)
+            state.pending_amount -= amount
+            state.pending_count -= 1
+            self._add(state, now, amount, 1)
+
+    def release(self, account_id: UUID, amount: Decimal) -> None:
+        with self._lock:
+            state = self._accounts.get(account_id)
+            if state is not None:
+                state.pending_amount -= amount
+                state.pending_count -= 1
+
+    def warm(self, limit_index: int, rows: Iterable[tuple[UUID, int, Decimal, int]]) -> None:
+        for account_id, bucket, amount, count in rows:
+            with self._lock:
+                state = self._state(account_id)
+                state.rings[limit_index].add(int(bucket), amount, count)
+
+
+class VelocityLimiter:
+    """
+    Enforces the configured velocity limits on outgoing transfers.
+
+    Args:
+        limits (list[VelocityLimit]): The limits to enforce. No limits disables the limiter.
+        buckets (int): Number of buckets each window is split into.
+        backend (VelocityBackend): Where the counters are kept.
+    """
+
+    def __init__(self, limits: list[VelocityLimit], buckets: int = 60, backend: Optional[VelocityBackend] = None):
+        self.limits = limits
+        self.buckets = buckets
+        self.backend = backend
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.limits) and self.backend is not None
+
+    def reserve(self, account_id: UUID, amount: Decimal) -> Optional[VelocityLimit]:
+        if not self.enabled:
+            return None
+        return self.backend.reserve(account_id, amount, time.time())
+
+    def confirm(self, account_id: UUID, amount: Decimal) -> None:
+        if self.enabled:
+            self.backend.confirm(account_id, amount, time.time())
+
+    def release(self, account_id: UUID, amount: Decimal) -> None:
+        if self.enabled:
+            self.backend.release(account_id, amount)
+
+    def warm(self, db, local_senders_only: bool = False) -> None:
+        """
+        Load the counters of every limit from the transfers still inside its window.
+
+        With several shards every shard is warmed in turn, and `local_senders_only` keeps the
+        credit records of cross-shard transfers from being counted twice.
+        """
+        if not self.enabled:
+            return
+        from app.crud.transfer import get_outgoing_transfer_buckets
+
+        now = time.time()
+        for index, limit in enumerate(self.limits):
+            since = datetime.fromtimestamp(now - limit.window_seconds, timezone.utc)
+            rows = get_outgoing_transfer_buckets(db, since, bucket_seconds(limit, self.buckets),
+                                                 local_senders_only=local_senders_only)
+            self.backend.warm(index, rows)
+
+
+VELOCITY_LIMITS = parse_limits(os.getenv("VELOCITY_LIMITS", ""))
+VELOCITY_BUCKETS = int(os.getenv("VELOCITY_BUCKETS", "60"))
+VELOCITY_MAX_ACCOUNTS = int(os.getenv("VELOCITY_MAX_ACCOUNTS", "100000"))
+
+# The process-wide limiter; it has no backend, and so checks nothing, until configure() is called
+limiter = VelocityLimiter(VELOCITY_LIMITS, VELOCITY_BUCKETS)
+
+
+def configure(limits: list[VelocityLimit], backend: Optional[VelocityBackend] = None,
+              buckets: int = VELOCITY_BUCKETS, max_accounts: int = VELOCITY_MAX_ACCOUNTS) -> VelocityLimiter:
+    """
+    Set the limits and backend of the process-wide limiter.
+
+    Args:
+        limits (list[VelocityLimit]): The limits to enforce.
+        backend (VelocityBackend): A shared backend. Defaults to a new `LocalVelocityBackend`
+            that reloads evicted accounts from the database.
+        buckets (int): Buckets per window.
+        max_accounts (int): Capacity of the local backend.
+
+    Returns:
+        VelocityLimiter: The configured limiter.
+    """
+    from app.crud.transfer import get_outgoing_transfers_since
+    from app.database import SessionLocal
+
+    def load_history(account_id: UUID, since: datetime):
+        with SessionLocal() as db:
+            return get_outgoing_transfers_since(db, account_id, since)
+
+    limiter.limits = limits
+    limiter.buckets = buckets
+    limiter.backend = backend or LocalVelocityBackend(limits, buckets, max_accounts, loader=load_history)
+    return limiter
@@ -0,0 +1,110 @@
+"""
+Benchmark of the two money storage layouts (see app.money): NUMERIC(36, 20) against BIGINT minor units.
+
+For each layout a temporary transfers-like table is filled with the same random amounts, and the
+script reports the table and index sizes, the time of a grouped SUM over the whole table (the
+shape of the reconciliation and analytics queries) and the client-side insert throughput,
+including the Decimal to minor-unit conversion done by the Money column type.
+
+Usage:
+    python -m benchmarks.money_storage [--rows 1000000] [--client-rows 50000] [--accounts 10000]
+"""
+import argparse
+import random
+import time
+import uuid
+from decimal import Decimal
+
+from sqlalchemy import text
+
+from app import money
+from app.database import engine
+
+LAYOUTS = {
+    money.NUMERIC: f"NUMERIC({money.NUMERIC_PRECISION}, {money.NUMERIC_SCALE})",
+    money.INT64: "BIGINT",
+}
+
+
+def _best_of(conn, statement, repeat=3) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(text(statement)).all()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(rows: int, client_rows: int, accounts: int, scale: int = 2) -> dict:
+    results = {}
+    amount_expr = {
+        money.NUMERIC: f"round((random() * 10000)::numeric, {scale})",
+        money.INT64: f"floor(random() * 10000 * 10 ^ {scale})::bigint",
+    }
+    amounts = [Decimal(random.randint(1, 10 ** 6)).scaleb(-scale) for _ in range(client_rows)]
+    account_ids = [uuid.uuid4() for _ in range(accounts)]
+
+    for layout, column_type in LAYOUTS.items():
+        table = f"bench_money_{layout}"
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+            conn.execute(text(
+                f"CREATE TABLE {table} (id uuid PRIMARY KEY, account_id uuid NOT NULL, amount {column_type} NOT NULL)"
+            ))
+            conn.execute(text(
+                f"INSERT INTO {table} SELECT gen_random_uuid(), "
+                f"('00000000-0000-4000-8000-' || lpad(to_hex((random() * {accounts})::int), 12, '0'))::uuid, "
+                f"{amount_expr[layout]} FROM generate_series(1, {rows})"
+            ))
+            conn.execute(text(f"CREATE INDEX ON {table} (amount)"))
+            conn.execute(text(f"ANALYZE {table}"))
+
+        with engine.connect() as conn:
+            heap = conn.execute(text(f"SELECT pg_relation_size('{table}')")).scalar()
+            amount_index = conn.execute(text(
+                f"SELECT pg_relation_size(indexrelid) FROM pg_index "
+                f"WHERE indrelid = '{table}'::regclass AND NOT indisprimary"
+            )).scalar()
+            aggregate = _best_of(conn, f"SELECT account_id, SUM(amount) FROM {table} GROUP BY account_id")
+            total = _best_of(conn, f"SELECT SUM(amount) FROM {table}")
+
+        values = [
+            {"id": uuid.uuid4(), "account_id": random.choice(account_ids),
+             "amount": money.to_minor_units(amount, scale) if layout == money.INT64 else amount}
+            for amount in amounts
+        ]
+        with engine.begin() as conn:
+            start = time.perf_counter()
+            conn.execute(text(f"INSERT INTO {table} (id, account_id, amount) VALUES (:id, :account_id, :amount)"), values)
+            insert_seconds = time.perf_counter() - start
+
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE {table}"))
+
+        results[layout] = {
+            "heap_mb": heap / 2 ** 20,
+            "amount_index_mb": amount_index / 2 ** 20,
+            "group_by_sum_ms": aggregate * 1000,
+            "sum_ms": total * 1000,
+            "client_inserts_per_s": client_rows / insert_seconds,
+        }
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare NUMERIC and BIGINT money storage.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--client-rows", type=int, default=50_000)
+    parser.add_argument("--accounts", type=int, default=10_000)
+    args = parser.parse_args(argv)
+
+    results = run(args.rows, args.client_rows, args.accounts)
+    metrics = list(next(iter(results.values())))
+    print(f"{'metric':<24}" + "".join(f"{layout:>14}" for layout in results))
+    for metric in metrics:
+        print(f"{metric:<24}" + "".join(f"{results[layout][metric]:>14.1f}" for layout in results))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,87 @@
+"""
+Throughput of the production launcher (app.server) by number of worker processes.
+
+For every worker count the server is started on a free port, one account is created, and
+`--clients` load-generating processes send `GET /accounts/{id}/balance` over keep-alive
+connections for `--duration` seconds. Run it on a machine with more cores than the largest worker
+count plus the clients, otherwise the load generator competes with the server for CPU.
+
+Usage:
+    python -m benchmarks.server_workers [--workers 1 2 4 8] [--clients 16] [--duration 10]
+"""
+import argparse
+import multiprocessing
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_until_ready(base_url: str, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"{base_url}/docs", timeout=1.0)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+def _client(url: str, duration: float) -> int:
+    requests = 0
+    with httpx.Client() as client:
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            client.get(url).raise_for_status()
+            requests += 1
+    return requests
+
+
+def measure(workers: int, clients: int, duration: float) -> float:
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "app.server", "--workers", str(workers), "--port", str(port),
+         "--host", "127.0.0.1", "--access-log", "0"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_until_ready(base_url)
+        customer_id = httpx.post(f"{base_url}/customers/", json={"name": "Bench"}).json()["id"]
+        account_id = httpx.post(f"{base_url}/accounts/", json={"customer_id": customer_id, "balance": "100.00"}).json()["id"]
+        url = f"{base_url}/accounts/{account_id}/balance"
+        with multiprocessing.Pool(clients) as pool:
+            started = time.monotonic()
+            counts = pool.starmap(_client, [(url, duration)] * clients)
+            elapsed = time.monotonic() - started
+        return sum(counts) / elapsed
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Measure API throughput by number of server workers.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args(argv)
+
+    print(f"{'workers':>8}{'req/s':>12}")
+    for workers in args.workers:
+        print(f"{workers:>8}{measure(workers, args.clients, args.duration):>12.0f}", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
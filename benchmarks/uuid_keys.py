@@ -0,0 +1,75 @@
+"""
+Insert benchmark for primary key layouts (see app.ids).
+
+Inserts the same number of rows into a transfers-like table keyed by random UUIDv4 keys and by
+time-ordered UUIDv7 keys, each with and without the redundant second index that `index=True` used
+to create on the primary key. Keys are generated in Python like the ORM does and inserted in
+batches; the script reports rows per second and the resulting index sizes.
+
+Usage:
+    python -m benchmarks.uuid_keys [--rows 1000000] [--batch-size 5000]
+"""
+import argparse
+import time
+import uuid
+
+from sqlalchemy import text
+
+from app.database import engine
+from app.ids import uuid7
+
+GENERATORS = {"uuid4": uuid.uuid4, "uuid7": uuid7}
+
+
+def run(rows: int, batch_size: int) -> dict:
+    results = {}
+    for name, generate in GENERATORS.items():
+        for duplicate_index in (True, False):
+            label = f"{name}{' + dup index' if duplicate_index else ''}"
+            table = f"bench_keys_{name}"
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+                conn.execute(text(
+                    f"CREATE TABLE {table} (id uuid PRIMARY KEY, account_id uuid NOT NULL, "
+                    f"amount numeric(36, 20) NOT NULL, timestamp timestamptz NOT NULL DEFAULT now())"
+                ))
+                if duplicate_index:
+                    conn.execute(text(f"CREATE INDEX ix_{table}_id ON {table} (id)"))
+
+            account_id = str(uuid.uuid4())
+            elapsed = 0.0
+            for start in range(0, rows, batch_size):
+                ids = [str(generate()) for _ in range(min(batch_size, rows - start))]
+                with engine.begin() as conn:
+                    began = time.perf_counter()
+                    conn.execute(
+                        text(f"INSERT INTO {table} (id, account_id, amount) "
+                             f"SELECT unnest(CAST(:ids AS uuid[])), CAST(:account_id AS uuid), 1"),
+                        {"ids": ids, "account_id": account_id},
+                    )
+                    elapsed += time.perf_counter() - began
+
+            with engine.begin() as conn:
+                index_bytes = conn.execute(text(
+                    f"SELECT sum(pg_relation_size(indexrelid)) FROM pg_index WHERE indrelid = '{table}'::regclass"
+                )).scalar()
+                conn.execute(text(f"DROP TABLE {table}"))
+            results[label] = {"rows_per_s": rows / elapsed, "index_mb": index_bytes / 2 ** 20}
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare insert throughput of UUIDv4 and UUIDv7 primary keys.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    results = run(args.rows, args.batch_size)
+    print(f"{'layout':<22}{'rows/s':>12}{'index MB':>12}")
+    for label, result in results.items():
+        print(f"{label:<22}{result['rows_per_s']:>12.0f}{result['index_mb']:>12.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
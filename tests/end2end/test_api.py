@@ -1,10 +1,19 @@
+import json
+import os
+import time
+from datetime import datetime, timezone
+from contextlib import contextmanager
 import pytest
+from sqlalchemy import event
 from app.main import app
 from fastapi.testclient import TestClient
 from hypothesis import given, strategies as st, settings, HealthCheck
 from uuid import UUID
 from decimal import Decimal
 from ..conftest import db_session
+from app import database, slow_queries
+from app.ids import uuid7
+from app.jobs import export as export_jobs
 
 def decimal_strategy():
     return st.decimals(min_value=Decimal('0.01'), max_value=Decimal('1000000.00'), places=2).map(lambda d: d.quantize(Decimal('0.01')))
@@ -126,3 +135,259 @@ def test_get_account_transfers(db_session, data):
                 assert transfer["to_account_id"] == account2_id
                 assert Decimal(transfer["amount"]) == amount
 
+
+
+def test_account_etag_conditional_get(db_session):
+    with db_session() as session:
+        with TestClient(app) as client:
+            customer_id = client.post("/customers/", json={"name": "Etag Owner"}).json()["id"]
+            account1_id = client.post("/accounts/", json={"customer_id": customer_id, "balance": "100.00"}).json()["id"]
+            account2_id = client.post("/accounts/", json={"customer_id": customer_id, "balance": "50.00"}).json()["id"]
+
+            response = client.get(f"/accounts/{account1_id}")
+            assert response.status_code == 200
+            etag = response.headers["ETag"]
+
+            response = client.get(f"/accounts/{account1_id}", headers={"If-None-Match": etag})
+            assert response.status_code == 304
+            assert response.headers["ETag"] == etag
+
+            response = client.get(f"/accounts/{account1_id}/balance", headers={"If-None-Match": f"W/{etag}"})
+            assert response.status_code == 304
+
+            response = client.post("/transfers/", json={
+                "from_account_id": account1_id,
+                "to_account_id": account2_id,
+                "amount": "10.00"
+            })
+            assert response.status_code == 200
+
+            response = client.get(f"/accounts/{account1_id}/balance", headers={"If-None-Match": etag})
+            assert response.status_code == 200
+            assert response.headers["ETag"] != etag
+            assert Decimal(str(response.json()["balance"])) == Decimal("90.00")
+
+
+def test_account_balance_as_of(db_session):
+    with db_session() as session:
+        with TestClient(app) as client:
+            customer_id = client.post("/customers/", json={"name": "Audit Owner"}).json()["id"]
+            account1_id = client.post("/accounts/", json={"customer_id": customer_id, "balance": "100.00"}).json()["id"]
+            account2_id = client.post("/accounts/", json={"customer_id": customer_id, "balance": "50.00"}).json()["id"]
+            opened_at = datetime.now(timezone.utc).isoformat()
+            time.sleep(0.01)
+            client.post("/transfers/", json={
+                "from_account_id": account1_id, "to_account_id": account2_id, "amount": "10.00"})
+            transferred_at = datetime.now(timezone.utc).isoformat()
+
+            response = client.get(f"/accounts/{account1_id}/balance", params={"as_of": opened_at})
+            assert response.status_code == 200
+            assert "ETag" not in response.headers
+            assert Decimal(str(response.json()["balance"])) == Decimal("100.00")
+            response = client.get(f"/accounts/{account1_id}/balance", params={"as_of": transferred_at})
+            assert Decimal(str(response.json()["balance"])) == Decimal("90.00")
+
+            response = client.get(f"/accounts/{uuid7()}/balance", params={"as_of": opened_at})
+            assert response.status_code == 404
+
+
+def test_recurring_transfer_lifecycle(db_session):
+    with db_session() as session:
+        with TestClient(app) as client:
+            customer_id = client.post("/customers/", json={"name": "Standing Order"}).json()["id"]
+            account1_id = client.post("/accounts/", json={"customer_id": customer_id, "balance": "100.00"}).json()["id"]
+            account2_id = client.post("/accounts/", json={"customer_id": customer_id, "balance": "50.00"}).json()["id"]
+
+            response = client.post("/recurring-transfers/", json={
+                "from_account_id": account1_id,
+                "to_account_id": account2_id,
+                "amount": "25.00",
+                "frequency": "monthly",
+                "start_at": "2030-01-31T09:00:00Z"
+            })
+            assert response.status_code == 200
+            data = response.json()
+            assert data["active"] is True
+            assert data["next_run_at"].startswith("2030-01-31T09:00:00")
+
+            response = client.delete(f"/recurring-transfers/{data['id']}")
+            assert response.status_code == 200
+            assert response.json()["active"] is False
+
+            response = client.post("/recurring-transfers/", json={
+                "from_account_id": account1_id,
+                "to_account_id": account1_id,
+                "amount": "25.00",
+                "frequency": "daily"
+            })
+            assert response.status_code == 422
+
+
+def _wait_for_export(client, export_job_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/exports/{export_job_id}").json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.2)
+    raise AssertionError("export did not finish")
+
+
+@pytest.mark.parametrize("export_format", ["csv", "ndjson"])
+def test_export_account_transfers(db_session, tmp_path, monkeypatch, export_format):
+    monkeypatch.setenv("EXPORT_DIR", str(tmp_path))
+    monkeypatch.setattr(export_jobs, "EXPORT_DIR", str(tmp_path))
+    with db_session() as session:
+        with TestClient(app) as client:
+            customer_id = client.post("/customers/", json={"name": "Export Owner"}).json()["id"]
+            account1_id = client.post("/accounts/", json={"customer_id": customer_id, "balance": "100.00"}).json()["id"]
+            account2_id = client.post("/accounts/", json={"customer_id": customer_id, "balance": "50.00"}).json()["id"]
+            for amount in ("1.00", "2.50", "3.25"):
+                client.post("/transfers/", json={
+                    "from_account_id": account1_id, "to_account_id": account2_id, "amount": amount})
+
+            response = client.post("/exports/", json={"account_id": account1_id, "format": export_format})
+            assert response.status_code == 202
+            job = _wait_for_export(client, response.json()["id"])
+            assert job["status"] == "completed"
+            assert job["rows"] == 3
+
+            response = client.get(f"/exports/{job['id']}/download")
+            assert response.status_code == 200
+            if export_format == "csv":
+                lines = response.text.strip().splitlines()
+                assert lines[0] == "id,from_account_id,to_account_id,amount,timestamp"
+                assert [Decimal(line.split(",")[3]) for line in lines[1:]] == [Decimal("1.00"), Decimal("2.50"), Decimal("3.25")]
+            else:
+                rows = [json.loads(line) for line in response.text.strip().splitlines()]
+                assert [row["to_account_id"] for row in rows] == [account2_id] * 3
+
+            response = client.post("/exports/", json={"account_id": str(uuid7()), "format": export_format})
+            assert response.status_code == 404
+
+
+def test_account_counterparties_and_flows(db_session):
+    with db_session() as session:
+        with TestClient(app) as client:
+            customer_id = client.post("/customers/", json={"name": "Flow Owner"}).json()["id"]
+            a, b, c = [
+                client.post("/accounts/", json={"customer_id": customer_id, "balance": "100.00"}).json()["id"]
+                for _ in range(3)
+            ]
+            for from_id, to_id, amount in [(a, b, "10.00"), (a, b, "5.00"), (b, c, "7.00"), (c, a, "1.00")]:
+                response = client.post("/transfers/", json={
+                    "from_account_id": from_id, "to_account_id": to_id, "amount": amount})
+                assert response.status_code == 200
+
+            response = client.get(f"/accounts/{a}/counterparties")
+            assert response.status_code == 200
+            counterparties = response.json()
+            assert [row["account_id"] for row in counterparties] == [b, c]
+            assert counterparties[0]["transfer_count"] == 2
+            assert Decimal(str(counterparties[0]["sent_amount"])) == Decimal("15.00")
+
+            response = client.get(f"/accounts/{a}/flows", params={"depth": 2})
+            assert response.status_code == 200
+            graph = response.json()
+            assert graph["nodes"] == [a, b, c]
+            assert [edge["depth"] for edge in graph["edges"]] == [1, 2]
+
+            assert client.get(f"/accounts/{a}/flows", params={"depth": 5}).status_code == 422
+            assert client.get(f"/accounts/{uuid7()}/counterparties").status_code == 404
+            assert client.get(f"/accounts/{uuid7()}/flows").status_code == 404
+
+
+def test_slow_query_diagnostics(db_session, monkeypatch):
+    with db_session() as session:
+        with TestClient(app) as client:
+            assert client.get("/diagnostics/slow-queries").status_code == 404
+
+            customer_id = client.post("/customers/", json={"name": "Slow Owner"}).json()["id"]
+            account_id = client.post("/accounts/", json={"customer_id": customer_id, "balance": "100.00"}).json()["id"]
+
+            monkeypatch.setattr(slow_queries.log, "threshold_ms", 0.000001)
+            monkeypatch.setattr(slow_queries.log, "explain_rate", 1.0)
+            slow_queries.log.clear()
+            slow_queries.log.install(database.engine)
+            try:
+                assert client.get(f"/accounts/{account_id}/balance").status_code == 200
+            finally:
+                slow_queries.log.uninstall(database.engine)
+
+            response = client.get("/diagnostics/slow-queries")
+            assert response.status_code == 200
+            entry = next(e for e in response.json() if e["caller"] == "app.crud.account.get_account")
+            assert entry["route"] == "GET /accounts/{account_id}/balance"
+            assert entry["analyzed"]
+            assert "on accounts" in entry["plan"]
+
+
+def test_transaction_metrics(db_session):
+    with db_session() as session:
+        with TestClient(app) as client:
+            customer_id = client.post("/customers/", json={"name": "Metrics Owner"}).json()["id"]
+            account1_id = client.post("/accounts/", json={"customer_id": customer_id, "balance": "100.00"}).json()["id"]
+            account2_id = client.post("/accounts/", json={"customer_id": customer_id, "balance": "100.00"}).json()["id"]
+            before = client.get("/diagnostics/transactions").json().get("create_transfer", {}).get("attempts", 0)
+            client.post("/transfers/", json={"from_account_id": account1_id, "to_account_id": account2_id, "amount": "1.00"})
+
+            response = client.get("/diagnostics/transactions")
+            assert response.status_code == 200
+            assert response.headers["X-Worker-PID"] == str(os.getpid())
+            assert response.json()["create_transfer"]["attempts"] == before + 1
+
+
+def test_outbox_diagnostics(db_session):
+    with db_session() as session:
+        with TestClient(app) as client:
+            response = client.get("/diagnostics/outbox")
+            assert response.status_code == 200
+            assert response.json() == {database.DEFAULT_SHARD: {"undelivered": 0, "oldest": None}}
+
+
+@contextmanager
+def _count_statements():
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(database.engine, "before_cursor_execute", count)
+    try:
+        yield statements
+    finally:
+        event.remove(database.engine, "before_cursor_execute", count)
+
+
+def test_endpoint_statement_budgets(db_session):
+    with db_session() as session:
+        with TestClient(app) as client:
+            def request(method, url, budget, **kwargs):
+                with _count_statements() as statements:
+                    response = client.request(method, url, **kwargs)
+                assert response.status_code < 400, response.text
+                assert len(statements) == budget, f"{method} {url}: " + "\n".join(statements)
+                return response
+
+            customer_id = request("POST", "/customers/", 1, json={"name": "Budget Owner"}).json()["id"]
+            account1_id = request("POST", "/accounts/", 1, json={"customer_id": customer_id, "balance": "100.00"}).json()["id"]
+            account2_id = request("POST", "/accounts/", 1, json={"customer_id": customer_id, "balance": "100.00"}).json()["id"]
+
+            # One SELECT of both accounts, the INSERT, two versioned UPDATEs and the edge upsert
+            transfer = request("POST", "/transfers/", 5, json={
+                "from_account_id": account1_id, "to_account_id": account2_id, "amount": "1.00"}).json()
+            assert transfer["amount"] == "1.00"
+
+            request("GET", f"/customers/{customer_id}", 1)
+            request("GET", f"/transfers/{transfer['id']}", 1)
+            request("GET", f"/transfers/account/{account1_id}", 1)
+            etag = request("GET", f"/accounts/{account1_id}", 1).headers["ETag"]
+            request("GET", f"/accounts/{account1_id}/balance", 1)
+            request("GET", f"/accounts/{account1_id}/balance", 1, headers={"If-None-Match": etag})
+
+            # Account existence check and INSERT
+            recurring = request("POST", "/recurring-transfers/", 2, json={
+                "from_account_id": account1_id, "to_account_id": account2_id, "amount": "1.00",
+                "frequency": "monthly", "start_at": "2030-01-31T09:00:00Z"}).json()
+            # SELECT ... FOR UPDATE and UPDATE
+            request("DELETE", f"/recurring-transfers/{recurring['id']}", 2)
@@ -0,0 +1,95 @@
+from datetime import date
+from decimal import Decimal
+import pytest
+from sqlalchemy import func
+from app.models.models import AccrualRun, Transfer, TransferEdge
+from app.schemas.schemas import CustomerCreate, AccountCreate
+from app.crud import customer as customer_crud
+from app.crud import account as account_crud
+from app.crud.accrual import post_accrual_chunk
+from app.jobs import accrual
+
+
+def _accounts(session, balances):
+    customer = customer_crud.create_customer(session, CustomerCreate(name="Accrual Owner"))
+    return [
+        account_crud.create_account(session, AccountCreate(customer_id=customer.id, balance=Decimal(balance))).id
+        for balance in balances
+    ]
+
+
+def test_accrual_posts_interest_and_fees(db_session):
+    with db_session() as session:
+        interest_account, fee_account = _accounts(session, ['1000000.00', '1.00'])
+        rich, modest, poor = _accounts(session, ['36500.00', '100.00', '0.50'])
+
+    summary = accrual.run(date(2030, 1, 31), Decimal('0.05'), Decimal('1.00'), interest_account, fee_account,
+                          fee_waiver_balance=Decimal('10000.00'), chunk_size=2)
+
+    with db_session() as session:
+        balance = lambda account_id: account_crud.get_account(session, account_id).balance
+        # 36500.00 * 5% / 365 = 5.00 and no fee above the waiver balance
+        assert balance(rich) == Decimal('36505.00')
+        # 100.00 * 5% / 365 = 0.0136..., rounded down to 0.01, then the 1.00 fee
+        assert balance(modest) == Decimal('99.01')
+        # The fee never takes a balance below zero
+        assert balance(poor) == Decimal('0.00')
+        assert account_crud.get_account_version(session, rich) == 2
+
+        # The run covers every account in the database, not only the ones created here
+        run = session.get(AccrualRun, date(2030, 1, 31))
+        assert run.status == "completed"
+        assert run.interest_postings >= 2 and run.fee_postings >= 2
+        assert balance(interest_account) == Decimal('1000000.00') - run.interest_total
+        assert balance(fee_account) == Decimal('1.00') + run.fee_total
+        assert session.get(TransferEdge, (modest, fee_account)).total_amount == Decimal('1.00')
+        assert session.get(TransferEdge, (interest_account, rich)).total_amount == Decimal('5.00')
+
+        # The postings are ordinary ledger transfers, so the ledger still reconciles
+        for account_id in (interest_account, fee_account, rich, modest, poor):
+            account = account_crud.get_account(session, account_id)
+            received = session.query(func.coalesce(func.sum(Transfer.amount), 0)).filter(Transfer.to_account_id == account_id).scalar()
+            sent = session.query(func.coalesce(func.sum(Transfer.amount), 0)).filter(Transfer.from_account_id == account_id).scalar()
+            assert account.balance == account.initial_balance + received - sent
+
+    assert summary["status"] == "completed"
+    assert summary["accounts_per_second"] > 0
+
+    # A completed run is not posted again
+    with db_session() as session:
+        transfers = session.query(func.count(Transfer.id)).scalar()
+    assert accrual.run(date(2030, 1, 31), Decimal('0.05'), Decimal('1.00'), interest_account, fee_account,
+                       fee_waiver_balance=Decimal('10000.00'), chunk_size=2)["processed"] == 0
+    with db_session() as session:
+        assert session.query(func.count(Transfer.id)).scalar() == transfers
+
+
+def test_accrual_resumes_after_last_committed_chunk(db_session, monkeypatch):
+    with db_session() as session:
+        interest_account, fee_account = _accounts(session, ['1000000.00', '1.00'])
+        accounts = _accounts(session, ['365.00'] * 5)
+
+    calls = []
+
+    def fail_on_second_chunk(db, business_date, chunk_size):
+        calls.append(chunk_size)
+        if len(calls) == 2:
+            raise RuntimeError("worker killed")
+        return post_accrual_chunk(db, business_date, chunk_size)
+
+    monkeypatch.setattr(accrual, "post_accrual_chunk", fail_on_second_chunk)
+    with pytest.raises(RuntimeError):
+        accrual.run(date(2030, 2, 1), Decimal('0.10'), Decimal('0'), interest_account, fee_account, chunk_size=2)
+    monkeypatch.undo()
+
+    with pytest.raises(ValueError):
+        accrual.run(date(2030, 2, 1), Decimal('0.20'), Decimal('0'), interest_account, fee_account, chunk_size=2)
+
+    accrual.run(date(2030, 2, 1), Decimal('0.10'), Decimal('0'), interest_account, fee_account, chunk_size=2)
+
+    with db_session() as session:
+        # 365.00 * 10% / 365 = 0.10, posted exactly once to every account
+        for account_id in accounts:
+            assert account_crud.get_account(session, account_id).balance == Decimal('365.10')
+        assert session.query(func.count(Transfer.id)).filter(
+            Transfer.from_account_id == interest_account).scalar() == session.get(AccrualRun, date(2030, 2, 1)).interest_postings
@@ -0,0 +1,95 @@
+from decimal import Decimal
+from app.schemas.schemas import CustomerCreate, AccountCreate, TransferCreate
+from app.crud import customer as customer_crud
+from app.crud import account as account_crud
+from app.crud import transfer as transfer_crud
+from app.crud import analytics as analytics_crud
+from app.ids import uuid7
+
+
+def _accounts(session, count):
+    customer = customer_crud.create_customer(session, CustomerCreate(name="Analytics Owner"))
+    return [
+        account_crud.create_account(session, AccountCreate(customer_id=customer.id, balance=Decimal('1000.00'))).id
+        for _ in range(count)
+    ]
+
+
+def _transfer(session, from_account_id, to_account_id, amount):
+    transfer_crud.create_transfer(session, TransferCreate(
+        from_account_id=from_account_id, to_account_id=to_account_id, amount=Decimal(amount)))
+
+
+def test_counterparties_by_volume_and_count(db_session):
+    with db_session() as session:
+        a, b, c, d = _accounts(session, 4)
+        _transfer(session, a, b, '100.00')
+        _transfer(session, b, a, '25.50')
+        for _ in range(3):
+            _transfer(session, a, c, '10.00')
+        _transfer(session, d, a, '1.00')
+
+        by_volume = analytics_crud.get_counterparties(session, a)
+        assert [row["account_id"] for row in by_volume] == [b, c, d]
+        assert by_volume[0]["transfer_count"] == 2
+        assert by_volume[0]["total_amount"] == Decimal('125.50')
+        assert by_volume[0]["sent_amount"] == Decimal('100.00')
+        assert by_volume[0]["received_amount"] == Decimal('25.50')
+        assert by_volume[2]["sent_count"] == 0
+        assert by_volume[2]["received_count"] == 1
+
+        by_count = analytics_crud.get_counterparties(session, a, order_by="count", limit=2)
+        assert [row["account_id"] for row in by_count] == [c, b]
+
+        assert analytics_crud.get_counterparties(session, uuid7()) is None
+
+
+def test_counterparties_cache_is_invalidated_by_transfers(db_session):
+    with db_session() as session:
+        a, b, c = _accounts(session, 3)
+        _transfer(session, a, b, '5.00')
+        first = analytics_crud.get_counterparties(session, a)
+        assert analytics_crud.get_counterparties(session, a) is first
+
+        # A transfer between other accounts leaves the cached result valid
+        _transfer(session, b, c, '1.00')
+        assert analytics_crud.get_counterparties(session, a) is first
+
+        _transfer(session, c, a, '2.00')
+        second = analytics_crud.get_counterparties(session, a)
+        assert second is not first
+        assert {row["account_id"] for row in second} == {b, c}
+
+
+def test_flow_graph(db_session):
+    with db_session() as session:
+        a, b, c, d, e = _accounts(session, 5)
+        _transfer(session, a, b, '50.00')
+        _transfer(session, a, c, '20.00')
+        _transfer(session, b, d, '30.00')
+        _transfer(session, d, a, '10.00')  # cycle back to the start
+        _transfer(session, d, e, '5.00')
+
+        graph = analytics_crud.get_flow_graph(session, a, depth=2)
+        assert graph["nodes"] == [a, b, c, d]
+        assert [(edge["from_account_id"], edge["to_account_id"], edge["depth"]) for edge in graph["edges"]] == [
+            (a, b, 1), (a, c, 1), (b, d, 2)]
+        assert not graph["truncated"]
+
+        graph = analytics_crud.get_flow_graph(session, a, depth=4)
+        assert set(graph["nodes"]) == {a, b, c, d, e}
+        assert len(graph["edges"]) == 5
+
+        graph = analytics_crud.get_flow_graph(session, a, depth=3, max_edges=2)
+        assert [(edge["from_account_id"], edge["to_account_id"]) for edge in graph["edges"]] == [(a, b), (a, c)]
+        assert graph["truncated"]
+
+        graph = analytics_crud.get_flow_graph(session, e, depth=2, direction="in")
+        assert graph["nodes"] == [e, d, b]
+
+        # A transfer from an account expanded at the second hop invalidates the cached graph
+        cached = analytics_crud.get_flow_graph(session, a, depth=2)
+        _transfer(session, b, e, '1.00')
+        graph = analytics_crud.get_flow_graph(session, a, depth=2)
+        assert graph is not cached
+        assert e in graph["nodes"]
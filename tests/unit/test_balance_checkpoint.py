@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from sqlalchemy import delete, select, update
+from app.crud import account as account_crud
+from app.crud import customer as customer_crud
+from app.crud import transfer as transfer_crud
+from app.crud.balance_checkpoint import get_balance_as_of
+from app.ids import uuid7
+from app.jobs import checkpoint
+from app.models.models import BalanceCheckpoint, Transfer, TransferOutbox
+from app.schemas.schemas import AccountCreate, CustomerCreate, TransferCreate
+
+DAY = timedelta(days=1)
+T0 = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+def _history(session):
+    """
+    Two accounts opened with 100.00 and 50.00 and three transfers between them, a day apart.
+    """
+    customer = customer_crud.create_customer(session, CustomerCreate(name="Audit Owner"))
+    account1, account2 = (
+        account_crud.create_account(session, AccountCreate(customer_id=customer.id, balance=Decimal(balance))).id
+        for balance in ('100.00', '50.00')
+    )
+    for days, from_id, to_id, amount in ((1, account1, account2, '10.00'), (2, account2, account1, '3.00'),
+                                         (3, account1, account2, '20.00')):
+        transfer = transfer_crud.create_transfer(session, TransferCreate(
+            from_account_id=from_id, to_account_id=to_id, amount=Decimal(amount)))
+        session.execute(update(Transfer).where(Transfer.id == transfer.id).values(timestamp=T0 + days * DAY))
+        session.commit()
+    return account1, account2
+
+
+# Balances of the two accounts at each point in time, replayed by hand
+EXPECTED = [
+    (T0, '100.00', '50.00'),
+    (T0 + DAY - timedelta(microseconds=1), '100.00', '50.00'),
+    (T0 + DAY, '90.00', '60.00'),
+    (T0 + 2 * DAY, '93.00', '57.00'),
+    (T0 + 2 * DAY + timedelta(hours=12), '93.00', '57.00'),
+    (T0 + 3 * DAY, '73.00', '77.00'),
+    (T0 + 30 * DAY, '73.00', '77.00'),
+]
+
+
+def _assert_history(session, account1, account2):
+    for as_of, balance1, balance2 in EXPECTED:
+        assert get_balance_as_of(session, account1, as_of) == Decimal(balance1), as_of
+        assert get_balance_as_of(session, account2, as_of) == Decimal(balance2), as_of
+
+
+def _checkpoints(session, account_id):
+    return session.execute(
+        select(BalanceCheckpoint.as_of, BalanceCheckpoint.balance)
+        .where(BalanceCheckpoint.account_id == account_id).order_by(BalanceCheckpoint.as_of)
+    ).all()
+
+
+def test_balance_as_of_without_checkpoints(db_session):
+    with db_session() as session:
+        account1, account2 = _history(session)
+        _assert_history(session, account1, account2)
+        # Times without a zone are UTC
+        assert get_balance_as_of(session, account1, datetime(2020, 1, 2)) == Decimal('90.00')
+        assert get_balance_as_of(session, account1, T0 + 30 * DAY) == account_crud.get_account(session, account1).balance
+
+
+def test_balance_as_of_uses_checkpoints(db_session):
+    with db_session() as session:
+        account1, account2 = _history(session)
+
+    middle = T0 + 2 * DAY + timedelta(hours=12)
+    summary = checkpoint.run(as_of=middle, chunk_size=50)
+    assert summary["checkpoints"] >= 2
+    # Running again writes nothing new
+    assert checkpoint.run(as_of=middle, chunk_size=50)["checkpoints"] == 0
+
+    with db_session() as session:
+        assert _checkpoints(session, account1) == [(middle, Decimal('93.00'))]
+        assert _checkpoints(session, account2) == [(middle, Decimal('57.00'))]
+        _assert_history(session, account1, account2)
+
+        # Balances after the checkpoint are computed from it, balances before it are not
+        session.execute(update(BalanceCheckpoint).where(BalanceCheckpoint.account_id == account1)
+                        .values(balance=BalanceCheckpoint.balance + Decimal('1000')))
+        session.commit()
+        assert get_balance_as_of(session, account1, T0 + 3 * DAY) == Decimal('1073.00')
+        assert get_balance_as_of(session, account1, T0 + DAY) == Decimal('90.00')
+        session.execute(update(BalanceCheckpoint).where(BalanceCheckpoint.account_id == account1)
+                        .values(balance=BalanceCheckpoint.balance - Decimal('1000')))
+        session.commit()
+
+    # Only accounts with transfers since their latest checkpoint get a new one
+    checkpoint.run(as_of=T0 + 4 * DAY, chunk_size=50)
+    checkpoint.run(as_of=T0 + 5 * DAY, chunk_size=50)
+    with db_session() as session:
+        assert _checkpoints(session, account1) == [(middle, Decimal('93.00')), (T0 + 4 * DAY, Decimal('73.00'))]
+        _assert_history(session, account1, account2)
+
+
+def test_checkpoint_time_waits_for_undelivered_credits(db_session):
+    now = datetime.now(timezone.utc)
+    assert checkpoint.checkpoint_time(settle=60, now=now) == now - timedelta(seconds=60)
+
+    with db_session() as session:
+        account1, _ = _history(session)
+        transfer_id = session.execute(
+            select(Transfer.id).where(Transfer.from_account_id == account1).order_by(Transfer.timestamp)
+        ).scalars().first()
+        session.add(TransferOutbox(transfer_id=transfer_id))
+        session.commit()
+        try:
+            assert checkpoint.checkpoint_time(settle=60, now=now) == T0 + DAY - timedelta(microseconds=1)
+        finally:
+            session.execute(delete(TransferOutbox).where(TransferOutbox.transfer_id == transfer_id))
+            session.commit()
+
+
+def test_balance_as_of_unknown_account(db_session):
+    with db_session() as session:
+        assert get_balance_as_of(session, uuid7(), T0) is None
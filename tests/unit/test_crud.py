@@ -1,11 +1,15 @@
 import string
 import pytest
+from concurrent.futures import ThreadPoolExecutor
 from hypothesis import given, settings, strategies as st
 from app.schemas.schemas import CustomerCreate, AccountCreate, TransferCreate
 from app.crud import customer as customer_crud
 from app.crud import account as account_crud
 from app.crud import transfer as transfer_crud
+from app.crud import unit_of_work
 from decimal import Decimal
+from sqlalchemy import event
+from sqlalchemy.orm.exc import StaleDataError
 
 def valid_name_strategy():
     return st.text(min_size=1, max_size=50, alphabet=string.ascii_letters + " -'").map(lambda s: s.strip()).filter(lambda x: len(x) > 0)
@@ -108,3 +112,69 @@ def test_get_account_transfers(db_session, data):
         final_account2 = account_crud.get_account(session, account2.id)
         assert final_account1.balance == initial_balance1 - total_transfer_amount
         assert final_account2.balance == initial_balance2 + total_transfer_amount
+
+
+def test_account_version_increments_on_balance_change(db_session):
+    with db_session() as session:
+        customer = customer_crud.create_customer(session, CustomerCreate(name="Version Owner"))
+        account = account_crud.create_account(session, AccountCreate(customer_id=customer.id, balance=Decimal('100.00')))
+        assert account_crud.get_account_version(session, account.id) == 1
+
+        account_crud.update_account_balance(session, account.id, Decimal('5.00'))
+        assert account_crud.get_account_version(session, account.id) == 2
+
+
+def test_concurrent_balance_change_is_rejected(db_session):
+    with db_session() as session, db_session() as other_session:
+        customer = customer_crud.create_customer(session, CustomerCreate(name="Race Owner"))
+        account = account_crud.create_account(session, AccountCreate(customer_id=customer.id, balance=Decimal('100.00')))
+
+        # Load the account in a second session, then change it underneath that session
+        stale = account_crud.get_account(other_session, account.id)
+        account_crud.update_account_balance(session, account.id, Decimal('5.00'))
+
+        stale.balance += Decimal('1.00')
+        with pytest.raises(StaleDataError):
+            other_session.commit()
+        other_session.rollback()
+
+        assert account_crud.get_account(session, account.id).balance == Decimal('105.00')
+
+
+def test_concurrent_transfers_are_retried(db_session, monkeypatch):
+    monkeypatch.setattr(unit_of_work, "WRITE_RETRY_ATTEMPTS", 50)
+    with db_session() as session:
+        customer = customer_crud.create_customer(session, CustomerCreate(name="Contended Owner"))
+        account1 = account_crud.create_account(session, AccountCreate(customer_id=customer.id, balance=Decimal('100.00')))
+        account2 = account_crud.create_account(session, AccountCreate(customer_id=customer.id, balance=Decimal('1.00')))
+        account1_id, account2_id = account1.id, account2.id
+
+    def send(count):
+        with db_session() as worker_session:
+            for _ in range(count):
+                transfer_crud.create_transfer(worker_session, TransferCreate(
+                    from_account_id=account1_id, to_account_id=account2_id, amount=Decimal('1.00')))
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(send, [5] * 4))
+
+    with db_session() as session:
+        assert account_crud.get_account(session, account1_id).balance == Decimal('80.00')
+        assert account_crud.get_account(session, account2_id).balance == Decimal('21.00')
+
+
+def test_update_account_balance_is_a_single_statement(db_session):
+    with db_session() as session:
+        customer = customer_crud.create_customer(session, CustomerCreate(name="Budget Owner"))
+        account = account_crud.create_account(session, AccountCreate(customer_id=customer.id, balance=Decimal('100.00')))
+
+        statements = []
+        count = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(session.get_bind(), "before_cursor_execute", count)
+        try:
+            updated = account_crud.update_account_balance(session, account.id, Decimal('-2.50'))
+            assert updated.balance == Decimal('97.50')
+            assert updated.version == 2
+        finally:
+            event.remove(session.get_bind(), "before_cursor_execute", count)
+        assert len(statements) == 1 and statements[0].startswith("UPDATE accounts")
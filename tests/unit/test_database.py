@@ -0,0 +1,21 @@
+import multiprocessing
+from sqlalchemy import text
+from app.database import engine
+
+
+def _checked_in_connections(queue):
+    queue.put(engine.pool.checkedin())
+
+
+def test_forked_child_starts_with_empty_pool(db_session):
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    assert engine.pool.checkedin() >= 1
+
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    child = ctx.Process(target=_checked_in_connections, args=(queue,))
+    child.start()
+    child.join()
+    assert queue.get() == 0
+    assert engine.pool.checkedin() >= 1
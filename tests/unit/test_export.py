@@ -0,0 +1,89 @@
+import csv
+import json
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+import pytest
+from sqlalchemy import update
+from app.schemas.schemas import CustomerCreate, AccountCreate, TransferCreate, ExportJobCreate
+from app.crud import customer as customer_crud
+from app.crud import account as account_crud
+from app.crud import transfer as transfer_crud
+from app.crud import export_job as export_job_crud
+from app.jobs import export
+from app.models.models import ExportJob
+
+
+def _create_history(session, transfers):
+    customer = customer_crud.create_customer(session, CustomerCreate(name="Export Owner"))
+    account1 = account_crud.create_account(session, AccountCreate(customer_id=customer.id, balance=Decimal('1000.00')))
+    account2 = account_crud.create_account(session, AccountCreate(customer_id=customer.id, balance=Decimal('10.00')))
+    for i in range(transfers):
+        transfer_crud.create_transfer(session, TransferCreate(
+            from_account_id=account1.id, to_account_id=account2.id, amount=Decimal(i + 1)))
+    return account1.id, account2.id
+
+
+def test_stream_account_transfers_in_chunks(db_session):
+    with db_session() as session:
+        account1_id, account2_id = _create_history(session, 7)
+        chunks = list(transfer_crud.stream_account_transfers(session, account2_id, chunk_size=3))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+    assert [row.amount for chunk in chunks for row in chunk] == [Decimal(i + 1) for i in range(7)]
+
+
+@pytest.mark.parametrize("export_format", ["csv", "ndjson", "parquet"])
+def test_run_export(db_session, tmp_path, monkeypatch, export_format):
+    if not export.format_available(export_format):
+        pytest.skip(f"{export_format} export is not available")
+    monkeypatch.setattr(export, "EXPORT_DIR", str(tmp_path))
+    monkeypatch.setattr(export, "EXPORT_CHUNK_SIZE", 2)
+    with db_session() as session:
+        account1_id, _ = _create_history(session, 5)
+        job = export_job_crud.create_export_job(session, ExportJobCreate(account_id=account1_id, format=export_format))
+        job_id = job.id
+
+        assert export.run_export(job_id)
+        assert not export.run_export()
+
+        session.expire_all()
+        job = export_job_crud.get_export_job(session, job_id)
+        assert job.status == "completed"
+        assert job.rows == 5
+        assert job.finished_at is not None
+        path = job.path
+
+    if export_format == "csv":
+        with open(path, newline="") as f:
+            rows = list(csv.DictReader(f))
+        amounts = [Decimal(row["amount"]) for row in rows]
+    elif export_format == "ndjson":
+        with open(path) as f:
+            amounts = [Decimal(json.loads(line)["amount"]) for line in f]
+    else:
+        import pyarrow.parquet
+        amounts = [Decimal(v) for v in pyarrow.parquet.read_table(path).column("amount").to_pylist()]
+    assert amounts == [Decimal(i + 1) for i in range(5)]
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_stale_running_export_is_claimed_again(db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(export, "EXPORT_DIR", str(tmp_path))
+    with db_session() as session:
+        account1_id, _ = _create_history(session, 3)
+        job_id = export_job_crud.create_export_job(session, ExportJobCreate(account_id=account1_id, format="csv")).id
+        # A worker claims the job and dies
+        assert export_job_crud.claim_export_job(session, job_id).status == "running"
+
+        assert not export.run_export(job_id)
+        assert not export.run_export(job_id, stale_after=timedelta(hours=1))
+
+        session.execute(update(ExportJob).where(ExportJob.id == job_id)
+                        .values(started_at=datetime.now(timezone.utc) - timedelta(hours=2)))
+        session.commit()
+        assert not export.run_export(job_id)
+        assert export.run_export(job_id, stale_after=timedelta(hours=1))
+
+        session.expire_all()
+        job = export_job_crud.get_export_job(session, job_id)
+        assert job.status == "completed"
+        assert job.rows == 3
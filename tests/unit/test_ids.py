@@ -0,0 +1,17 @@
+import time
+from app.ids import uuid7
+
+
+def test_uuid7_layout():
+    before = time.time_ns() // 1_000_000
+    value = uuid7()
+    after = time.time_ns() // 1_000_000
+    assert value.version == 7
+    assert value.variant == "specified in RFC 4122"
+    assert before <= value.int >> 80 <= after + 1
+
+
+def test_uuid7_is_strictly_increasing():
+    values = [uuid7() for _ in range(20000)]
+    assert values == sorted(values)
+    assert len(set(values)) == len(values)
@@ -13,6 +13,7 @@ def test_customer_model(db_session, name):
         db.commit()
         assert customer.id is not None
         assert isinstance(customer.id, UUID)
+        assert customer.id.version == 7
         assert customer.name == name
 
 @given(name=valid_name_strategy())
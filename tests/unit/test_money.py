@@ -0,0 +1,28 @@
+import pytest
+from decimal import Decimal
+from hypothesis import given, strategies as st
+from app import money
+
+
+@given(units=st.integers(min_value=money.INT64_MIN, max_value=money.INT64_MAX), scale=st.integers(min_value=0, max_value=6))
+def test_minor_units_round_trip(units, scale):
+    assert money.to_minor_units(money.from_minor_units(units, scale), scale) == units
+
+
+def test_to_minor_units():
+    assert money.to_minor_units(Decimal('12.30'), 2) == 1230
+    assert money.to_minor_units(Decimal('12.300000'), 2) == 1230
+    assert money.to_minor_units(Decimal('-0.05'), 2) == -5
+    assert money.to_minor_units(Decimal('1E+3'), 0) == 1000
+
+    with pytest.raises(ValueError):
+        money.to_minor_units(Decimal('1.005'), 2)  # Would need rounding
+
+    with pytest.raises(ValueError):
+        money.to_minor_units(Decimal('1E+17'), 3)  # Does not fit in 64 bits
+
+
+def test_decimal_places_never_rounds():
+    assert money.decimal_places(Decimal('10')) == 0
+    assert money.decimal_places(Decimal('1.50')) == 1
+    assert money.decimal_places(Decimal('123456789012345678.12345678901234567891')) == 20
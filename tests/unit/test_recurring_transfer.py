@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from app.schemas.schemas import CustomerCreate, AccountCreate, RecurringTransferCreate
+from app.crud import customer as customer_crud
+from app.crud import account as account_crud
+from app.crud import recurring_transfer as recurring_transfer_crud
+
+
+def _accounts(session, balance1, balance2):
+    customer = customer_crud.create_customer(session, CustomerCreate(name="Standing Order Owner"))
+    account1 = account_crud.create_account(session, AccountCreate(customer_id=customer.id, balance=balance1))
+    account2 = account_crud.create_account(session, AccountCreate(customer_id=customer.id, balance=balance2))
+    return account1, account2
+
+
+def test_monthly_occurrence_clamps_to_month_end():
+    start = datetime(2024, 1, 31, 9, 0, tzinfo=timezone.utc)
+    assert recurring_transfer_crud.occurrence(start, "monthly", 1) == datetime(2024, 2, 29, 9, 0, tzinfo=timezone.utc)
+    assert recurring_transfer_crud.occurrence(start, "monthly", 2) == datetime(2024, 3, 31, 9, 0, tzinfo=timezone.utc)
+    assert recurring_transfer_crud.occurrence(start, "monthly", 12) == datetime(2025, 1, 31, 9, 0, tzinfo=timezone.utc)
+    assert recurring_transfer_crud.occurrence(start, "weekly", 2) == start + timedelta(days=14)
+
+
+def test_first_occurrence_after():
+    start = datetime(2024, 1, 31, 9, 0, tzinfo=timezone.utc)
+    first = recurring_transfer_crud.first_occurrence_after
+    assert first(start, "daily", start - timedelta(days=3)) == 0
+    assert first(start, "daily", start) == 1
+    assert first(start, "daily", start + timedelta(days=365, hours=1)) == 366
+    assert first(start, "weekly", start + timedelta(days=14)) == 3
+    assert first(start, "monthly", datetime(2024, 2, 29, 8, 0, tzinfo=timezone.utc)) == 1
+    assert first(start, "monthly", datetime(2024, 2, 29, 9, 0, tzinfo=timezone.utc)) == 2
+    assert first(start, "monthly", datetime(2025, 1, 1, tzinfo=timezone.utc)) == 12
+    assert first(start, "daily", start, n=5) == 5
+
+
+def test_execute_due_recurring_transfers(db_session):
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    with db_session() as session:
+        account1, account2 = _accounts(session, Decimal('100.00'), Decimal('0.01'))
+        funded = recurring_transfer_crud.create_recurring_transfer(session, RecurringTransferCreate(
+            from_account_id=account1.id, to_account_id=account2.id, amount=Decimal('10.00'),
+            frequency="daily", start_at=start, end_at=start + timedelta(days=1)))
+        unfunded = recurring_transfer_crud.create_recurring_transfer(session, RecurringTransferCreate(
+            from_account_id=account2.id, to_account_id=account1.id, amount=Decimal('500.00'),
+            frequency="monthly", start_at=start))
+
+        now = start + timedelta(hours=1)
+        recurring_transfer_crud.execute_recurring_transfers(session, batch_size=1000, now=now)
+
+        session.refresh(funded)
+        session.refresh(unfunded)
+        assert funded.next_run_at == start + timedelta(days=1)
+        assert funded.active
+        assert account_crud.get_account(session, account1.id).balance == Decimal('90.00')
+
+        assert unfunded.attempts == 1
+        assert unfunded.last_error == "Insufficient funds"
+        assert unfunded.next_run_at == now + recurring_transfer_crud.RETRY_BASE_DELAY
+
+        # The second run is the last one before end_at
+        recurring_transfer_crud.execute_recurring_transfers(session, batch_size=1000, now=start + timedelta(days=1))
+        session.refresh(funded)
+        assert not funded.active
+        assert account_crud.get_account(session, account1.id).balance == Decimal('80.00')
+
+
+def test_claimed_orders_are_skipped_by_other_workers(db_session):
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    with db_session() as session, db_session() as other_session:
+        account1, account2 = _accounts(session, Decimal('100.00'), Decimal('1.00'))
+        order = recurring_transfer_crud.create_recurring_transfer(session, RecurringTransferCreate(
+            from_account_id=account1.id, to_account_id=account2.id, amount=Decimal('1.00'),
+            frequency="weekly", start_at=start))
+
+        claimed = recurring_transfer_crud.claim_due_recurring_transfers(session, batch_size=1000, now=start)
+        assert order.id in {o.id for o in claimed}
+
+        other_claimed = recurring_transfer_crud.claim_due_recurring_transfers(other_session, batch_size=1000, now=start)
+        assert order.id not in {o.id for o in other_claimed}
+        other_session.rollback()
+        session.rollback()
+
+
+def test_backdated_order_runs_once(db_session):
+    now = datetime(2025, 1, 1, 12, 0, tzinfo=timezone.utc)
+    start = now - timedelta(days=365, hours=3)
+    with db_session() as session:
+        account1, account2 = _accounts(session, Decimal('1000.00'), Decimal('1.00'))
+        order = recurring_transfer_crud.create_recurring_transfer(session, RecurringTransferCreate(
+            from_account_id=account1.id, to_account_id=account2.id, amount=Decimal('1.00'),
+            frequency="daily", start_at=start))
+
+        recurring_transfer_crud.execute_recurring_transfers(session, batch_size=1000, now=now)
+        recurring_transfer_crud.execute_recurring_transfers(session, batch_size=1000, now=now)
+
+        # The missed occurrences are skipped, the order moves on to its first run after now
+        session.refresh(order)
+        assert account_crud.get_account(session, account1.id).balance == Decimal('999.00')
+        assert order.next_run_at == start + timedelta(days=366)
+        assert order.run_count == 366
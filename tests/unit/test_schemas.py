@@ -1,5 +1,6 @@
 import pytest
-from uuid import UUID, uuid4
+from uuid import UUID, uuid1, uuid4
+from app.ids import uuid7
 from decimal import Decimal
 from pydantic import ValidationError
 from app.schemas.schemas import (
@@ -137,3 +138,27 @@ def test_transfer_schema():
             to_account_id=to_account_id,
             amount="not-a-decimal"
         )
+
+
+
+def test_amount_scale_follows_money_storage(monkeypatch):
+    from app import money
+    monkeypatch.setattr(money, "SCALE", 2)
+
+    transfer = TransferCreate(from_account_id=uuid4(), to_account_id=uuid4(), amount=Decimal('12.30'))
+    assert transfer.amount == Decimal('12.30')
+
+    with pytest.raises(ValidationError):
+        TransferCreate(from_account_id=uuid4(), to_account_id=uuid4(), amount=Decimal('12.305'))
+
+    with pytest.raises(ValidationError):
+        AccountCreate(customer_id=uuid4(), balance=Decimal('0.001'))
+
+
+
+def test_ids_accept_uuid4_and_uuid7():
+    transfer = TransferCreate(from_account_id=uuid4(), to_account_id=uuid7(), amount=Decimal('1.00'))
+    assert transfer.to_account_id.version == 7
+
+    with pytest.raises(ValidationError):
+        Customer(id=uuid1(), name="Jane Doe")
@@ -0,0 +1,18 @@
+from app import server
+
+
+def test_launcher_settings(monkeypatch):
+    calls = []
+    monkeypatch.setattr(server.uvicorn, "run", lambda app, **kwargs: calls.append((app, kwargs)))
+    monkeypatch.setenv("WEB_WORKERS", "3")
+    monkeypatch.setenv("WEB_KEEPALIVE", "15")
+
+    assert server.main(["--backlog", "4096", "--loop", "uvloop"]) == 0
+
+    app, kwargs = calls[0]
+    assert app == "app.main:app"
+    assert kwargs["workers"] == 3
+    assert kwargs["timeout_keep_alive"] == 15
+    assert kwargs["backlog"] == 4096
+    assert kwargs["loop"] == "uvloop"
+    assert kwargs["limit_max_requests"] is None
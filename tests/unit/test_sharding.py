@@ -0,0 +1,301 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import create_engine, event, func, select, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import database
+from app.crud import account as account_crud
+from app.crud import customer as customer_crud
+from app.crud import outbox as outbox_crud
+from app.crud import transfer as transfer_crud
+from app.ids import uuid7
+from app.jobs import outbox as outbox_job
+from app.jobs import rebalance
+from app.jobs.reconcile import check_conservation
+from app.migrations import prepare_database
+from app.models.models import Account, Customer, Transfer, TransferOutbox
+from app.schemas.schemas import AccountCreate, CustomerCreate, TransferCreate
+from app.sharding import SLOTS, ShardMap, parse_shard_urls, slot_of
+
+
+def test_shard_map_is_deterministic_and_even():
+    shard_map = ShardMap(["a", "b", "c", "d"])
+    again = ShardMap(["a", "b", "c", "d"])
+    assert all(shard_map.shard_for_slot(slot) == again.shard_for_slot(slot) for slot in range(SLOTS))
+    counts = shard_map.slot_counts()
+    assert sum(counts.values()) == SLOTS
+    assert all(0.6 * SLOTS / 4 < count < 1.4 * SLOTS / 4 for count in counts.values())
+
+
+def test_adding_a_shard_moves_only_its_share_of_slots():
+    before = ShardMap(["a", "b", "c"])
+    after = ShardMap(["a", "b", "c", "d"])
+    moves = before.moved_slots(after)
+    # Every moved slot goes to the new shard, and about a quarter of the slots move
+    assert {target for _, target in moves} == {"d"}
+    assert 0.15 * SLOTS < sum(moves.values()) < 0.35 * SLOTS
+    # Removing it again moves exactly the same slots back
+    assert sum(after.moved_slots(before).values()) == sum(moves.values())
+
+
+def test_single_shard_owns_everything():
+    shard_map = ShardMap(["only"])
+    assert shard_map.shard_for(uuid4()) == "only"
+    assert shard_map.slot_counts() == {"only": SLOTS}
+    with pytest.raises(ValueError):
+        ShardMap([])
+
+
+def test_parse_shard_urls():
+    assert parse_shard_urls("a=postgresql://x/a, b=postgresql://x/b") == {
+        "a": "postgresql://x/a", "b": "postgresql://x/b",
+    }
+    for value in ("postgresql://x/a", "a=", "a=x,a=y"):
+        with pytest.raises(ValueError):
+            parse_shard_urls(value)
+
+
+def test_uuid7_carries_slot():
+    customer_id = uuid7()
+    values = [uuid7(slot_of(customer_id)) for _ in range(1000)]
+    assert all(slot_of(value) == slot_of(customer_id) for value in values)
+    assert all(value.version == 7 for value in values)
+    assert values == sorted(values)
+    assert len(set(values)) == len(values)
+
+
+@pytest.fixture
+def shards(db_session, monkeypatch):
+    """
+    Two shards in databases of their own next to the test database.
+    """
+    url = make_url(database.SQLALCHEMY_DATABASE_URL)
+    names = {"a": f"{url.database}_shard_a", "b": f"{url.database}_shard_b"}
+    admin = create_engine(url, isolation_level="AUTOCOMMIT")
+    try:
+        with admin.connect() as conn:
+            for name in names.values():
+                conn.exec_driver_sql(f'DROP DATABASE IF EXISTS "{name}"')
+                conn.exec_driver_sql(f'CREATE DATABASE "{name}"')
+    except SQLAlchemyError as e:
+        admin.dispose()
+        pytest.skip(f"cannot create shard databases: {e}")
+
+    engines = {shard: create_engine(url.set(database=name)) for shard, name in names.items()}
+    for shard_engine in engines.values():
+        prepare_database(shard_engine)
+    monkeypatch.setattr(database, "engines", engines)
+    monkeypatch.setattr(database, "shard_map", ShardMap(engines))
+    monkeypatch.setattr(database, "DEFAULT_SHARD", "a")
+    yield engines
+
+    for shard_engine in engines.values():
+        shard_engine.dispose()
+    with admin.connect() as conn:
+        for name in names.values():
+            conn.exec_driver_sql(f'DROP DATABASE IF EXISTS "{name}"')
+    admin.dispose()
+
+
+def _customer_on(shard):
+    with database.SessionLocal() as db:
+        while True:
+            customer = customer_crud.create_customer(db, CustomerCreate(name="Shard Owner"))
+            if database.shard_map.shard_for(customer.id) == shard:
+                return customer.id
+
+
+def _account(customer_id, balance):
+    with database.SessionLocal() as db:
+        return account_crud.create_account(db, AccountCreate(customer_id=customer_id, balance=balance)).id
+
+
+def _balance(account_id):
+    with database.SessionLocal() as db:
+        return account_crud.get_account(db, account_id).balance
+
+
+def _transfer(from_id, to_id, amount):
+    with database.SessionLocal() as db:
+        return transfer_crud.create_transfer(
+            db, TransferCreate(from_account_id=from_id, to_account_id=to_id, amount=amount)).id
+
+
+def _count(shard, model, *conditions):
+    with database.engines[shard].connect() as conn:
+        return conn.execute(select(func.count()).select_from(model).where(*conditions)).scalar()
+
+
+def _conserved(shard):
+    with database.engines[shard].connect() as conn:
+        return check_conservation(conn, cross_shard=True)["conserved"]
+
+
+def test_transfers_within_and_across_shards(shards):
+    owner_a, owner_b = _customer_on("a"), _customer_on("b")
+    a1, a2 = _account(owner_a, Decimal("100.00")), _account(owner_a, Decimal("1.00"))
+    b1 = _account(owner_b, Decimal("1.00"))
+    assert database.shard_map.shard_for(a1) == "a" and database.shard_map.shard_for(b1) == "b"
+
+    same = _transfer(a1, a2, Decimal("30.00"))
+    assert _count("a", Transfer, Transfer.id == same) == 1
+    assert _count("a", TransferOutbox) == 0
+
+    across = _transfer(a1, b1, Decimal("20.00"))
+    assert (_balance(a1), _balance(a2), _balance(b1)) == (Decimal("50.00"), Decimal("31.00"), Decimal("21.00"))
+    # The debit and the credit are stored under the same ID, one on each shard
+    assert _count("a", Transfer, Transfer.id == across) == 1
+    assert _count("b", Transfer, Transfer.id == across) == 1
+    assert _count("a", TransferOutbox, TransferOutbox.delivered_at.is_(None)) == 0
+    # Delivering again applies nothing
+    assert outbox_crud.deliver_transfer("a", across) is False
+    assert _balance(b1) == Decimal("21.00")
+
+    back = _transfer(b1, a2, Decimal("5.00"))
+    assert _count("b", Transfer, Transfer.id == back) == 1
+    assert (_balance(a2), _balance(b1)) == (Decimal("36.00"), Decimal("16.00"))
+    with database.SessionLocal() as db:
+        assert {t.id for t in transfer_crud.get_account_transfers(db, b1)} == {across, back}
+        assert transfer_crud.get_transfer(db, back).amount == Decimal("5.00")
+    assert _conserved("a") and _conserved("b")
+
+
+def test_switching_shards_never_ends_a_transaction_that_wrote(shards):
+    owner_a = _customer_on("a")
+    a1 = _account(owner_a, Decimal("100.00"))
+    with database.SessionLocal(shard="a") as db:
+        # A transaction that only read is rolled back
+        assert db.get(Account, a1).balance == Decimal("100.00")
+        db.use_shard("b")
+        assert db.shard == "b" and not db.in_transaction()
+
+        db.use_shard("a")
+        db.get(Account, a1).balance += Decimal("5.00")
+        with pytest.raises(RuntimeError):
+            db.use_shard("b")
+        db.flush()
+        with pytest.raises(RuntimeError):
+            db.use_shard("b")
+        db.rollback()
+
+        db.execute(update(Account).where(Account.id == a1).values(balance=Decimal("1.00")))
+        with pytest.raises(RuntimeError):
+            db.use_shard("b")
+        assert db.shard == "a"
+        db.rollback()
+    assert _balance(a1) == Decimal("100.00")
+
+
+def test_outbox_relay_delivers_failed_credits(shards, monkeypatch):
+    owner_a, owner_b = _customer_on("a"), _customer_on("b")
+    a1, b1 = _account(owner_a, Decimal("100.00")), _account(owner_b, Decimal("1.00"))
+    deliver = outbox_crud.deliver_transfer
+
+    def unreachable(shard, transfer_id):
+        raise ConnectionError("shard b is unreachable")
+
+    monkeypatch.setattr(outbox_crud, "deliver_transfer", unreachable)
+    transfer_id = _transfer(a1, b1, Decimal("40.00"))
+    assert (_balance(a1), _balance(b1)) == (Decimal("60.00"), Decimal("1.00"))
+    with database.SessionLocal(shard="a") as db:
+        assert outbox_crud.get_outbox_backlog(db)["undelivered"] == 1
+    assert _conserved("a") and _conserved("b")
+
+    monkeypatch.setattr(outbox_job, "deliver_transfer", unreachable)
+    assert outbox_job.run_relay(once=True) == {"delivered": 0, "failed": 1}
+    with database.SessionLocal(shard="a") as db:
+        entry = db.get(TransferOutbox, transfer_id)
+        assert (entry.attempts, entry.last_error) == (1, "shard b is unreachable")
+        assert entry.next_attempt_at > datetime.now(timezone.utc)
+        entry.next_attempt_at = datetime.now(timezone.utc)
+        db.commit()
+
+    monkeypatch.setattr(outbox_job, "deliver_transfer", deliver)
+    assert outbox_job.run_relay(once=True) == {"delivered": 1, "failed": 0}
+    assert _balance(b1) == Decimal("41.00")
+    with database.SessionLocal(shard="a") as db:
+        assert outbox_crud.get_outbox_backlog(db) == {"undelivered": 0, "oldest": None}
+    assert _conserved("a") and _conserved("b")
+
+
+def test_rebalance_drains_a_retired_shard(shards, monkeypatch):
+    owner_a, owner_b = _customer_on("a"), _customer_on("b")
+    a1, b1, b2 = (_account(owner_a, Decimal("100.00")), _account(owner_b, Decimal("50.00")),
+                  _account(owner_b, Decimal("1.00")))
+    to_b = _transfer(a1, b1, Decimal("10.00"))
+    within_b = _transfer(b1, b2, Decimal("5.00"))
+    to_a = _transfer(b2, a1, Decimal("1.00"))
+
+    # Retire shard b: every slot now belongs to shard a
+    misplaced = _count("b", Customer)
+    monkeypatch.setattr(database, "shard_map", ShardMap(["a"]))
+    assert rebalance.run(dry_run=True) == {"b -> a": misplaced}
+    assert rebalance.run() == {"moved": misplaced, "skipped": 0, "failed": 0}
+    assert rebalance.plan() == {}
+
+    assert _count("b", Customer) == _count("b", Account) == _count("b", Transfer) == 0
+    assert _count("a", Customer, Customer.id == owner_b) == 1
+    for transfer_id in (to_b, within_b, to_a):
+        assert _count("a", Transfer, Transfer.id == transfer_id) == 1
+    assert (_balance(a1), _balance(b1), _balance(b2)) == (Decimal("91.00"), Decimal("55.00"), Decimal("5.00"))
+    assert _conserved("a")
+    with database.engines["a"].connect() as conn:
+        assert check_conservation(conn)["conserved"]
+
+    # Transfers keep working on the new shard
+    _transfer(b1, a1, Decimal("5.00"))
+    assert (_balance(a1), _balance(b1)) == (Decimal("96.00"), Decimal("50.00"))
+
+
+def test_rebalance_recovers_from_a_failed_source_commit(shards, monkeypatch):
+    owner_a, owner_b = _customer_on("a"), _customer_on("b")
+    a1, b1 = _account(owner_a, Decimal("100.00")), _account(owner_b, Decimal("1.00"))
+    _transfer(a1, b1, Decimal("10.00"))
+    monkeypatch.setattr(database, "shard_map", ShardMap(["a"]))
+
+    def fail(conn):
+        conn.invalidate()
+        raise ConnectionError("shard b went away")
+
+    # The copy commits on shard a, then the delete fails on shard b: the customer is on both
+    event.listen(shards["b"], "commit", fail)
+    try:
+        with pytest.raises(ConnectionError):
+            rebalance.move_customer(owner_b, "b", "a")
+    finally:
+        event.remove(shards["b"], "commit", fail)
+    assert _count("a", Account, Account.id == b1) == _count("b", Account, Account.id == b1) == 1
+
+    # Shard a owns the slot, so transfers go to its copy from now on
+    _transfer(a1, b1, Decimal("5.00"))
+    assert _balance(b1) == Decimal("16.00")
+
+    # Moving again deletes the stale source rows and keeps the live ones
+    assert rebalance.run()["failed"] == 0
+    assert _count("b", Account, Account.id == b1) == 0
+    assert (_balance(a1), _balance(b1)) == (Decimal("85.00"), Decimal("16.00"))
+    assert _conserved("a")
+
+
+def test_rebalance_skips_customers_with_transfers_in_flight(shards, monkeypatch):
+    owner_a, owner_b = _customer_on("a"), _customer_on("b")
+    a1, b1 = _account(owner_a, Decimal("100.00")), _account(owner_b, Decimal("1.00"))
+    monkeypatch.setattr(outbox_crud, "deliver_transfer", lambda shard, transfer_id: None)
+    transfer_id = _transfer(a1, b1, Decimal("10.00"))
+
+    misplaced = _count("b", Customer)
+    monkeypatch.setattr(database, "shard_map", ShardMap(["a"]))
+    assert rebalance.run() == {"moved": misplaced - 1, "skipped": 1, "failed": 0}
+    assert _count("b", Account, Account.id == b1) == 1
+
+    with database.engines["a"].begin() as conn:
+        conn.execute(update(TransferOutbox).where(TransferOutbox.transfer_id == transfer_id)
+                     .values(next_attempt_at=datetime.now(timezone.utc)))
+    monkeypatch.setattr(outbox_crud, "deliver_transfer", outbox_job.deliver_transfer)
+    assert outbox_job.run_relay(once=True)["delivered"] == 1
+    assert rebalance.run()["moved"] == 1
+    assert _balance(b1) == Decimal("11.00")
@@ -0,0 +1,109 @@
+from decimal import Decimal
+from uuid import UUID
+import pytest
+from sqlalchemy import create_engine, select, text, update
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import sessionmaker
+from app.database import SQLALCHEMY_DATABASE_URL
+from app.models.models import Account
+from app.schemas.schemas import CustomerCreate, AccountCreate
+from app.crud import customer as customer_crud
+from app.crud import account as account_crud
+from app.slow_queries import SlowQueryLog, read_only, redact_parameters
+
+
+def test_redact_parameters():
+    account_id = UUID("0190a5a8-0000-7000-8000-000000000000")
+    redacted = redact_parameters({"id": account_id, "amount": Decimal("1.50"), "name": "Jane Doe", "ids": [1, "x"]})
+    assert redacted == {"id": account_id, "amount": Decimal("1.50"), "name": "<redacted str>",
+                        "ids": [1, "<redacted str>"]}
+
+
+def test_read_only():
+    assert read_only("SELECT accounts.id, coalesce(sum(transfers.amount), 0) FROM accounts JOIN transfers ON true")
+    assert read_only("  select count(*) from (select 1) as anon_1 where id in (%(id_1)s)")
+    assert not read_only("SELECT accounts.id FROM accounts WHERE accounts.id = %(id_1)s FOR UPDATE")
+    assert not read_only("SELECT accounts.id FROM accounts FOR NO KEY UPDATE SKIP LOCKED")
+    assert not read_only("SELECT pg_advisory_lock(%(key)s)")
+    assert not read_only("SELECT nextval('transfer_seq')")
+    assert not read_only("SELECT pg_catalog.setval('transfer_seq', 1)")
+    assert not read_only("UPDATE accounts SET balance=(accounts.balance + %(balance_1)s)")
+    assert not read_only("WITH moved AS (DELETE FROM transfers RETURNING *) SELECT count(*) FROM moved")
+
+
+def test_slow_query_log_records_caller_and_plan(db_session):
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    log = SlowQueryLog(threshold_ms=0.000001, explain_rate=1.0, size=10)
+    log.install(engine)
+    try:
+        with sessionmaker(bind=engine)() as session:
+            customer = customer_crud.create_customer(session, CustomerCreate(name="Jane Doe"))
+            account = account_crud.create_account(session, AccountCreate(customer_id=customer.id, balance=Decimal('10.00')))
+            log.clear()
+
+            assert account_crud.get_account(session, account.id).balance == Decimal('10.00')
+            entry = log.entries()[0]
+            assert entry["caller"] == "app.crud.account.get_account"
+            assert entry["route"] is None
+            assert entry["analyzed"]
+            assert "actual time" in entry["plan"] and "Buffers" in entry["plan"]
+            assert account.id in entry["parameters"].values()
+
+            # Data-modifying statements are explained without being executed again
+            session.execute(update(Account).where(Account.id == account.id).values(balance=Account.balance + Decimal('1.00')))
+            entry = log.entries()[0]
+            assert not entry["analyzed"]
+            assert "Update on accounts" in entry["plan"] and "actual time" not in entry["plan"]
+            session.commit()
+            assert session.execute(select(Account.balance).where(Account.id == account.id)).scalar() == Decimal('11.00')
+            assert len(log.entries(limit=2)) == 2
+    finally:
+        log.uninstall(engine)
+        engine.dispose()
+
+
+def test_slow_query_log_threshold(db_session):
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    log = SlowQueryLog(threshold_ms=60000, explain_rate=1.0)
+    log.install(engine)
+    try:
+        with engine.connect() as conn:
+            conn.execute(select(1))
+        assert log.entries() == []
+    finally:
+        log.uninstall(engine)
+        engine.dispose()
+
+
+def test_slow_query_log_does_not_run_side_effects_twice(db_session):
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    log = SlowQueryLog(threshold_ms=0.000001, explain_rate=1.0)
+    log.install(engine)
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": 424242})
+            entry = log.entries()[0]
+            assert not entry["analyzed"] and "actual time" not in entry["plan"]
+            # One unlock releases the lock, so it was taken only once
+            assert conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": 424242}).scalar()
+            with engine.connect() as other:
+                held = other.execute(text("SELECT count(*) FROM pg_locks WHERE locktype = 'advisory'")).scalar()
+            assert held == 0
+            conn.rollback()
+    finally:
+        log.uninstall(engine)
+        engine.dispose()
+
+
+def test_slow_query_log_forgets_failed_statements(db_session):
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    log = SlowQueryLog(threshold_ms=60000, explain_rate=1.0)
+    log.install(engine)
+    try:
+        with engine.connect() as conn:
+            with pytest.raises(DBAPIError):
+                conn.execute(text("SELECT 1 / 0"))
+            assert conn.info["slow_query_started"] == {}
+    finally:
+        log.uninstall(engine)
+        engine.dispose()
@@ -0,0 +1,120 @@
+from decimal import Decimal
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import update
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm.exc import StaleDataError
+from app.models.models import Account
+from app.schemas.schemas import CustomerCreate, AccountCreate
+from app.crud import customer as customer_crud
+from app.crud import account as account_crud
+from app.crud import unit_of_work
+from app.crud.unit_of_work import run_in_transaction
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(unit_of_work, "backoff_delay", lambda attempt: 0)
+    unit_of_work.metrics.reset()
+
+
+def _account(session):
+    customer = customer_crud.create_customer(session, CustomerCreate(name="Retry Owner"))
+    return account_crud.create_account(session, AccountCreate(customer_id=customer.id, balance=Decimal('100.00'))).id
+
+
+def _conflicting_work(other_session, account_id, conflicts):
+    def work(db):
+        # Read the account in this transaction's snapshot, then let a concurrent transaction
+        # change it before this one writes
+        account = account_crud.get_account(db, account_id)
+        if conflicts[0] > 0:
+            conflicts[0] -= 1
+            account_crud.update_account_balance(other_session, account_id, Decimal('1.00'))
+        account.balance += Decimal('5.00')
+        return account
+    return work
+
+
+def test_serialization_failure_is_retried(db_session, no_backoff):
+    with db_session() as session, db_session() as other_session:
+        account_id = _account(session)
+
+        account = run_in_transaction(session, _conflicting_work(other_session, account_id, [1]), operation="test")
+
+        assert account.balance == Decimal('106.00')
+        assert unit_of_work.metrics.snapshot()["test"] == {"attempts": 2, "retries": 1, "serialization_failure": 1}
+
+
+def test_retries_are_bounded(db_session, no_backoff):
+    with db_session() as session, db_session() as other_session:
+        account_id = _account(session)
+
+        with pytest.raises(DBAPIError) as excinfo:
+            run_in_transaction(session, _conflicting_work(other_session, account_id, [3]), operation="test", attempts=3)
+
+        assert unit_of_work.retryable_error(excinfo.value) == "serialization_failure"
+        assert unit_of_work.metrics.snapshot()["test"] == {
+            "attempts": 3, "retries": 2, "serialization_failure": 2, "exhausted": 1}
+        assert account_crud.get_account(session, account_id).balance == Decimal('103.00')
+
+
+def test_other_errors_are_not_retried(db_session, no_backoff):
+    with db_session() as session:
+        account_id = _account(session)
+
+        def work(db):
+            account_crud.get_account(db, account_id).balance += Decimal('5.00')
+            raise HTTPException(status_code=400, detail="Rejected")
+
+        with pytest.raises(HTTPException):
+            run_in_transaction(session, work, operation="test")
+
+        assert unit_of_work.metrics.snapshot()["test"] == {"attempts": 1}
+        assert account_crud.get_account(session, account_id).balance == Decimal('100.00')
+
+
+def test_stale_data_is_retried(db_session, no_backoff):
+    with db_session() as session:
+        account_id = _account(session)
+        stale = [1]
+
+        def work(db):
+            account = account_crud.get_account(db, account_id)
+            account.balance += Decimal('5.00')
+            if stale[0] > 0:
+                stale[0] -= 1
+                raise StaleDataError("UPDATE statement on table 'accounts' expected to update 1 row(s); 0 were matched.")
+            return account
+
+        assert run_in_transaction(session, work, operation="test").balance == Decimal('105.00')
+        assert unit_of_work.metrics.snapshot()["test"] == {"attempts": 2, "retries": 1, "stale_data": 1}
+
+
+def test_uncommitted_changes_are_not_committed(db_session, no_backoff):
+    with db_session() as session:
+        account_id = _account(session)
+        account_crud.get_account(session, account_id).balance += Decimal('7.00')
+
+        with pytest.raises(RuntimeError):
+            run_in_transaction(session, lambda db: account_crud.get_account(db, account_id), operation="test")
+        session.rollback()
+        assert account_crud.get_account(session, account_id).balance == Decimal('100.00')
+
+        # Including changes that were already flushed or made with Core statements
+        session.execute(update(Account).where(Account.id == account_id).values(balance=Decimal('50.00')))
+        with pytest.raises(RuntimeError):
+            run_in_transaction(session, lambda db: account_crud.get_account(db, account_id), operation="test")
+        session.rollback()
+
+        # A transaction that only read is ended and the work runs
+        account_crud.get_account(session, account_id)
+        assert session.in_transaction()
+        account = run_in_transaction(session, lambda db: account_crud.update_account_balance(
+            db, account_id, Decimal('1.00'), commit=False), operation="test")
+        assert account.balance == Decimal('101.00')
+
+
+def test_backoff_delay_is_bounded():
+    for attempt in range(1, 20):
+        assert 0 <= unit_of_work.backoff_delay(attempt) <= unit_of_work.WRITE_RETRY_MAX_DELAY
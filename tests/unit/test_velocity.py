@@ -0,0 +1,116 @@
+import time
+import pytest
+from datetime import datetime, timezone
+from decimal import Decimal
+from uuid import uuid4
+from fastapi import HTTPException
+from app import velocity
+from app.velocity import LocalVelocityBackend, VelocityLimit, VelocityLimiter, parse_limits
+from app.schemas.schemas import CustomerCreate, AccountCreate, TransferCreate
+from app.crud import customer as customer_crud
+from app.crud import account as account_crud
+from app.crud import transfer as transfer_crud
+from app.database import SessionLocal
+
+MINUTE = VelocityLimit(window_seconds=60, max_amount=Decimal('100'), max_count=3)
+
+
+def test_parse_limits():
+    assert parse_limits("60::20, 86400:50000:") == [
+        VelocityLimit(60, None, 20),
+        VelocityLimit(86400, Decimal('50000'), None),
+    ]
+    with pytest.raises(ValueError):
+        parse_limits("60::")
+
+
+def test_sliding_window():
+    backend = LocalVelocityBackend([MINUTE], buckets=60)
+    account = uuid4()
+    for second in range(3):
+        assert backend.reserve(account, Decimal('10'), now=1000.0 + second) is None
+        backend.confirm(account, Decimal('10'), now=1000.0 + second)
+
+    assert backend.reserve(account, Decimal('10'), now=1030.0) == MINUTE  # Fourth transfer in a minute
+    assert backend.reserve(account, Decimal('10'), now=1059.5) == MINUTE  # All three still inside the window
+    assert backend.reserve(account, Decimal('10'), now=1060.5) is None    # The first one has expired
+
+
+def test_window_not_a_multiple_of_the_buckets():
+    limit = VelocityLimit(window_seconds=90, max_amount=None, max_count=2)
+    backend = LocalVelocityBackend([limit], buckets=60)
+    account = uuid4()
+    for second in range(2):
+        assert backend.reserve(account, Decimal('1'), now=1000.0 + second) is None
+        backend.confirm(account, Decimal('1'), now=1000.0 + second)
+
+    assert backend.reserve(account, Decimal('1'), now=1061.0) == limit  # Both still inside the 90s
+    assert backend.reserve(account, Decimal('1'), now=1089.5) == limit
+    assert backend.reserve(account, Decimal('1'), now=1090.5) is None
+
+    # 1000s in buckets of 16s take one more bucket for the remainder
+    assert velocity.ring_size(VelocityLimit(1000, None, 1), 60) == 63
+
+
+def test_window_shorter_than_the_buckets():
+    limit = VelocityLimit(window_seconds=30, max_amount=None, max_count=1)
+    backend = LocalVelocityBackend([limit], buckets=60)
+    account = uuid4()
+    assert backend.reserve(account, Decimal('1'), now=1000.0) is None
+    backend.confirm(account, Decimal('1'), now=1000.0)
+
+    assert backend.reserve(account, Decimal('1'), now=1029.5) == limit
+    assert backend.reserve(account, Decimal('1'), now=1030.5) is None  # Not stretched to 60s
+
+
+def test_pending_reservations_count_and_release():
+    backend = LocalVelocityBackend([MINUTE], buckets=60)
+    account = uuid4()
+    assert backend.reserve(account, Decimal('60'), now=1000.0) is None
+    assert backend.reserve(account, Decimal('60'), now=1000.0) == MINUTE  # 60 pending + 60 > 100
+    backend.release(account, Decimal('60'))
+    assert backend.reserve(account, Decimal('60'), now=1000.0) is None
+
+
+def test_evicted_accounts_are_reloaded():
+    history = {}
+    backend = LocalVelocityBackend([MINUTE], buckets=60, max_accounts=2,
+                                   loader=lambda account_id, since: history.get(account_id, []))
+    first, *others = [uuid4() for _ in range(3)]
+    backend.reserve(first, Decimal('90'), now=1000.0)
+    backend.confirm(first, Decimal('90'), now=1000.0)
+    for account in others:
+        backend.reserve(account, Decimal('1'), now=1000.0)
+        backend.confirm(account, Decimal('1'), now=1000.0)
+    assert len(backend) == 2
+
+    history[first] = [(datetime.fromtimestamp(1000.0, timezone.utc), Decimal('90'))]
+    assert backend.reserve(first, Decimal('20'), now=1001.0) == MINUTE
+
+
+def test_create_transfer_enforces_velocity_limits(db_session, monkeypatch):
+    with db_session() as session:
+        customer = customer_crud.create_customer(session, CustomerCreate(name="Velocity Owner"))
+        account1 = account_crud.create_account(session, AccountCreate(customer_id=customer.id, balance=Decimal('1000.00')))
+        account2 = account_crud.create_account(session, AccountCreate(customer_id=customer.id, balance=Decimal('1.00')))
+        transfer_crud.create_transfer(session, TransferCreate(
+            from_account_id=account1.id, to_account_id=account2.id, amount=Decimal('70.00')))
+
+        limiter = VelocityLimiter([MINUTE], buckets=60, backend=LocalVelocityBackend([MINUTE], buckets=60))
+        monkeypatch.setattr(velocity, "limiter", limiter)
+        with SessionLocal() as db:
+            limiter.warm(db)
+
+        with pytest.raises(HTTPException) as exc_info:
+            transfer_crud.create_transfer(session, TransferCreate(
+                from_account_id=account1.id, to_account_id=account2.id, amount=Decimal('40.00')))
+        assert exc_info.value.status_code == 429
+
+        transfer_crud.create_transfer(session, TransferCreate(
+            from_account_id=account1.id, to_account_id=account2.id, amount=Decimal('30.00')))
+
+        # A failed transfer gives its reservation back
+        with pytest.raises(HTTPException):
+            transfer_crud.create_transfer(session, TransferCreate(
+                from_account_id=account2.id, to_account_id=account1.id, amount=Decimal('5000.00')))
+        assert limiter.backend.reserve(account2.id, Decimal('100'), now=time.time()) is None